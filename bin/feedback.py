@@ -107,7 +107,7 @@ class ThetaLowerTask(FeedbackTask):
 
 	def frame(self, p,window):
 		flen = 50
-		spectrum, relative_spectrum = bin_power(p.raw_values[-p.buffer_len:], range(flen),512)
+		spectrum, relative_spectrum = bin_power(p.raw_ring.latest(p.raw_buffer_len), range(flen),512)
 		self.spectra.append(array(relative_spectrum))
 		if len(self.spectra)>30:
 			self.spectra.pop(0)
@@ -131,7 +131,7 @@ class ThetaIncreaseTask(FeedbackTask):
 	def frame(self, p,window):
 		FeedbackTask.frame(self,p,window)
 		flen = 50
-		spectrum, relative_spectrum = bin_power(p.raw_values[-p.buffer_len:], range(flen),512)
+		spectrum, relative_spectrum = bin_power(p.raw_ring.latest(p.raw_buffer_len), range(flen),512)
 		self.spectra.append(array(relative_spectrum))
 		if len(self.spectra)>10:
 			self.spectra.pop(0)
@@ -163,7 +163,7 @@ def feedback_menu(window,p):
 		for img in task_images:
 			window.blit(img, (400,y))
 			y+= img.get_height()
-		p.update()
+		p.update_all()
 		pygame.display.update()
 		for event in pygame.event.get():
 			if event.type==QUIT:
@@ -183,7 +183,7 @@ def start_session(Task):
 	task = Task()
 	while not quit:
 		window.fill(pygame.Color(0,0,0))
-		p.update()
+		p.update_all()
 		for event in pygame.event.get():
 			if event.type==QUIT:
 				pygame.quit()
@@ -26,12 +26,17 @@ if __name__ == "__main__":
     if hs.get_state() != 'connected':
         hs.disconnect()
 
-    while hs.get_state() != 'connected':
-        time.sleep(1)
-        print 'current state: {0}'.format(hs.get_state())
-        if (hs.get_state() == 'standby'):
-            print 'trying to connect...'
-            hs.connect()
+    # the headset reconnects by itself whenever the link drops
+    hs.subscribe_connection(
+        lambda event: sys.stdout.write('{0} ({1}, {2:.2f}s)\n'.format(
+            event.state, event.cause, event.duration)))
+    print 'trying to connect...'
+    if not hs.connect(timeout=30) and hs.get_state() != 'connected':
+        print 'no headset connected within 30s (dongle state: {0}), ' \
+            'is it switched on and paired?'.format(hs.get_state())
+        hs.disconnect()
+        hs.destroy()
+        sys.exit(1)
 
     print 'now connected!'
     while True:
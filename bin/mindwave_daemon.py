@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""Share one dongle with several programs through a Unix socket.
+
+Usage: mindwave_daemon.py [serial device] [socket path]
+
+Then start the other tools with the socket path as their serial device.
+"""
+
+import sys
+from pymindwave import fanout
+
+
+if __name__ == "__main__":
+    dev = sys.argv[1] if len(sys.argv) > 1 else '/dev/ttyUSB0'
+    path = sys.argv[2] if len(sys.argv) > 2 else '/tmp/mindwave.sock'
+    daemon = fanout.FanoutDaemon(path, dev)
+    print 'serving {0} on {1}'.format(dev, path)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+        daemon.headset.destroy()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""Stream a headset to TCP clients, like the ThinkGear Connector (Python 3).
+
+Usage: mindwave_server.py [serial device] [port]
+"""
+
+import asyncio
+import sys
+
+from pymindwave.async_headset import AsyncHeadset
+from pymindwave.server import StreamServer
+
+
+if __name__ == "__main__":
+    dev = sys.argv[1] if len(sys.argv) > 1 else '/dev/ttyUSB0'
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 13854
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    headset = AsyncHeadset(dev, loop=loop)
+    stream_server = StreamServer(headset.parser)
+    loop.run_until_complete(stream_server.start(port=port, loop=loop))
+    loop.run_until_complete(headset.connect())
+    print('streaming {0} on port {1}'.format(dev, port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        headset.close()
+        loop.close()
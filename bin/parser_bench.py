@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""Parser throughput benchmark on synthetic dongle streams.
+
+Usage: parser_bench.py [seconds of stream] [repeats]
+
+For every parser backend prints frames/s, raw samples/s, allocations per
+frame and how many raw samples are lost resynchronising after a dropout
+that cuts a packet short. Allocations are the gc-tracked objects still alive per frame
+when the decoded output is kept and, where the interpreter has tracemalloc,
+the peak traced bytes per frame.
+"""
+
+import gc
+import sys
+import time
+import StringIO
+import numpy as np
+from pymindwave import bulk
+from pymindwave import parser
+from pymindwave import synthetic
+from pymindwave import transport
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def run_update(data, keep=None):
+    "Drain mode over a file-like object, as DongleReader does"
+    stream = StringIO.StringIO(data)
+    p = parser.VirtualParser(stream, reader=transport.StreamReader(stream))
+    if keep is not None:
+        p.subscribe(parser.FRAME_TYPES.keys(), keep.extend)
+    while p.update_all() or p.reader.bytes_read < len(data):
+        pass
+    return p.stats.frames, p.raw_ring.count
+
+
+def run_update_single(data, keep=None):
+    "One update() per frame, the original polling loop"
+    stream = StringIO.StringIO(data)
+    p = parser.VirtualParser(stream, reader=transport.StreamReader(stream))
+    if keep is not None:
+        p.subscribe(parser.FRAME_TYPES.keys(), keep.extend)
+    while p.update():
+        pass
+    return p.stats.frames, p.raw_ring.count
+
+
+def run_feed(data, keep=None, chunk_size=1000):
+    "Push-style feed() in chunks"
+    p = parser.VirtualParser()
+    for i in range(0, len(data), chunk_size):
+        frames = p.feed(data[i:i + chunk_size])
+        if keep is not None:
+            keep.extend(frames)
+    return p.stats.frames, p.raw_ring.count
+
+
+def run_bulk(data, keep=None):
+    "Vectorized decoder on the whole buffer"
+    decoded = bulk.decode_buffer(data)
+    if keep is not None:
+        keep.append(decoded)
+    return len(decoded.frames), len(decoded.raw)
+
+
+BACKENDS = [
+    ('update', run_update),
+    ('update(1)', run_update_single),
+    ('feed', run_feed),
+    ('bulk', run_bulk),
+]
+
+
+def throughput(run, data, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        frames, samples = run(data)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return frames / best, samples / best
+
+
+def allocations(run, data):
+    keep = []
+    gc.collect()
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        if tracemalloc is not None:
+            tracemalloc.start()
+        frames, _ = run(data, keep)
+        peak = None
+        if tracemalloc is not None:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        objects = len(gc.get_objects()) - before
+    finally:
+        gc.enable()
+    per_frame = float(max(frames, 1))
+    return objects / per_frame, peak and peak / per_frame
+
+
+def resync_loss(run, trials=20, burst=16):
+    """Raw samples lost after an eSense packet cut short by a dropout.
+
+    The parser takes the bytes after the cut (up to ``burst`` bytes of line
+    noise, which may contain 0xaa, then the following packets) as the rest
+    of the cut packet and has to find the sync again.
+    """
+    lost = []
+    for seed in range(trials):
+        gen = synthetic.StreamGenerator(seed=seed)
+        before = gen.generate(1.0)
+        cut = synthetic.make_frame(gen.esense_payload())
+        truncated = cut[:gen.random.randint(3, len(cut) - 1)]
+        noise = gen.random.randint(0, 256, gen.random.randint(0, burst + 1))
+        noise = noise.astype(np.uint8).tobytes()
+        after = gen.generate(1.0)
+        _, samples = run(before + truncated + noise + after)
+        lost.append(gen.counts['raw_samples'] - samples)
+    return np.mean(lost), max(lost)
+
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 60.0
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    gen = synthetic.StreamGenerator(noise=0.001, corrupt=0.001, seed=0)
+    data = gen.state(0xd4) + gen.state(0xd0) + gen.generate(seconds)
+    print '{0:.0f} s of stream: {1} bytes, {2} frames, {3} raw samples'.format(
+        seconds, len(data), gen.counts['frames'], gen.counts['raw_samples'])
+    rate = float(gen.sample_rate)
+    for name, run in BACKENDS:
+        frames_per_s, samples_per_s = throughput(run, data, repeats)
+        objects, peak = allocations(run, data)
+        mean_lost, max_lost = resync_loss(run)
+        print '{0}:'.format(name)
+        print '  {0:.0f} frames/s, {1:.0f} samples/s ({2:.0f}x real time)'.format(
+            frames_per_s, samples_per_s, samples_per_s / rate)
+        print '  {0:.2f} objects/frame, peak {1} bytes/frame'.format(
+            objects, 'n/a' if peak is None else '{0:.1f}'.format(peak))
+        print '  resync: {0:.1f} samples lost on average ({1:.1f} ms), ' \
+            'max {2}'.format(mean_lost, mean_lost / rate * 1000, max_lost)
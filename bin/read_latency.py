@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""Compare read latencies of the polling, select and coalescing reader
+backends.
+
+Usage: read_latency.py [serial device] [seconds per backend] [budget]
+
+``budget`` is the CoalescingReader latency budget in seconds (0.02). Also
+prints the chunk sizes read and the CPU time per second of EEG.
+"""
+
+import os
+import sys
+import time
+import serial
+from pymindwave import parser
+from pymindwave import transport
+
+
+def measure(dongle, reader, seconds):
+    p = parser.VirtualParser(dongle, reader=reader)
+    frames = 0
+    before = os.times()
+    end = time.time() + seconds
+    while time.time() < end:
+        frames += p.update_all()
+    after = os.times()
+    cpu = (after[0] - before[0]) + (after[1] - before[1])
+    return frames, p.read_latency(), cpu
+
+
+def print_histogram(name, snapshot, unit='s'):
+    print '  {0}: mean {1:.4f}{5} p50 <={2}{5} p99 <={3}{5} max {4:.4f}{5}'.format(
+        name, snapshot['mean'], snapshot['p50'], snapshot['p99'],
+        snapshot['max'], unit)
+
+
+if __name__ == "__main__":
+    dev = sys.argv[1] if len(sys.argv) > 1 else '/dev/ttyUSB0'
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    budget = float(sys.argv[3]) if len(sys.argv) > 3 else 0.02
+    dongle = serial.Serial(dev, 115200, timeout=0.001)
+    for name, reader in [('polling', transport.PollingReader(dongle)),
+                         ('select', transport.SelectReader(dongle)),
+                         ('coalescing',
+                          transport.CoalescingReader(dongle, budget))]:
+        dongle.reset_input_buffer()
+        frames, latency, cpu = measure(dongle, reader, seconds)
+        print '{0}: {1} frames, {2} reads, {3} bytes, {4:.1f} ms CPU/s'.format(
+            name, frames, latency['reads'], latency['bytes_read'],
+            cpu / seconds * 1e3)
+        print_histogram('interval', latency['interval'])
+        print_histogram('chunk age', latency['chunk_age'])
+        print_histogram('chunk size', latency['chunk_bytes'], ' bytes')
+    dongle.close()
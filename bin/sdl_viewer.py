@@ -39,15 +39,15 @@ attention_img = font.render("Attention", False, redColor)
 record_baseline = False
 
 while True:
-    p.update()
+    p.update_all()
     window.blit(background_img,(0,0))
     if p.sending_data:
         iteration+=1
 
         flen = 50
 
-        if len(p.raw_values)>=500:
-            spectrum, relative_spectrum = bin_power(p.raw_values[-p.buffer_len:], range(flen),512)
+        if p.raw_ring.count>=500:
+            spectrum, relative_spectrum = bin_power(p.raw_ring.latest(p.raw_buffer_len), range(flen),512)
             spectra.append(array(relative_spectrum))
             if len(spectra)>30:
                 spectra.pop(0)
@@ -88,7 +88,7 @@ while True:
 
         if raw_eeg:
             lv = 0
-            for i,value in enumerate(p.raw_values[-1000:]):
+            for i,value in enumerate(p.raw_ring.latest(p.raw_buffer_len)):
                 v = value/ 255.0/ 5
                 pygame.draw.line(window, redColor, (i+25, 500-lv), (i+25, 500-v))
                 lv = v
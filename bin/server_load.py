@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""Load test of the TCP streaming server on localhost (Python 3).
+
+Usage: server_load.py [seconds of stream] [client counts ...]
+
+For every client count, connects that many simulated clients (half JSON,
+half binary, all subscribed to raw) plus one client that never reads,
+streams synthetic headset data through the server as fast as it goes and
+prints the broadcast cost per client and message, which should stay
+roughly flat as clients are added, and whether the stalled client was
+disconnected by the server (the client itself does not notice, its
+reads are paused).
+"""
+
+import asyncio
+import json
+import socket
+import sys
+import time
+
+from pymindwave import parser
+from pymindwave import server
+from pymindwave.synthetic import StreamGenerator
+
+
+class LoadClient(asyncio.Protocol):
+    def __init__(self, fmt, stall=False):
+        self.fmt = fmt
+        self.stall = stall
+        self.received = 0
+        self.lost = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        command = {'subscribe': ['raw'], 'format': self.fmt}
+        transport.write((json.dumps(command) + '\n').encode('ascii'))
+        if self.stall:
+            transport.pause_reading()
+
+    def data_received(self, data):
+        self.received += len(data)
+
+    def connection_lost(self, exc):
+        self.lost = True
+
+
+def run(loop, n_clients, seconds):
+    p = parser.VirtualParser()
+    stream_server = server.StreamServer(p, raw_block=64,
+                                        max_buffer=16 * 1024,
+                                        high_water=4096,
+                                        sndbuf=4096)
+    listener = loop.run_until_complete(stream_server.start(port=0, loop=loop))
+    port = listener.sockets[0].getsockname()[1]
+    clients = []
+    for i in range(n_clients + 1):
+        # the stalled client takes JSON, the bulkier format, so it
+        # overflows the kernel buffers sooner
+        stall = i == n_clients
+        client = LoadClient('json' if i % 2 or stall else 'binary', stall)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if stall:
+            # the receive window is fixed at connect(), so shrink it first
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.connect(('127.0.0.1', port))
+        sock.setblocking(False)
+        loop.run_until_complete(loop.create_connection(
+            lambda: client, sock=sock))
+        clients.append(client)
+    # let the subscriptions arrive
+    loop.run_until_complete(asyncio.sleep(0.2))
+
+    gen = StreamGenerator(seed=0)
+    data = gen.state(0xd0) + gen.generate(seconds)
+    chunk = len(data) // int(seconds * 8)
+    busy = 0.0
+    for i in range(0, len(data), chunk):
+        start = time.time()
+        p.feed(data[i:i + chunk])
+        busy += time.time() - start
+        # give the clients a turn, as a real 512 Hz stream would
+        loop.run_until_complete(asyncio.sleep(0.005))
+    loop.run_until_complete(asyncio.sleep(0.5))
+
+    stats = stream_server.stats()
+    per_send = busy / max(stats['messages'] * n_clients, 1)
+    print('{0:4d} clients: {1:.2f} s busy for {2:.0f} s of data, '
+          '{3:.2f} us per client and message, stalled client {4}'.format(
+              n_clients, busy, seconds, per_send * 1e6,
+              'disconnected' if stats['stalled_disconnects'] else
+              'STILL CONNECTED'))
+    for client in clients:
+        if not client.lost:
+            client.transport.close()
+    listener.close()
+    loop.run_until_complete(listener.wait_closed())
+
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 60.0
+    counts = [int(n) for n in sys.argv[2:]] or [50, 100, 200, 400]
+    loop = asyncio.new_event_loop()
+    for n in counts:
+        run(loop, n, seconds)
+    loop.close()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""End-to-end load test on virtual dongles.
+
+Usage: virtual_load.py [seconds] [speed] [dongle counts ...]
+
+For every dongle count, starts that many virtual dongles (see
+pymindwave.simulator) in a child process, reads them once with a Headset
+and its reader thread per dongle and once with a single DongleManager,
+connects them all and streams for ``seconds``. ``speed`` multiplies the
+512 Hz sample rate. Prints per mode the delivered fraction of the samples
+sent, the delay of raw samples behind their schedule, anchored at the
+first sample of every headset (p50/p99/max), and the reading process's CPU
+time per headset and second. The dongles run in the child so that their
+CPU time is not counted.
+"""
+
+import multiprocessing
+import os
+import sys
+import time
+from pymindwave import headset
+from pymindwave import manager
+from pymindwave import simulator
+from pymindwave.stats import Histogram, clock
+
+
+def serve_dongles(n, speed, pipe):
+    dongles = simulator.spawn(n, speed=speed)
+    pipe.send([d.path for d in dongles])
+    # wait for the parent to finish, then report what was sent
+    pipe.recv()
+    pipe.send(sum(d.samples_sent for d in dongles))
+    pipe.recv()
+    for d in dongles:
+        d.stop()
+
+
+class Lag(object):
+    "Delay of raw samples behind a steady ``rate`` from the first one"
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.histogram = Histogram()
+        self.start = None
+        self.count = 0
+
+    def record(self, samples, times):
+        if self.start is None:
+            self.start = times[0]
+        now = clock()
+        # the last sample of the batch, delivered now
+        self.count += len(samples)
+        self.histogram.record(
+            max(now - self.start - (self.count - 1) / self.rate, 0))
+
+
+def run_headsets(paths, seconds, rate):
+    headsets = [headset.Headset(path) for path in paths]
+    lags = [Lag(rate) for _ in paths]
+    for h, lag in zip(headsets, lags):
+        h.parser.subscribe_raw(lag.record)
+        h.connect()
+    time.sleep(seconds)
+    for h in headsets:
+        h.disconnect()
+    time.sleep(0.2)
+    for h in headsets:
+        h.destroy()
+    return lags
+
+
+def run_manager(paths, seconds, rate):
+    m = manager.DongleManager()
+    lags = {}
+    for path in paths:
+        m.add(path)
+        lags[path] = Lag(rate)
+    m.subscribe_raw(lambda device_id, samples, times:
+                    lags[device_id].record(samples, times))
+    m.start()
+    m.connect()
+    time.sleep(seconds)
+    m.disconnect()
+    time.sleep(0.2)
+    m.destroy()
+    return list(lags.values())
+
+
+def run(mode, n, seconds, speed):
+    pipe, child_pipe = multiprocessing.Pipe()
+    child = multiprocessing.Process(target=serve_dongles,
+                                    args=(n, speed, child_pipe))
+    child.start()
+    paths = pipe.recv()
+    before = os.times()
+    lags = mode(paths, seconds, 512.0 * speed)
+    after = os.times()
+    pipe.send('sent?')
+    sent = pipe.recv()
+    pipe.send('stop')
+    child.join()
+
+    cpu = (after[0] - before[0]) + (after[1] - before[1])
+    received = sum(lag.count for lag in lags)
+    merged = Histogram()
+    for lag in lags:
+        merged.counts = [a + b for a, b in
+                         zip(merged.counts, lag.histogram.counts)]
+        merged.count += lag.histogram.count
+        merged.max = max(merged.max, lag.histogram.max)
+    print '{0:>8} {1:4d} dongles: {2:.1%} of {3} samples, ' \
+        'lag p50 {4:.1f} ms p99 {5:.1f} ms max {6:.1f} ms, ' \
+        '{7:.2f} ms CPU per headset and second'.format(
+            mode.__name__[4:], n, received / float(max(sent, 1)), sent,
+            min(merged.percentile(50), merged.max) * 1e3,
+            min(merged.percentile(99), merged.max) * 1e3,
+            merged.max * 1e3, cpu / n / seconds * 1e3)
+
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    counts = [int(n) for n in sys.argv[3:]] or [1, 8, 32]
+    for n in counts:
+        for mode in (run_headsets, run_manager):
+            run(mode, n, seconds, speed)
@@ -0,0 +1,266 @@
+"""
+Headset driven by an asyncio event loop instead of a reader thread.
+
+Headset starts a DongleReader thread per dongle and runs every callback on
+it. AsyncHeadset registers the serial port's file descriptor with the event
+loop instead: bytes are read when the loop reports the port readable and
+fed to a push-driven VirtualParser (see VirtualParser.feed), so any number
+of headsets share the loop's thread. Needs Python 3.5+::
+
+    headset = AsyncHeadset('/dev/ttyUSB0')
+    await headset.connect()
+    async with headset.raw_blocks(512) as blocks:
+        async for block in blocks:
+            ...
+
+A stream keeps queueing until it is closed, and leaving ``async for`` with
+break does not close it: use ``async with`` as above, or await
+``stream.aclose()``.
+
+The streams are plain objects implementing ``__aiter__``/``__anext__``, so
+this module stays importable on Python 2, where AsyncHeadset refuses to be
+created.
+"""
+from collections import deque
+
+import serial
+
+from pymindwave import parser
+from pymindwave.buffers import BlockBuilder
+from pymindwave.headset import COMMAND_BYTES, connect_command
+from pymindwave.stats import clock
+from pymindwave.transport import open_dongle, read_available
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+
+class _Stream(object):
+    """Async iterator over items pushed by the headset.
+
+    Holds at most ``maxlen`` items; when the consumer falls behind the
+    oldest items are dropped and counted in ``dropped``.
+    """
+
+    def __init__(self, headset, maxlen):
+        self.headset = headset
+        self.items = deque(maxlen=maxlen)
+        self.dropped = 0
+        self.closed = False
+        self.waiter = None
+
+    def __aiter__(self):
+        return self
+
+    def __aenter__(self):
+        return self._done(self)
+
+    def __aexit__(self, exc_type, exc, traceback):
+        self.close()
+        return self._done(None)
+
+    def aclose(self):
+        "Close the stream, see close(); returns an awaitable"
+        self.close()
+        return self._done(None)
+
+    def _done(self, result):
+        future = self.headset.loop.create_future()
+        future.set_result(result)
+        return future
+
+    def __anext__(self):
+        future = self.headset.loop.create_future()
+        if self.items:
+            future.set_result(self.items.popleft())
+        elif self.closed:
+            future.set_exception(StopAsyncIteration())
+        else:
+            self.waiter = future
+        return future
+
+    def push(self, item):
+        waiter = self.waiter
+        if waiter is not None and not waiter.done():
+            self.waiter = None
+            waiter.set_result(item)
+            return
+        if len(self.items) == self.items.maxlen:
+            self.dropped += 1
+        self.items.append(item)
+
+    def close(self):
+        """Unsubscribe, and stop the iteration once the queued items have
+        been consumed"""
+        if self.closed:
+            return
+        self.closed = True
+        self.headset._remove_stream(self)
+        waiter, self.waiter = self.waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_exception(StopAsyncIteration())
+
+
+class FrameStream(_Stream):
+    "Yields the decoded Frames of the subscribed frame types"
+
+    def push_batch(self, frames):
+        for frame in frames:
+            self.push(frame)
+
+
+class RawBlockStream(_Stream):
+    """Yields raw samples in blocks of exactly ``block_size`` samples.
+
+    A block is an int16 array, or a ``(samples, times)`` pair with the
+    sample timestamps when ``with_times`` is set.
+    """
+
+    def __init__(self, headset, maxlen, block_size, with_times):
+        super(RawBlockStream, self).__init__(headset, maxlen)
+        self.with_times = with_times
+        self.blocks = BlockBuilder(block_size, self.push_block)
+        self.push_samples = self.blocks.push
+
+    def push_block(self, samples, times):
+        if self.with_times:
+            self.push((samples, times))
+        else:
+            self.push(samples)
+
+
+class AsyncHeadset(object):
+    """Headset read through an asyncio event loop, see the module docstring.
+
+    ``queue_size`` bounds every stream returned by frames() and
+    raw_blocks(). The parser is available as ``parser`` for the usual
+    property access and for get_stats().
+    """
+
+    def __init__(self, dongle_dev, global_id=None, loop=None,
+                 queue_size=1024):
+        if asyncio is None:
+            raise RuntimeError('AsyncHeadset needs asyncio (Python 3.5+)')
+        self.loop = loop or asyncio.get_event_loop()
+        self.global_id = global_id
+        self.auto_connect = not global_id
+        self.queue_size = queue_size
+        self.dongle_dev = dongle_dev
+        self.dongle_fs = self._open(dongle_dev)
+        self.parser = parser.VirtualParser()
+        self.parser.subscribe('state', self._on_state)
+        self.streams = []
+        # (target states, future) pairs of pending connect()/disconnect()
+        self.state_waiters = []
+        self.fd = self.dongle_fs.fileno()
+        self.loop.add_reader(self.fd, self._on_readable)
+
+    def _open(self, dongle_dev):
+        "Open the byte stream of the dongle, see transport.open_dongle"
+        return open_dongle(dongle_dev, timeout=0)
+
+    def _on_readable(self):
+        arrival = clock()
+        try:
+            data = read_available(self.dongle_fs, self.fd)
+        except (IOError, OSError, serial.SerialException) as e:
+            self._fail(e)
+            return
+        if data:
+            self.parser.feed(data, arrival)
+        else:
+            # readable but empty: the other end is gone
+            self._fail(EOFError('dongle stream closed'))
+
+    def _on_state(self, frames):
+        for frame in frames:
+            for states, future in list(self.state_waiters):
+                if future.done():
+                    self.state_waiters.remove((states, future))
+                elif frame.error is not None:
+                    self.state_waiters.remove((states, future))
+                    future.set_exception(IOError(frame.error))
+                elif frame.dongle_state in states:
+                    self.state_waiters.remove((states, future))
+                    future.set_result(frame.dongle_state)
+
+    def _wait_for_state(self, command, states):
+        future = self.loop.create_future()
+        if self.parser.dongle_state in states:
+            future.set_result(self.parser.dongle_state)
+            return future
+        self.state_waiters.append((states, future))
+        self.dongle_fs.write(command)
+        return future
+
+    def _fail(self, error):
+        for _, future in self.state_waiters:
+            if not future.done():
+                future.set_exception(error)
+        self.state_waiters = []
+        self.close()
+
+    def _remove_stream(self, stream):
+        if stream in self.streams:
+            self.streams.remove(stream)
+            self.parser.unsubscribe(getattr(stream, 'push_batch', None))
+            self.parser.unsubscribe(getattr(stream, 'push_samples', None))
+
+    def connect(self):
+        """Connect the dongle to the headset.
+
+        Returns a future that resolves to 'connected', or fails with an
+        IOError when the dongle reports that the headset was not found or
+        the request was denied.
+        """
+        return self._wait_for_state(connect_command(self.global_id),
+                                    ('connected',))
+
+    def disconnect(self):
+        "Returns a future that resolves once the dongle has disconnected"
+        return self._wait_for_state(COMMAND_BYTES['disconnect'],
+                                    ('disconnected', 'standby'))
+
+    def frames(self, frame_types=tuple(parser.FRAME_TYPES)):
+        """Async iterator over decoded Frames.
+
+        ``frame_types`` is what VirtualParser.subscribe takes; by default
+        every frame is yielded.
+        """
+        stream = FrameStream(self, self.queue_size)
+        self.streams.append(stream)
+        self.parser.subscribe(frame_types, stream.push_batch)
+        return stream
+
+    def raw_blocks(self, block_size=512, with_times=False):
+        "Async iterator over raw samples in blocks, see RawBlockStream"
+        stream = RawBlockStream(self, self.queue_size, block_size, with_times)
+        self.streams.append(stream)
+        self.parser.subscribe_raw(stream.push_samples)
+        return stream
+
+    def get_state(self):
+        return self.parser.dongle_state
+
+    def get_stats(self):
+        "Link health snapshot, see VirtualParser.get_stats"
+        stats = self.parser.get_stats()
+        stats['dongle_dev'] = self.dongle_dev
+        stats['state'] = self.parser.dongle_state
+        stats['stream_drops'] = sum(s.dropped for s in self.streams)
+        return stats
+
+    def close(self):
+        "Stop reading, end all streams and close the serial port"
+        if self.fd is None:
+            return
+        self.loop.remove_reader(self.fd)
+        self.fd = None
+        for stream in list(self.streams):
+            stream.close()
+        for _, future in self.state_waiters:
+            future.cancel()
+        self.state_waiters = []
+        self.dongle_fs.close()
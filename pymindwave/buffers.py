@@ -0,0 +1,220 @@
+"""
+Preallocated buffers used on the acquisition path.
+
+The parser used to keep its input as a Python list of ints and trim it with
+pop(0) and slicing, which costs O(n) per byte and per frame. ByteBuffer keeps
+the bytes in one bytearray and only moves read and write cursors, so the cost
+of decoding a frame does not depend on how much data is waiting behind it.
+
+SampleRing does the same for decoded raw samples: a preallocated NumPy array
+written in a circle, with a sample counter that never wraps, so consumers
+can take windows without converting lists to arrays on every frame.
+BlockBuilder cuts the samples into fixed size blocks for consumers that
+want them that way.
+"""
+import numpy as np
+
+
+class ByteBuffer(object):
+    """Byte buffer with read and write cursors over a preallocated bytearray.
+
+    Unread bytes live in ``_buf[_read:_write]``. Consuming bytes only moves
+    the read cursor. When a write does not fit behind the write cursor the
+    unread bytes are slid back to the start of the array, or the array is
+    doubled when it is more than half full, so every byte is moved a bounded
+    number of times. All offsets taken by the public methods are relative to
+    the read cursor.
+    """
+
+    def __init__(self, capacity=4096):
+        self._buf = bytearray(capacity)
+        self._read = 0
+        self._write = 0
+
+    def __len__(self):
+        return self._write - self._read
+
+    def __getitem__(self, index):
+        "Return the byte at ``index`` (relative to the read cursor) as an int"
+        if index < 0:
+            index += self._write - self._read
+        if not 0 <= index < self._write - self._read:
+            raise IndexError('ByteBuffer index out of range')
+        return self._buf[self._read + index]
+
+    @property
+    def capacity(self):
+        return len(self._buf)
+
+    def write(self, data):
+        "Append ``data`` (str, bytes or bytearray) behind the write cursor"
+        n = len(data)
+        if not n:
+            return
+        if self._write + n > len(self._buf):
+            self._make_room(n)
+        self._buf[self._write:self._write + n] = data
+        self._write += n
+
+    def _make_room(self, n):
+        used = self._write - self._read
+        size = len(self._buf)
+        if used + n > size // 2:
+            while used + n > size // 2:
+                size *= 2
+            buf = bytearray(size)
+            buf[:used] = self._buf[self._read:self._write]
+            self._buf = buf
+        else:
+            self._buf[:used] = self._buf[self._read:self._write]
+        self._read = 0
+        self._write = used
+
+    def consume(self, n):
+        "Drop ``n`` bytes from the front of the buffer"
+        self._read = min(self._read + n, self._write)
+        if self._read == self._write:
+            self._read = self._write = 0
+
+    def clear(self):
+        self._read = self._write = 0
+
+    def find(self, sub, start=0):
+        "Relative offset of the first occurrence of ``sub``, or -1"
+        pos = self._buf.find(sub, self._read + start, self._write)
+        if pos < 0:
+            return -1
+        return pos - self._read
+
+    def slice(self, start, end):
+        "Copy of the bytes between the relative offsets ``start`` and ``end``"
+        return self._buf[self._read + start:self._read + end]
+
+    def view(self, start=0, end=None):
+        """Zero-copy memoryview of the unread bytes.
+
+        The view is only valid until the next call to write(), which may move
+        or reallocate the underlying array.
+        """
+        if end is None:
+            end = self._write - self._read
+        return memoryview(self._buf)[self._read + start:self._read + end]
+
+
+class SampleRing(object):
+    """Circular NumPy buffer for samples with a monotonically increasing counter.
+
+    ``count`` is the number of samples ever appended; the last ``capacity``
+    of them are kept. latest() and since() return read-only views into the
+    ring and only copy when the requested window wraps around the end of
+    the array. A view keeps pointing into the ring, so it shows new samples
+    once the writer has gone ``capacity`` samples further; copy it if it has
+    to outlive that.
+    """
+
+    def __init__(self, capacity=4096, dtype=np.int16):
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.capacity = capacity
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, value):
+        self.data[self.count % self.capacity] = value
+        self.count += 1
+
+    def extend(self, values):
+        values = np.asarray(values)
+        n = len(values)
+        if n > self.capacity:
+            values = values[-self.capacity:]
+            self.count += n - self.capacity
+            n = self.capacity
+        start = self.count % self.capacity
+        first = min(n, self.capacity - start)
+        self.data[start:start + first] = values[:first]
+        self.data[:n - first] = values[first:]
+        self.count += n
+
+    def window(self, start, end):
+        """Samples with counters ``start`` up to ``end`` (exclusive).
+
+        The range is clipped to what the ring still holds.
+        """
+        end = min(end, self.count)
+        start = max(start, self.count - self.capacity, 0)
+        if start >= end:
+            return self.data[:0]
+        a = start % self.capacity
+        b = a + (end - start)
+        if b <= self.capacity:
+            view = self.data[a:b]
+            view.flags.writeable = False
+            return view
+        return np.concatenate((self.data[a:], self.data[:b - self.capacity]))
+
+    def latest(self, n):
+        "The last ``n`` samples (fewer if the ring does not hold that many)"
+        return self.window(self.count - n, self.count)
+
+    def copy_latest(self, n, end=None):
+        """Copy of the last ``n`` samples and the counter after them.
+
+        Safe to call while another thread appends: the copy is taken again
+        if the writer came round to the copied samples meanwhile. ``n`` is
+        limited to ``capacity - 1``, the slot being written is never read.
+        With ``end`` the window ends at that counter instead of ``count``;
+        samples the writer has overwritten since are left out rather than
+        retried. The copy is read-only so it can be shared.
+        """
+        n = min(n, self.capacity - 1)
+        while True:
+            last = self.count if end is None else end
+            values = self.window(last - n, last).copy()
+            # the writer may be filling slot ``count`` right now
+            lost = self.count + 1 - self.capacity - (last - len(values))
+            if lost > 0 and end is not None:
+                values = values[lost:]
+            elif lost > 0:
+                continue
+            values.flags.writeable = False
+            return values, last
+
+    def since(self, counter):
+        """Samples appended since the ring's ``count`` was ``counter``.
+
+        If the ring has been overwritten since then, the oldest samples it
+        still holds are returned; compare ``counter`` with
+        ``count - capacity`` to detect the loss.
+        """
+        return self.window(counter, self.count)
+
+
+class BlockBuilder(object):
+    """Cuts raw samples and their timestamps into blocks of ``block_size``.
+
+    push() takes batches of any length (e.g. from
+    VirtualParser.subscribe_raw) and calls ``callback(samples, times)``
+    with a fresh copy of every block completed.
+    """
+
+    def __init__(self, block_size, callback):
+        self.block_size = block_size
+        self.callback = callback
+        self.samples = np.zeros(block_size, dtype=np.int16)
+        self.times = np.zeros(block_size)
+        self.filled = 0
+
+    def push(self, samples, times):
+        i = 0
+        n = len(samples)
+        while i < n:
+            take = min(n - i, self.block_size - self.filled)
+            self.samples[self.filled:self.filled + take] = samples[i:i + take]
+            self.times[self.filled:self.filled + take] = times[i:i + take]
+            self.filled += take
+            i += take
+            if self.filled == self.block_size:
+                self.filled = 0
+                self.callback(self.samples.copy(), self.times.copy())
@@ -0,0 +1,222 @@
+"""
+Vectorized decoder for captured ThinkGear byte streams.
+
+VirtualParser decodes one frame at a time in Python, which is what a live
+dongle needs but far too slow to reprocess hours of recorded bytes. The
+functions here decode a whole buffer with NumPy: sync search, length checks
+and checksums run over the whole buffer at once, the chain of frames the
+streaming parser would follow is resolved by pointer doubling, and payload
+rows are walked for all frames in parallel. The results are the same as
+feeding the buffer through VirtualParser.parse_payload.
+
+Every output is a structured array whose ``frame`` field is the index of the
+decoded frame it came from, so values from the same packet can be matched up.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from pymindwave.parser import bigend_24b
+
+
+FRAME_DTYPE = np.dtype([('offset', np.int64), ('length', np.uint8)])
+RAW_DTYPE = np.dtype([('frame', np.int64), ('value', np.int16)])
+WAVES_DTYPE = np.dtype([('frame', np.int64), ('values', np.int64, (8,))])
+VALUE_DTYPE = np.dtype([('frame', np.int64), ('value', np.uint8)])
+EVENT_DTYPE = np.dtype([('frame', np.int64), ('code', np.uint8),
+                        ('value', np.int64)])
+
+# dongle state codes reported in ``events``
+STATE_CODES = (0xd0, 0xd1, 0xd2, 0xd3, 0xd4)
+
+
+DecodedStream = namedtuple('DecodedStream', [
+    'frames',           # offset of the sync bytes and plen of each frame
+    'raw',              # 0x80 raw samples
+    'waves',            # 0x83 band powers: delta .. mid_gamma
+    'attention',        # 0x04
+    'meditation',       # 0x05
+    'poor_signal',      # 0x02
+    'blink_strength',   # 0x16
+    'events',           # 0xd0 - 0xd4 dongle states, value is the global id
+    'checksum_errors',  # frames skipped because of a bad checksum
+    'oversize',         # sync bytes followed by a plen above 170
+    'consumed',         # bytes decoded; the rest is an incomplete frame
+])
+
+
+def _as_array(data):
+    if isinstance(data, np.ndarray):
+        return data.astype(np.uint8, copy=False).ravel()
+    return np.frombuffer(data, dtype=np.uint8)
+
+
+def _follow_chain(jump, sink):
+    """Indices visited by following ``jump`` from node 0 until ``sink``.
+
+    Uses pointer doubling: after step t the path holds the first 2**t nodes,
+    in order, and ``jump`` has been squared t times.
+    """
+    path = np.zeros(1, dtype=np.int64)
+    while True:
+        tail = jump[path]
+        done = tail == sink
+        if done.all():
+            return path[path != sink]
+        path = np.concatenate([path, tail])
+        jump = jump[jump]
+
+
+def _walk_rows(b, starts, ends):
+    """Split every payload into rows, all payloads at once.
+
+    Mirrors the bounds handling of VirtualParser.parse_payload: a row that
+    runs past the end of its payload ends the payload. Returns the frame
+    index, code, value offset and value length of every complete row, in
+    stream order.
+    """
+    frame_idx, codes, voffs, vlens = [], [], [], []
+    cur = starts.copy()
+    active = np.flatnonzero(cur < ends)
+    while len(active):
+        c = cur[active]
+        end = ends[active]
+        code = b[c]
+        ext = code >= 0x80
+        vlen = np.where(ext, b[c + 1], 1).astype(np.int64)
+        voff = np.where(ext, c + 2, c + 1)
+        new = voff + vlen
+        ok = new <= end
+        frame_idx.append(active[ok])
+        codes.append(code[ok])
+        voffs.append(voff[ok])
+        vlens.append(vlen[ok])
+        cur[active] = np.where(ok, new, end)
+        active = active[cur[active] < end]
+    if not frame_idx:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, np.zeros(0, dtype=np.uint8), empty, empty
+    # the loop collects rows by their position in the payload; a stable
+    # sort on the frame index restores stream order, rows of one frame
+    # keeping theirs
+    frame_idx = np.concatenate(frame_idx)
+    order = np.argsort(frame_idx, kind='mergesort')
+    return (frame_idx[order], np.concatenate(codes)[order],
+            np.concatenate(voffs)[order], np.concatenate(vlens)[order])
+
+
+def _values(dtype, frames, values):
+    out = np.zeros(len(frames), dtype=dtype)
+    out['frame'] = frames
+    out['value'] = values
+    return out
+
+
+def decode_buffer(data):
+    """Decode all frames in ``data`` (bytes, bytearray or uint8 array).
+
+    Returns a DecodedStream. Bytes after ``consumed`` belong to a frame that
+    is not complete yet; prepend them to the next buffer to continue.
+    """
+    b = _as_array(data)
+    n = len(b)
+    empty = DecodedStream(
+        np.zeros(0, FRAME_DTYPE), np.zeros(0, RAW_DTYPE),
+        np.zeros(0, WAVES_DTYPE), np.zeros(0, VALUE_DTYPE),
+        np.zeros(0, VALUE_DTYPE), np.zeros(0, VALUE_DTYPE),
+        np.zeros(0, VALUE_DTYPE), np.zeros(0, EVENT_DTYPE), 0, 0, 0)
+    if n < 2:
+        return empty._replace(consumed=0 if n and b[0] == 0xaa else n)
+
+    is_sync = b == 0xaa
+    syncs = np.flatnonzero(is_sync[:-1] & is_sync[1:])
+    if not len(syncs):
+        return empty._replace(consumed=n - 1 if is_sync[-1] else n)
+
+    # first non-0xaa byte at or after every position: the plen of a sync
+    idx = np.where(is_sync, n, np.arange(n))
+    next_plen = np.minimum.accumulate(idx[::-1])[::-1]
+    next_plen = np.append(next_plen, n)
+    plen_pos = next_plen[np.minimum(syncs + 2, n)]
+    have_plen = plen_pos < n
+    plen = np.where(have_plen, b[np.minimum(plen_pos, n - 1)], 0)
+    plen = plen.astype(np.int64)
+    oversize = have_plen & (plen > 170)
+    chk_pos = plen_pos + 1 + plen
+    complete = have_plen & (oversize | (chk_pos < n))
+    framed = complete & ~oversize
+
+    # checksums of every candidate frame from a running sum
+    csum = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(b, out=csum[1:])
+    safe_chk = np.where(framed, chk_pos, 0)
+    payload_sum = csum[safe_chk] - csum[np.where(framed, plen_pos + 1, 0)]
+    valid = framed & ((~payload_sum) & 0xff == b[safe_chk])
+
+    # where the streaming parser searches for the next sync after each
+    # candidate, and which candidate it finds there
+    resume = np.where(oversize, plen_pos + 1, chk_pos + 1)
+    sink = len(syncs)
+    jump = np.append(np.searchsorted(syncs, resume), sink)
+    jump[:-1][~complete] = sink
+    path = _follow_chain(jump, sink)
+
+    last = path[-1]
+    if not complete[last]:
+        # the walk stopped at a frame that is not complete yet
+        consumed = syncs[last]
+        path = path[:-1]
+    else:
+        # no sync after the last frame; a trailing 0xaa is kept
+        after = resume[last]
+        consumed = n - 1 if after < n and is_sync[-1] else n
+
+    checksum_errors = int(np.count_nonzero(framed[path] & ~valid[path]))
+    oversize_count = int(np.count_nonzero(oversize[path]))
+    path = path[valid[path]]
+
+    frames = np.zeros(len(path), dtype=FRAME_DTYPE)
+    frames['offset'] = syncs[path]
+    frames['length'] = plen[path]
+
+    starts = plen_pos[path] + 1
+    ends = chk_pos[path]
+    frame_idx, codes, voff, vlen = _walk_rows(b, starts, ends)
+
+    sel = (codes == 0x80) & (vlen >= 2)
+    v = voff[sel]
+    raw_values = (b[v].astype(np.int32) << 8) | b[v + 1]
+    raw = _values(RAW_DTYPE, frame_idx[sel],
+                  raw_values.astype(np.uint16).view(np.int16))
+
+    sel = (codes == 0x83) & (vlen >= 24)
+    v = voff[sel]
+    triples = b[v[:, None] + np.arange(24)].reshape(-1, 8, 3).astype(np.int64)
+    waves = np.zeros(len(v), dtype=WAVES_DTYPE)
+    waves['frame'] = frame_idx[sel]
+    waves['values'] = bigend_24b(triples[:, :, 0], triples[:, :, 1],
+                                 triples[:, :, 2])
+
+    def single(code):
+        sel = codes == code
+        return _values(VALUE_DTYPE, frame_idx[sel], b[voff[sel]])
+
+    sel = np.in1d(codes, STATE_CODES) & \
+        ((vlen >= 2) | ~np.in1d(codes, (0xd0, 0xd2)))
+    events = np.zeros(np.count_nonzero(sel), dtype=EVENT_DTYPE)
+    events['frame'] = frame_idx[sel]
+    events['code'] = codes[sel]
+    v = voff[sel]
+    has_id = np.in1d(codes[sel], (0xd0, 0xd2))
+    ids = 256 * b[np.where(has_id, v, 0)].astype(np.int64) + \
+        b[np.where(has_id, v + 1, 0)]
+    events['value'] = np.where(has_id, ids, -1)
+
+    return DecodedStream(frames, raw, waves, single(0x04), single(0x05),
+                         single(0x02), single(0x16), events,
+                         checksum_errors, oversize_count, int(consumed))
+
+
+def decode_file(file_name):
+    "Decode a file of captured dongle bytes, see decode_buffer()"
+    return decode_buffer(np.fromfile(file_name, dtype=np.uint8))
@@ -0,0 +1,131 @@
+"""
+Subscribers that get their data on their own thread through a bounded queue.
+
+Callbacks set with setCallBack or subscribe() run inside the parser, on the
+thread that reads the dongle, so a slow one (network sends, analysis)
+delays the next read. A QueuedSubscriber only costs the reader a queue
+append; the callback runs on the subscriber's worker thread. What happens
+when the consumer falls behind and the queue is full is up to the policy:
+
+``block``
+    the reader waits for room: nothing is lost, but a slow consumer slows
+    acquisition down again. Only for consumers that must see everything.
+``drop_oldest``
+    the oldest queued item is discarded
+``drop_newest``
+    the new item is discarded
+``latest``
+    only the newest item is kept, for consumers that show current values
+
+Every subscriber counts what it delivered and dropped, and the deepest its
+queue got, so a consumer that cannot keep up shows in the stats.
+"""
+import threading
+import traceback
+from collections import deque
+
+from pymindwave.stats import Histogram, clock
+
+POLICIES = ('block', 'drop_oldest', 'drop_newest', 'latest')
+
+
+class QueuedSubscriber(object):
+    """Calls ``callback(item)`` on a worker thread for every item put().
+
+    With ``unpack`` set items are tuples passed as ``callback(*item)``.
+    """
+
+    def __init__(self, callback, maxsize=64, policy='drop_oldest', name=None,
+                 unpack=False):
+        if policy not in POLICIES:
+            raise ValueError('unknown policy %r, use one of %s'
+                             % (policy, ', '.join(POLICIES)))
+        self.callback = callback
+        self.maxsize = maxsize
+        self.policy = policy
+        self.name = name or getattr(callback, '__name__', repr(callback))
+        self.unpack = unpack
+        self.items = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.callback_time = Histogram()
+        self.worker = threading.Thread(target=self.run, name=self.name)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def put(self, item):
+        "Queue ``item`` following the policy; called on the reader thread"
+        with self.cond:
+            items = self.items
+            if self.policy == 'latest':
+                self.dropped += len(items)
+                items.clear()
+            elif len(items) >= self.maxsize:
+                if self.policy == 'drop_newest':
+                    self.dropped += 1
+                    return
+                if self.policy == 'drop_oldest':
+                    items.popleft()
+                    self.dropped += 1
+                else:
+                    while len(items) >= self.maxsize and not self.closed:
+                        self.cond.wait()
+            if self.closed:
+                return
+            items.append(item)
+            if len(items) > self.max_depth:
+                self.max_depth = len(items)
+            self.cond.notify_all()
+
+    def put_raw(self, samples, times):
+        """put() for VirtualParser.subscribe_raw: queues copies, the arrays
+        passed there are views the parser overwrites later"""
+        self.put((samples.copy(), times.copy()))
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.items and not self.closed:
+                    self.cond.wait()
+                if not self.items:
+                    return
+                item = self.items.popleft()
+                self.cond.notify_all()
+            started = clock()
+            try:
+                if self.unpack:
+                    self.callback(*item)
+                else:
+                    self.callback(item)
+            except Exception:
+                # keep the worker alive, a dead one would block the reader
+                # under the block policy
+                self.errors += 1
+                traceback.print_exc()
+            self.callback_time.record(clock() - started)
+            self.delivered += 1
+
+    def close(self, timeout=1.0):
+        """Deliver what is queued, then stop the worker (waits up to
+        ``timeout`` seconds)"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        if threading.current_thread() is not self.worker:
+            self.worker.join(timeout)
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'policy': self.policy,
+            'depth': len(self.items),
+            'max_depth': self.max_depth,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'callback_time': self.callback_time.snapshot(),
+        }
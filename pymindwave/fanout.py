@@ -0,0 +1,274 @@
+"""
+Share one dongle between several local programs.
+
+The serial port can only be opened once. FanoutDaemon owns the dongle
+through a Headset and serves its byte stream on a Unix socket: every
+client gets the bytes exactly as the dongle sends them. Clients parse the
+stream themselves, so any program that takes a serial device works
+unchanged when given the socket path instead, see transport.open_dongle.
+RemoteHeadset is the same thing spelled out.
+
+The link to the headset is shared, so the daemon alone controls it: a
+connect command from any client asks the daemon's Headset to connect (it
+then keeps the link up for everyone), and disconnect commands are ignored,
+since one client must not cut off the others. A connect by global id is
+passed on while the daemon is not tied to a headset yet; asking for a
+different headset than the one the daemon uses is answered with a 0xd3
+(request denied) packet to that client only.
+
+Every client has its own queue of pending chunks, capped at
+``max_buffer`` bytes. When a client does not read fast enough its oldest
+chunks are dropped (its parser resynchronises on the next packet), so a
+slow client never slows the dongle or the other clients. The Headset's
+reader thread only appends to a deque; all socket I/O happens on the
+daemon's own loop.
+"""
+import errno
+import fcntl
+import os
+import select
+import socket
+import stat
+from collections import deque
+
+from pymindwave.headset import Headset
+from pymindwave.transport import open_unix_socket
+
+
+# 0xd3 request denied, as the dongle sends it
+DENIED_PACKET = b'\xaa\xaa\x02\xd3\x00\x2c'
+
+
+class Client(object):
+    "A connected client with its queue of pending chunks"
+
+    def __init__(self, sock, max_buffer):
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.max_buffer = max_buffer
+        self.chunks = deque()
+        self.offset = 0     # bytes of chunks[0] already sent
+        self.buffered = 0   # bytes queued, including chunks[0]
+        self.bytes_sent = 0
+        self.dropped_bytes = 0
+        self.dropped_chunks = 0
+        # command bytes not complete yet, e.g. 0xc0 without its global id
+        self.commands = bytearray()
+        self.denied = 0
+
+    def push(self, data):
+        self.chunks.append(data)
+        self.buffered += len(data)
+        while self.buffered > self.max_buffer and len(self.chunks) > 1:
+            old = self.chunks.popleft()
+            self.buffered -= len(old)
+            self.dropped_bytes += len(old) - self.offset
+            self.dropped_chunks += 1
+            self.offset = 0
+
+    def flush(self):
+        "Send as much as the socket takes; False if the client is gone"
+        while self.chunks:
+            chunk = self.chunks[0]
+            try:
+                n = self.sock.send(chunk[self.offset:])
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return True
+                return False
+            self.bytes_sent += n
+            self.offset += n
+            if self.offset < len(chunk):
+                return True
+            self.chunks.popleft()
+            self.buffered -= len(chunk)
+            self.offset = 0
+        return True
+
+    def stats(self):
+        return {
+            'bytes_sent': self.bytes_sent,
+            'buffered': self.buffered,
+            'dropped_bytes': self.dropped_bytes,
+            'dropped_chunks': self.dropped_chunks,
+            'denied': self.denied,
+        }
+
+
+def _remove_stale_socket(path):
+    "Unlink a socket no daemon listens on any more; refuse anything else"
+    if not stat.S_ISSOCK(os.stat(path).st_mode):
+        raise IOError(errno.EEXIST, 'exists and is not a socket', path)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except socket.error as e:
+        if e.args[0] != errno.ECONNREFUSED:
+            raise
+    else:
+        raise IOError(errno.EADDRINUSE, 'a daemon is listening on it', path)
+    finally:
+        probe.close()
+    os.unlink(path)
+
+
+class FanoutDaemon(object):
+    """Serves a Headset's byte stream on ``socket_path``.
+
+    Pass ``headset`` to share a Headset that is already open, otherwise
+    one is opened on ``dongle_dev``. Run the loop with serve_forever(), or
+    call poll() from your own loop. A socket left at ``socket_path`` by an
+    earlier daemon is replaced. IOError is raised if a daemon still
+    listens there (EADDRINUSE) or the path is not a socket (EEXIST).
+    """
+
+    def __init__(self, socket_path, dongle_dev='/dev/ttyUSB0', headset=None,
+                 max_buffer=64 * 1024):
+        self.socket_path = socket_path
+        if os.path.exists(socket_path):
+            _remove_stale_socket(socket_path)
+        self.max_buffer = max_buffer
+        self.headset = headset or Headset(dongle_dev)
+        self.clients = {}
+        self.running = False
+        # chunks from the reader thread and a pipe to wake up the loop
+        self.incoming = deque()
+        self.wake_r, self.wake_w = os.pipe()
+        for fd in (self.wake_r, self.wake_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(socket_path)
+        self.listener.listen(16)
+        self.headset.parser.subscribe_bytes(self._on_bytes)
+
+    def _on_bytes(self, data):
+        # reader thread: hand over and wake the loop, never block
+        self.incoming.append(data)
+        try:
+            os.write(self.wake_w, b'.')
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def _accept(self):
+        sock, _ = self.listener.accept()
+        client = Client(sock, self.max_buffer)
+        self.clients[sock.fileno()] = client
+
+    def _drop(self, fd):
+        client = self.clients.pop(fd)
+        client.sock.close()
+
+    def _from_client(self, fd):
+        "Connect commands from a client are requests to the daemon's Headset"
+        try:
+            data = self.clients[fd].sock.recv(4096)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = b''
+        if not data:
+            self._drop(fd)
+            return
+        client = self.clients[fd]
+        commands = client.commands
+        commands.extend(data)
+        i = 0
+        while i < len(commands):
+            if commands[i] == 0xc0:
+                if i + 3 > len(commands):
+                    # the global id is still on its way
+                    break
+                self._connect_request(client,
+                                      commands[i + 1] << 8 | commands[i + 2])
+                i += 3
+                continue
+            if commands[i] == 0xc2:
+                self._connect_request(client, None)
+            i += 1
+        del commands[:i]
+
+    def _connect_request(self, client, global_id):
+        connection = self.headset.connection
+        if global_id is not None:
+            current = connection.global_id
+            if current is None and self.headset.get_state() == 'connected':
+                current = self.headset.parser.global_id
+            if current is None:
+                connection.global_id = global_id
+            elif current != global_id:
+                # another headset than the one everyone shares
+                client.denied += 1
+                client.push(DENIED_PACKET)
+                return
+        self.headset.connect()
+
+    def poll(self, timeout=0.1):
+        "Wait up to ``timeout`` seconds and handle what is ready"
+        writers = [fd for fd, client in self.clients.items() if client.chunks]
+        readers = [self.listener.fileno(), self.wake_r] + list(self.clients)
+        readable, writable, _ = select.select(readers, writers, [], timeout)
+        for fd in readable:
+            if fd == self.listener.fileno():
+                self._accept()
+            elif fd == self.wake_r:
+                try:
+                    os.read(self.wake_r, 4096)
+                except OSError:
+                    pass
+            elif fd in self.clients:
+                self._from_client(fd)
+        while self.incoming:
+            data = self.incoming.popleft()
+            for client in self.clients.values():
+                client.push(data)
+        for fd, client in list(self.clients.items()):
+            if client.chunks and (fd in writable or fd not in writers):
+                if not client.flush():
+                    self._drop(fd)
+
+    def serve_forever(self):
+        self.running = True
+        while self.running:
+            self.poll()
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        "Headset stats plus per client queue stats, keyed by client fd"
+        stats = self.headset.get_stats()
+        stats['clients'] = dict((fd, client.stats())
+                                for fd, client in self.clients.items())
+        return stats
+
+    def close(self):
+        for fd in list(self.clients):
+            self._drop(fd)
+        self.listener.close()
+        os.close(self.wake_r)
+        os.close(self.wake_w)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class RemoteHeadset(Headset):
+    """Headset that reads the stream served by a FanoutDaemon.
+
+    Behaves like a Headset on the dongle itself, but the link is shared
+    with the daemon's other clients: connect() asks the daemon to connect,
+    which keeps the link up from then on, and disconnect() does nothing.
+    The headset's ``connection`` only follows the link, it never retries
+    on its own.
+    """
+
+    def __init__(self, socket_path, global_id=None):
+        super(RemoteHeadset, self).__init__(socket_path, global_id,
+                                            reconnect=False)
+
+    def disconnect(self):
+        "Does nothing: other clients share the link"
+
+    def _open(self, socket_path):
+        return open_unix_socket(socket_path)
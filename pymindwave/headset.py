@@ -2,96 +2,390 @@
 # -*- coding:utf-8 -*-
 
 import threading
-import serial
-import parser
 import time
+from collections import namedtuple
+
+import serial
+
+from pymindwave import parser
+from pymindwave.stats import Histogram, clock
+from pymindwave.transport import make_reader, open_dongle
 
 
 COMMAND_BYTES = {
-    'auto_connect': '\xc2',
-    'disconnect': '\xc1',
+    'connect': b'\xc0',  # followed by the 2 byte global id
+    'auto_connect': b'\xc2',
+    'disconnect': b'\xc1',
 }
 
 
+def connect_command(global_id=None):
+    "The bytes asking the dongle to connect to ``global_id``, or to any headset"
+    if not global_id:
+        return COMMAND_BYTES['auto_connect']
+    return COMMAND_BYTES['connect'] + bytes(bytearray(
+        [global_id >> 8, global_id & 0xff]))
+
+
+# ``state`` of the link as Reconnector sees it: 'idle', 'connecting',
+# 'connected' or 'retrying'; ``cause`` is the dongle state or error that
+# made it change, ``duration`` the seconds spent in ``previous``
+ConnectionEvent = namedtuple('ConnectionEvent', ('time', 'state', 'previous',
+                                                 'duration', 'cause',
+                                                 'attempt'))
+
+
+class Reconnector(object):
+    """Keeps a dongle connected once connect() was called.
+
+    Listens to the parser's state and data packets, so it reacts on the
+    reader thread as soon as 0xd1 (not found), 0xd2 (disconnected), 0xd3 (denied)
+    or 0xd4 (standby, except while an attempt is pending) is decoded: the
+    first retry is sent at once, further ones after a backoff doubling
+    from ``min_backoff`` up to ``max_backoff`` seconds, until 0xd0
+    arrives. An attempt that gets no answer at all is retried after
+    ``connect_timeout`` seconds. Raw or wave data counts as connected too:
+    a dongle that was already linked before it was opened streams without
+    ever sending 0xd0. poll() fires the delayed retries and has to be
+    called regularly, DongleReader does it after every read.
+
+    Every state change is passed to the listeners as a ConnectionEvent.
+    The time from losing a connection to getting it back is recorded in
+    the ``reconnect_time`` histogram.
+    """
+
+    def __init__(self, send, global_id=None, min_backoff=0.05,
+                 max_backoff=2.0, connect_timeout=5.0):
+        self.send = send
+        self.global_id = global_id
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.connect_timeout = connect_timeout
+        self.listeners = []
+        self.cond = threading.Condition(threading.RLock())
+        self.wanted = False
+        # set by stop(): data still in flight must not look like a link
+        self.stopped = False
+        self.state = 'idle'
+        self.since = clock()
+        self.backoff = 0
+        self.retry_at = None
+        self.attempt_time = None
+        self.lost_at = None
+        self.attempts = 0
+        self.total_attempts = 0
+        self.connects = 0
+        self.losses = 0
+        self.failures = 0
+        self.reconnect_time = Histogram()
+
+    def start(self, streaming=False):
+        """Connect, and reconnect whenever the link is lost.
+
+        ``streaming`` tells that the dongle is already connected and
+        sending data, then no connect command is sent.
+        """
+        with self.cond:
+            self.wanted = True
+            self.stopped = False
+            self.backoff = 0
+            if streaming:
+                self._connected(clock(), 'streaming')
+            elif self.state in ('idle', 'retrying'):
+                self.retry_at = None
+                self._attempt(clock(), 'connect')
+
+    def stop(self):
+        "Disconnect and stop reconnecting"
+        with self.cond:
+            self.wanted = False
+            self.stopped = True
+            self.retry_at = None
+            self.lost_at = None
+            self.send(COMMAND_BYTES['disconnect'])
+            self._set('idle', 'disconnect', clock())
+
+    def stream_closed(self, cause='closed'):
+        "The stream to the dongle is gone: go idle without sending anything"
+        with self.cond:
+            self.wanted = False
+            self.retry_at = None
+            self.lost_at = None
+            if self.state != 'idle':
+                self._set('idle', cause, clock())
+
+    def on_frames(self, frames):
+        "Subscriber for the parser's 'state', 'raw' and 'waves' frames"
+        with self.cond:
+            for frame in frames:
+                now = clock()
+                if frame.dongle_state == 'connected':
+                    self._connected(now)
+                elif frame.error is not None:
+                    self.failures += 1
+                    self._lost(now, frame.error)
+                elif frame.dongle_state in ('disconnected', 'standby'):
+                    self._lost(now, frame.dongle_state)
+                elif frame.dongle_state is None and not self.stopped and \
+                        self.state != 'connected':
+                    # data flows, so the link is up
+                    self._connected(now, 'streaming')
+
+    def poll(self, now=None):
+        "Send a due retry; call this regularly"
+        if now is None:
+            now = clock()
+        with self.cond:
+            if self.retry_at is not None and now >= self.retry_at:
+                self.retry_at = None
+                self._attempt(now, 'backoff')
+            elif self.state == 'connecting' and \
+                    now - self.attempt_time > self.connect_timeout:
+                self._retry(now, 'timeout')
+
+    def _connected(self, now, cause='connected'):
+        if self.lost_at is not None:
+            self.reconnect_time.record(now - self.lost_at)
+            self.lost_at = None
+        if self.state != 'connected':
+            self.connects += 1
+        self.backoff = 0
+        self.retry_at = None
+        self._set('connected', cause, now)
+        self.attempts = 0
+
+    def _lost(self, now, cause):
+        if not self.wanted:
+            if self.state != 'idle':
+                self._set('idle', cause, now)
+            return
+        if self.state == 'connecting' and cause == 'standby':
+            # sent before the dongle saw the command; a failed search
+            # ends in 0xd1 or the connect timeout
+            return
+        if self.state == 'connected':
+            self.losses += 1
+            self.lost_at = now
+        self._retry(now, cause)
+
+    def _retry(self, now, cause):
+        if self.retry_at is not None:
+            return
+        delay = self.backoff
+        self.backoff = min(max(2 * self.backoff, self.min_backoff),
+                           self.max_backoff)
+        if delay:
+            self.retry_at = now + delay
+            self._set('retrying', cause, now)
+        else:
+            self._attempt(now, cause)
+
+    def _attempt(self, now, cause):
+        self.attempts += 1
+        self.total_attempts += 1
+        self.attempt_time = now
+        self.send(connect_command(self.global_id))
+        self._set('connecting', cause, now)
+
+    def _set(self, state, cause, now):
+        event = ConnectionEvent(now, state, self.state, now - self.since,
+                                cause, self.attempts)
+        self.state = state
+        self.since = now
+        self.cond.notify_all()
+        for listener in self.listeners:
+            listener(event)
+
+    def wait(self, state='connected', timeout=None):
+        "Block until the link is in ``state``; False on timeout"
+        deadline = None if timeout is None else clock() + timeout
+        with self.cond:
+            while self.state != state:
+                remaining = None if deadline is None else deadline - clock()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+            return True
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'connects': self.connects,
+            'losses': self.losses,
+            'failures': self.failures,
+            'attempts': self.total_attempts,
+            'reconnect_time': self.reconnect_time.snapshot(),
+        }
+
 
 class DongleReader(threading.Thread):
     def __init__(self, parser, *args, **kwargs):
         self.parser = parser
         self.running = True
+        # called with the time after every read, see Reconnector.poll
+        self.timers = []
+        # called with the cause when the stream closes and the thread ends
+        self.on_close = []
         super(DongleReader, self).__init__(*args, **kwargs)
 
     def run(self):
+        # the parser's reader blocks until the dongle sends something, so
+        # there is no need to sleep here
+        reader = self.parser.reader
         while self.running:
-            if not self.parser.sending_data:
-                time.sleep(0.5)
-            self.parser.update()
+            try:
+                self.parser.update_all()
+            except (IOError, OSError, serial.SerialException) as e:
+                self._closed('error: {0}'.format(e))
+                return
+            if reader.eof:
+                self._closed('closed')
+                return
+            if self.timers:
+                now = clock()
+                for timer in self.timers:
+                    timer(now)
+
+    def _closed(self, cause):
+        # unplugged dongle or closed socket: reading again would only spin
+        self.running = False
+        self.parser.dongle_state = 'disconnected'
+        self.parser.publish()
+        for callback in self.on_close:
+            callback(cause)
 
     def stop(self):
+        # the reader returns within its select() timeout
         self.running = False
-        self._Thread__stop()
 
 
 class Headset(object):
-    def __init__(self, dongle_dev, global_id=None):
+    """A headset behind a dongle, read by a DongleReader thread.
+
+    With ``latency_budget`` (seconds) the port is read by a
+    CoalescingReader: fewer, larger reads for up to that much extra delay,
+    which saves CPU on small hosts such as a Raspberry Pi.
+
+    After connect() the headset stays connected: a Reconnector (in
+    ``connection``) connects again as soon as the dongle reports the link
+    lost, by ``global_id`` if one is given. Pass ``reconnect=False`` to
+    only send the connect command once. If the port goes away (unplugged
+    dongle, closed fan-out socket) the reader thread ends and the state
+    turns 'disconnected'.
+    """
+
+    def __init__(self, dongle_dev, global_id=None, latency_budget=None,
+                 reconnect=True):
         if global_id:
             self.auto_connect = False
             self.global_id = global_id
         else:
             self.auto_connect = True
         self.dongle_dev = dongle_dev
-        self.dongle_fs = serial.Serial(dongle_dev,  115200, timeout=0.001)
-        self.parser = parser.VirtualParser(self.dongle_fs)
+        self.dongle_fs = self._open(dongle_dev)
+        self.parser = parser.VirtualParser(
+            self.dongle_fs, reader=make_reader(self.dongle_fs, latency_budget))
+        self.reconnect = reconnect
+        self.connection = Reconnector(self.dongle_fs.write, global_id)
+        self.parser.subscribe(['state', 'raw', 'waves'],
+                              self.connection.on_frames)
         # setup listening thread
         self.dongle_reader = DongleReader(self.parser)
+        self.dongle_reader.timers.append(self.connection.poll)
+        self.dongle_reader.on_close.append(self.connection.stream_closed)
         self.dongle_reader.daemon = True
         self.dongle_reader.start()
 
-    def connect(self):
-        if self.auto_connect:
-            self.dongle_fs.write(COMMAND_BYTES['auto_connect'])
+    def _open(self, dongle_dev):
+        "Open the byte stream of the dongle, see transport.open_dongle"
+        return open_dongle(dongle_dev)
+
+    def connect(self, timeout=None):
+        """Connect, by global id if one was given.
+
+        Returns at once unless ``timeout`` is given, then waits up to that
+        many seconds and returns whether the headset is connected.
+        """
+        if self.reconnect:
+            self.connection.start(
+                streaming=self.parser.dongle_state == 'connected')
         else:
-            #@TODO connect to specific headset  11.07 2013 (houqp)
-            pass
+            self.dongle_fs.write(connect_command(self.connection.global_id))
+        if timeout is not None:
+            return self.wait_connected(timeout)
 
     def disconnect(self):
-        self.dongle_fs.write(COMMAND_BYTES['disconnect'])
+        self.connection.stop()
+
+    def wait_connected(self, timeout=None):
+        """Block until the dongle reports a connection, without polling;
+        False on timeout"""
+        return self.connection.wait('connected', timeout)
+
+    def subscribe_connection(self, callback):
+        """``callback(event)`` with a ConnectionEvent whenever the link
+        changes state, called on the reader thread"""
+        self.connection.listeners.append(callback)
 
     def destroy(self):
         self.dongle_reader.stop()
+        self.dongle_reader.join(1.0)
         self.dongle_fs.close()
+        for subscriber in list(self.parser.queued_subscribers):
+            self.parser.unsubscribe(subscriber)
+
+    # the getters read the published values, never a frame the reader
+    # thread is halfway through storing
 
     def get_state(self):
-        return self.parser.dongle_state
+        return self.parser.values.dongle_state
+
+    def snapshot(self, raw_len=None):
+        """All current values and the raw window as one immutable object,
+        see VirtualParser.snapshot"""
+        return self.parser.snapshot(raw_len)
+
+    def get_stats(self):
+        "Link health snapshot, see VirtualParser.get_stats"
+        stats = self.parser.get_stats()
+        stats['dongle_dev'] = self.dongle_dev
+        stats['state'] = self.parser.values.dongle_state
+        stats['reader_alive'] = self.dongle_reader.is_alive()
+        stats['connection'] = self.connection.stats()
+        return stats
 
     def get_attention(self):
-        return self.parser.attention
+        return self.parser.values.attention
 
     def get_meditation(self):
-        return self.parser.meditation
+        return self.parser.values.meditation
 
     def get_raw_values(self):
         return self.parser.raw_values
 
     def get_waves_vector(self):
-        return self.parser.current_vector
+        return list(self.parser.values.waves)
 
     def get_delta_waves(self):
-        return self.parser.delta
+        return self.parser.values.waves[0]
 
     def get_theta_waves(self):
-        return self.parser.theta
+        return self.parser.values.waves[1]
 
     def get_alpha_waves(self):
-        return (self.parser.low_alpha + self.parser.high_alpha) / 2
+        waves = self.parser.values.waves
+        return (waves[2] + waves[3]) / 2
 
     def get_beta_waves(self):
-        return (self.parser.low_beta + self.parser.high_beta) / 2
+        waves = self.parser.values.waves
+        return (waves[4] + waves[5]) / 2
 
     def get_gamma_waves(self):
-        return (self.parser.low_gamma + self.parser.mid_gamma) / 2
+        waves = self.parser.values.waves
+        return (waves[6] + waves[7]) / 2
 
     def get_blink_strength(self):
-        return self.parser.blink_strength
+        return self.parser.values.blink_strength
 
     def get(self, stuff):
         if stuff == 'attention':
@@ -121,3 +415,14 @@ class Headset(object):
 
     def setCallBack(self, variable_name, callback_function):
         self.parser.setCallBack(variable_name, callback_function)
+
+    def subscribe(self, frame_types, callback, maxsize=64,
+                  policy='drop_oldest'):
+        """``callback(frames)`` on its own thread behind a bounded queue,
+        see VirtualParser.subscribe_queued"""
+        return self.parser.subscribe_queued(frame_types, callback, maxsize,
+                                            policy)
+
+    def subscribe_raw(self, callback, maxsize=64, policy='drop_oldest'):
+        "``callback(samples, times)``, see VirtualParser.subscribe_raw_queued"
+        return self.parser.subscribe_raw_queued(callback, maxsize, policy)
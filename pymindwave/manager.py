@@ -0,0 +1,233 @@
+"""
+Several dongles on one select loop.
+
+A Headset per dongle means a serial handle and a DongleReader thread per
+dongle. DongleManager owns any number of dongles and waits on all their
+file descriptors in a single poll() (select() where poll is missing), so
+one thread serves every headset and the CPU cost grows with the bytes
+received, not with the number of threads. Every dongle gets its own
+push-driven VirtualParser; events reach the subscribers tagged with the
+device id they came from. A dongle that fails (unplugged, read error,
+hang-up) is dropped on its own and reported, the others keep streaming.
+"""
+
+import select
+import threading
+from collections import OrderedDict
+
+import serial
+
+from pymindwave import parser
+from pymindwave.headset import COMMAND_BYTES, connect_command
+from pymindwave.stats import clock
+from pymindwave.transport import read_available
+
+# poll() events meaning the descriptor will not deliver data any more
+FAILED_EVENTS = (getattr(select, 'POLLHUP', 0) | getattr(select, 'POLLERR', 0) |
+                 getattr(select, 'POLLNVAL', 0))
+
+
+class Dongle(object):
+    "A dongle owned by DongleManager"
+
+    def __init__(self, device_id, dongle_dev, fstream, global_id=None):
+        self.device_id = device_id
+        self.dongle_dev = dongle_dev
+        self.fstream = fstream
+        self.fd = fstream.fileno()
+        self.global_id = global_id
+        self.parser = parser.VirtualParser()
+
+    def connect(self):
+        self.fstream.write(connect_command(self.global_id))
+
+    def disconnect(self):
+        self.fstream.write(COMMAND_BYTES['disconnect'])
+
+
+class DongleManager(object):
+    """Reads any number of dongles from one loop, see the module docstring.
+
+    Drive it with poll() from your own loop or call start() to run the loop
+    on one background thread. Subscriber callbacks run on that thread and
+    get the device id as first argument.
+
+    Dongles removed by poll() because they failed are listed in ``failed``
+    with the cause, and passed to the subscribe_failure() callbacks.
+    """
+
+    def __init__(self, timeout=0.05):
+        self.timeout = timeout
+        self.dongles = OrderedDict()
+        self.by_fd = {}
+        # (frame_types, callback) and raw callbacks for every dongle
+        self.subscribers = []
+        self.raw_subscribers = []
+        self.failure_subscribers = []
+        # device id -> cause, for dongles poll() gave up on
+        self.failed = OrderedDict()
+        self.running = False
+        self.thread = None
+        if hasattr(select, 'poll'):
+            self.poller = select.poll()
+        else:
+            self.poller = None
+
+    def add(self, dongle_dev, device_id=None, global_id=None, fstream=None):
+        """Start reading a dongle and return its device id.
+
+        ``device_id`` defaults to ``dongle_dev``. ``fstream`` is opened
+        from ``dongle_dev`` unless given, e.g. a pipe or a socket.
+        """
+        if device_id is None:
+            device_id = dongle_dev
+        if device_id in self.dongles:
+            raise ValueError('duplicate device id %r' % (device_id,))
+        if fstream is None:
+            fstream = serial.Serial(dongle_dev, 115200, timeout=0)
+        dongle = Dongle(device_id, dongle_dev, fstream, global_id)
+        for frame_types, callback in self.subscribers:
+            self._subscribe(dongle, frame_types, callback)
+        for callback in self.raw_subscribers:
+            self._subscribe_raw(dongle, callback)
+        self.dongles[device_id] = dongle
+        self.by_fd[dongle.fd] = dongle
+        if self.poller is not None:
+            self.poller.register(dongle.fd, select.POLLIN)
+        return device_id
+
+    def remove(self, device_id):
+        """Stop reading a dongle and close its stream.
+
+        Dongles that stop delivering data (unplugged, end of a pipe) are
+        removed by poll().
+        """
+        dongle = self.dongles.pop(device_id)
+        del self.by_fd[dongle.fd]
+        if self.poller is not None:
+            self.poller.unregister(dongle.fd)
+        try:
+            dongle.fstream.close()
+        except (IOError, OSError, serial.SerialException):
+            # closing an unplugged port can fail too
+            pass
+
+    def _fail(self, dongle, cause):
+        self.remove(dongle.device_id)
+        dongle.parser.dongle_state = 'disconnected'
+        dongle.parser.publish()
+        self.failed[dongle.device_id] = cause
+        for callback in self.failure_subscribers:
+            callback(dongle.device_id, cause)
+
+    def _subscribe(self, dongle, frame_types, callback):
+        device_id = dongle.device_id
+        dongle.parser.subscribe(frame_types,
+                                lambda frames: callback(device_id, frames))
+
+    def _subscribe_raw(self, dongle, callback):
+        device_id = dongle.device_id
+        dongle.parser.subscribe_raw(
+            lambda samples, times: callback(device_id, samples, times))
+
+    def subscribe(self, frame_types, callback):
+        """``callback(device_id, frames)`` for frame batches of every dongle.
+
+        ``frame_types`` is what VirtualParser.subscribe takes.
+        """
+        self.subscribers.append((frame_types, callback))
+        for dongle in self.dongles.values():
+            self._subscribe(dongle, frame_types, callback)
+
+    def subscribe_raw(self, callback):
+        "``callback(device_id, samples, times)``, see VirtualParser.subscribe_raw"
+        self.raw_subscribers.append(callback)
+        for dongle in self.dongles.values():
+            self._subscribe_raw(dongle, callback)
+
+    def subscribe_failure(self, callback):
+        "``callback(device_id, cause)`` when poll() drops a failed dongle"
+        self.failure_subscribers.append(callback)
+
+    def poll(self, timeout=None):
+        """Wait up to ``timeout`` seconds for data and parse what arrived.
+
+        Returns the number of frames decoded over all dongles.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if not self.by_fd:
+            return 0
+        if self.poller is not None:
+            ready = self.poller.poll(timeout * 1000)
+        else:
+            readable, _, _ = select.select(list(self.by_fd), [], [], timeout)
+            # no event bits: a failure shows as a read error or no data
+            ready = [(fd, 0) for fd in readable]
+        arrival = clock()
+        frames = 0
+        for fd, event in ready:
+            dongle = self.by_fd.get(fd)
+            if dongle is None:
+                continue
+            if event & FAILED_EVENTS and not event & select.POLLIN:
+                self._fail(dongle, 'hang-up')
+                continue
+            try:
+                data = read_available(dongle.fstream, fd)
+            except (IOError, OSError, serial.SerialException) as e:
+                self._fail(dongle, 'error: {0}'.format(e))
+                continue
+            if data:
+                frames += len(dongle.parser.feed(data, arrival))
+            else:
+                # readable but empty: the device went away
+                self._fail(dongle, 'closed')
+        return frames
+
+    def run(self):
+        while self.running:
+            self.poll()
+
+    def start(self):
+        "Run the loop on a background thread"
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def connect(self, device_id=None):
+        "Connect one dongle, or all of them"
+        for dongle in self._select(device_id):
+            dongle.connect()
+
+    def disconnect(self, device_id=None):
+        for dongle in self._select(device_id):
+            dongle.disconnect()
+
+    def _select(self, device_id):
+        if device_id is None:
+            return list(self.dongles.values())
+        return [self.dongles[device_id]]
+
+    def get_state(self, device_id):
+        return self.dongles[device_id].parser.dongle_state
+
+    def get_stats(self):
+        "Per device link health snapshots, see VirtualParser.get_stats"
+        stats = OrderedDict()
+        for device_id, dongle in self.dongles.items():
+            stats[device_id] = dongle.parser.get_stats()
+            stats[device_id]['state'] = dongle.parser.dongle_state
+        return stats
+
+    def destroy(self):
+        self.stop()
+        for device_id in list(self.dongles):
+            self.remove(device_id)
@@ -1,11 +1,28 @@
-import struct
+from collections import namedtuple
 from time import time
-from time import sleep
-from numpy import mean
+from numpy import mean, column_stack, float64, savetxt
 import serial
 
+from pymindwave.buffers import ByteBuffer, SampleRing
+from pymindwave.delivery import QueuedSubscriber
+from pymindwave.stats import ParserStats, clock
+from pymindwave.timing import SampleClock
+from pymindwave.transport import make_reader, open_dongle
+
 
 SYNC_BYTES = [0xaa, 0xaa]
+SYNC = bytes(bytearray(SYNC_BYTES))
+
+# frame types for VirtualParser.subscribe and the codes they stand for
+FRAME_TYPES = {
+    'raw': (0x80,),
+    'waves': (0x83,),
+    'poor_signal': (0x02,),
+    'attention': (0x04,),
+    'meditation': (0x05,),
+    'blink_strength': (0x16,),
+    'state': (0xd0, 0xd1, 0xd2, 0xd3, 0xd4),
+}
 
 def bigend_24b(b1, b2, b3):
     return b1* 255 * 255 + 255 * b2 + b3
@@ -29,10 +46,50 @@ the impression, before reading the docs, that only the Mindset provides raw
 values, which is obviously not the case.
 
 The Mindwave ships with a TCP/IP server to provide apps a relatively easy way
-to access the data. Maybe I will write a substitute in Python in the future,
-but for now I am satisfied with using Python only.
+to access the data. pymindwave.server is a substitute in Python.
 """
 
+# values published after every batch of frames, see VirtualParser.values.
+# raw_count is the raw_ring counter at the time they were published
+Values = namedtuple('Values', [
+    'time', 'dongle_state', 'poor_signal', 'attention', 'meditation',
+    'blink_strength', 'waves', 'raw_count'])
+Snapshot = namedtuple('Snapshot', Values._fields + ('raw',))
+
+
+class Frame(object):
+    """One decoded packet. Fields the packet did not carry are None.
+
+    ``codes`` lists the codes of the rows in the packet. ``waves`` holds
+    delta, theta, low_alpha, high_alpha, low_beta, high_beta, low_gamma and
+    mid_gamma. ``raw_values`` holds every raw sample of the packet in order
+    and ``raw_value`` the last one. For other codes a packet that repeats a
+    code keeps the last value.
+    """
+    __slots__ = ('codes', 'raw_value', 'raw_values', 'poor_signal',
+                 'attention', 'meditation', 'blink_strength', 'waves',
+                 'dongle_state', 'global_id', 'error')
+
+    def __init__(self):
+        self.codes = None
+        self.raw_value = None
+        self.raw_values = None
+        self.poor_signal = None
+        self.attention = None
+        self.meditation = None
+        self.blink_strength = None
+        self.waves = None
+        self.dongle_state = None
+        self.global_id = None
+        self.error = None
+
+    def __repr__(self):
+        fields = ['%s=%r' % (name, getattr(self, name))
+                  for name in self.__slots__[1:]
+                  if getattr(self, name) is not None]
+        return 'Frame(%s)' % ', '.join(fields)
+
+
 class VirtualParser(object):
     
     """Setting callback:a call back can be associated with all the above 
@@ -43,7 +100,6 @@ class VirtualParser(object):
     __attention=0
     __meditation=0
     __raw_value=0
-    __raw_values=[]
     __delta=0
     __theta=0
     __low_alpha=0
@@ -55,22 +111,46 @@ class VirtualParser(object):
     __poor_signal=0
     __blink_strength=0 
 
-    callBacksDictionary={} #keep a track of all callbacks
-    
-    def __init__(self, input_fstream, raw_buffer_len=512):
-        #self.parser = self.run()
-        #self.parser.next()
+    def __init__(self, input_fstream=None, raw_buffer_len=512, reader=None,
+                 raw_ring_len=4096, sample_rate=512):
+        # keep a track of all callbacks, per parser so that several
+        # dongles in one process do not share them
+        self.callBacksDictionary = {}
         self.current_meditation = 0
         self.current_attention= 0
         self.current_blink_strength = 0
         self.current_spectrum = []
+        self.current_vector = []
+        # batch subscribers, see subscribe()
+        self.subscribers = []
+        self.raw_subscribers = []
+        self.raw_dispatched = 0
+        self.byte_subscribers = []
+        self.queued_subscribers = []
+        # replaced, never modified, so readers on other threads always
+        # see a coherent set of values
+        self.values = Values(clock(), 'initializing', 0, 0, 0, 0, (0,) * 8, 0)
         self.sending_data = False
         self.dongle_state ="initializing"
+        # last 0xd1/0xd3 error reported by the dongle
+        self.error = None
         self.raw_file = None
         self.esense_file = None
         self.input_fstream = input_fstream
-        self.input_stream = []
-        self.read_more_stream()
+        self.input_stream = ByteBuffer()
+        self.stats = ParserStats()
+        # raw samples, see raw_values for the list view older code uses
+        self.raw_ring = SampleRing(max(raw_ring_len, raw_buffer_len))
+        self.raw_block_start = 0
+        # acquisition time of every sample in raw_ring, same counter
+        self.raw_times = SampleRing(self.raw_ring.capacity, dtype=float64)
+        self.sample_clock = SampleClock(sample_rate)
+        # reader backend, see pymindwave.transport. Without an input stream
+        # the parser is driven with feed()
+        self.reader = None
+        if input_fstream is not None:
+            self.reader = reader or make_reader(input_fstream)
+            self.read_more_stream()
         self.raw_buffer_len = raw_buffer_len
         self.buffer_len = 512*3
 
@@ -79,141 +159,474 @@ class VirtualParser(object):
         self.dongle_state = 'connected'
 
     def read_more_stream(self):
-        self.input_stream += [ord(b) for b in list(self.input_fstream.read(1000))]
-        sleep(0.1)
+        if self.reader is not None:
+            self._buffer(self.reader.read())
+
+    def _buffer(self, data):
+        if data:
+            for callback in self.byte_subscribers:
+                callback(data)
+        self.input_stream.write(data)
+        stats = self.stats
+        stats.bytes_read += len(data)
+        if len(self.input_stream) > stats.buffer_high_water:
+            stats.buffer_high_water = len(self.input_stream)
+
+    def read_latency(self):
+        "Latency histograms of the reader backend"
+        return self.reader.latency()
 
     def parse_payload(self, payload):
-        while len(payload) > 0:
+        """Decode one checksummed payload and return it as a Frame.
+
+        ``payload`` can be any sequence of ints (list, bytearray); it is
+        walked with an index instead of being popped from.
+        """
+        frame = Frame()
+        codes = frame.codes = []
+        i = 0
+        n = len(payload)
+        while i < n:
             #@TODO parse excode?  13.07 2013 (houqp)
-            code = payload.pop(0)
+            code = payload[i]
             if code >= 0x80:
-                vlen = payload.pop(0)
-                # multi-byte codes
-                if code == 0x80:
+                if i + 1 >= n:
+                    break
+                vlen = payload[i + 1]
+                v = i + 2
+                # multi-byte rows always span vlen bytes, whether or not we
+                # understand the code; rows too short for their code are
+                # ignored like unknown codes
+                i = v + vlen
+                if i > n:
+                    break
+                codes.append(code)
+                if code == 0x80 and vlen >= 2:
                     self.is_sending_data()
-                    high_word = payload.pop(0)
-                    low_word = payload.pop(0)
-                    value = high_word * 256 + low_word
-                    if value > 32768:
+                    value = payload[v] * 256 + payload[v + 1]
+                    if value >= 32768:
                         value -= 65536
-                    self.raw_value = value
-                elif code == 0x83:
+                    frame.raw_value = value
+                    if frame.raw_values is None:
+                        frame.raw_values = (value,)
+                    else:
+                        frame.raw_values += (value,)
+                elif code == 0x83 and vlen >= 24:
                     self.is_sending_data()
                     # ASIC_EEG_POWER_INT
                     # delta, theta, low-alpha, high-alpha, low-beta, high-beta,
                     # low-gamma, high-gamma
-                    self.delta=bigend_24b(payload.pop(0), payload.pop(0), payload.pop(0))
-                    self.theta=bigend_24b(payload.pop(0), payload.pop(0), payload.pop(0))
-                    self.low_alpha=bigend_24b(payload.pop(0), payload.pop(0), payload.pop(0))
-                    self.high_alpha=bigend_24b(payload.pop(0), payload.pop(0), payload.pop(0))
-                    self.low_beta=bigend_24b(payload.pop(0), payload.pop(0), payload.pop(0))
-                    self.high_beta=bigend_24b(payload.pop(0), payload.pop(0), payload.pop(0))
-                    self.low_gamma=bigend_24b(payload.pop(0), payload.pop(0), payload.pop(0))
-                    self.mid_gamma=bigend_24b(payload.pop(0), payload.pop(0), payload.pop(0))
-
-                elif code == 0xd0:
+                    frame.waves = (
+                        bigend_24b(payload[v], payload[v + 1], payload[v + 2]),
+                        bigend_24b(payload[v + 3], payload[v + 4], payload[v + 5]),
+                        bigend_24b(payload[v + 6], payload[v + 7], payload[v + 8]),
+                        bigend_24b(payload[v + 9], payload[v + 10], payload[v + 11]),
+                        bigend_24b(payload[v + 12], payload[v + 13], payload[v + 14]),
+                        bigend_24b(payload[v + 15], payload[v + 16], payload[v + 17]),
+                        bigend_24b(payload[v + 18], payload[v + 19], payload[v + 20]),
+                        bigend_24b(payload[v + 21], payload[v + 22], payload[v + 23]))
+
+                elif code == 0xd0 and vlen >= 2:
                     # headset found
                     # 0xaa 0xaa 0x04 0xd0 0x02 0x05 0x05 0x23
-                    self.global_id = 255 * payload.pop(0) + payload.pop(0)
-                    self.dongle_state = 'connected'
+                    self.global_id = frame.global_id = \
+                        256 * payload[v] + payload[v + 1]
+                    self.dongle_state = frame.dongle_state = 'connected'
                 elif code == 0xd1:
                     # headset not found
                     # 0xaa 0xaa 0x04 0xd1 0x02 0x05 0x05 0xf2
-                    self.error = 'not found'
-                elif code == 0xd2:
+                    self.error = frame.error = 'not found'
+                elif code == 0xd2 and vlen >= 2:
                     # 0xaa 0xaa 0x04 0xd2 0x02 0x05 0x05 0x21
-                    self.disconnected_global_id = 255 * payload.pop(0) + payload.pop(0)
-                    self.dongle_state = 'disconnected'
+                    self.disconnected_global_id = frame.global_id = \
+                        256 * payload[v] + payload[v + 1]
+                    self.dongle_state = frame.dongle_state = 'disconnected'
                 elif code == 0xd3:
                     # request denied
                     # 0xaa 0xaa 0x02 0xd3 0x00 0x2c
-                    self.error = 'request denied'
+                    self.error = frame.error = 'request denied'
                 elif code == 0xd4:
-                    # standby mode, only pop the useless byte
+                    # standby mode, the single value byte is useless
                     # 0xaa 0xaa 0x03 0xd4 0x01 0x00 0x2a
-                    self.dongle_state = 'standby'
-                    payload.pop(0)
+                    self.dongle_state = frame.dongle_state = 'standby'
                 else:
                     # unknown multi-byte codes
                     pass
             else:
                 # single-byte codes
-                val = payload.pop(0)
+                if i + 1 >= n:
+                    break
+                val = payload[i + 1]
+                i += 2
+                codes.append(code)
                 self.is_sending_data()
                 if code == 0x02:
-                    self.poor_signal = val
+                    frame.poor_signal = val
                 elif code == 0x04:
-                    self.attention = val
+                    frame.attention = val
                 elif code == 0x05:
-                    self.meditation = val
+                    frame.meditation = val
                 elif code == 0x16:
-                    self.blink_strength = val
+                    frame.blink_strength = val
                 else:
                     # unknown code
                     pass
+        self.apply_frame(frame)
+        return frame
 
-    def consume_stream(self):
-        while 1:
-            while self.input_stream[:2] != SYNC_BYTES:
-                retry = 0
-                while len(self.input_stream) <= 3:
-                    retry += 1
-                    if retry > 3:
-                        return False
-                    self.read_more_stream()
-                self.input_stream.pop(0)
-            # remove sync bytes
-            self.input_stream.pop(0)
-            self.input_stream.pop(0)
-            plen = 170
-            while plen == 170:
-                # we are in sync now
-                if len(self.input_stream) == 0:
-                    return False
-                plen = self.input_stream.pop(0)
-                if plen == 170:
-                    # in sync
-                    continue
+    def apply_frame(self, frame):
+        """Store the values of a decoded frame on the parser.
+
+        The property setters, and with them the per-field callbacks, only run
+        when a callback has been set with setCallBack. Otherwise the values
+        are stored directly. The current_* fields keep the last valid eSense
+        values and band vector.
+        """
+        raw = frame.raw_values
+        if self.callBacksDictionary:
+            started = clock()
+            if raw is not None:
+                for value in raw:
+                    self.raw_value = value
+            if frame.poor_signal is not None:
+                self.poor_signal = frame.poor_signal
+            if frame.waves is not None:
+                (self.delta, self.theta, self.low_alpha, self.high_alpha,
+                 self.low_beta, self.high_beta, self.low_gamma,
+                 self.mid_gamma) = frame.waves
+            if frame.attention is not None:
+                self.attention = frame.attention
+            if frame.meditation is not None:
+                self.meditation = frame.meditation
+            if frame.blink_strength is not None:
+                self.blink_strength = frame.blink_strength
+            self.stats.callback_time.record(clock() - started)
+        else:
+            if raw is not None:
+                self.__raw_value = raw[-1]
+                if len(raw) == 1:
+                    self.raw_ring.append(raw[0])
                 else:
-                    break
+                    self.raw_ring.extend(raw)
+            if frame.poor_signal is not None:
+                self.__poor_signal = frame.poor_signal
+            if frame.waves is not None:
+                (self.__delta, self.__theta, self.__low_alpha,
+                 self.__high_alpha, self.__low_beta, self.__high_beta,
+                 self.__low_gamma, self.__mid_gamma) = frame.waves
+            if frame.attention is not None:
+                self.__attention = frame.attention
+            if frame.meditation is not None:
+                self.__meditation = frame.meditation
+            if frame.blink_strength is not None:
+                self.__blink_strength = frame.blink_strength
+        if frame.waves is not None:
+            self.current_vector = list(frame.waves)
+        if frame.attention:
+            self.current_attention = frame.attention
+        if frame.meditation:
+            self.current_meditation = frame.meditation
+        if frame.blink_strength is not None:
+            self.current_blink_strength = frame.blink_strength
+
+    def consume_frame(self):
+        """Decode the next complete frame already in the input buffer.
+
+        Returns the decoded Frame, or None if the buffer does not hold a
+        complete frame yet. Nothing is read from the input stream, and
+        the bytes of an incomplete frame are left in place for the next call.
+        """
+        buf = self.input_stream
+        stats = self.stats
+        while 1:
+            start = buf.find(SYNC)
+            if start < 0:
+                # a trailing 0xaa may be the first half of the next sync
+                n = len(buf)
+                if n and buf[n - 1] == 0xaa:
+                    n -= 1
+                buf.consume(n)
+                stats.resync_bytes += n
+                return None
+            buf.consume(start)
+            stats.resync_bytes += start
+            n = len(buf)
+            # skip the sync bytes; further 0xaa bytes are still sync
+            i = 2
+            while i < n and buf[i] == 0xaa:
+                i += 1
+            if i >= n:
+                return None
+            plen = buf[i]
             if plen > 170:
                 # plen too large
+                buf.consume(i + 1)
+                stats.oversize_frames += 1
+                stats.resync_bytes += i + 1
                 continue
-
-            if (len(self.input_stream) < plen + 1):
-                # read the payload and checksum
-                self.read_more_stream()
-            if (len(self.input_stream) < plen + 1):
-                return False
-
-            chksum = 0
-            for bv in self.input_stream[:plen]:
-                chksum += bv
+            # payload is buf[i+1:end], the checksum is buf[end]
+            end = i + 1 + plen
+            if end >= n:
+                return None
+            payload = buf.slice(i + 1, end)
+            chksum = buf[end]
+            buf.consume(end + 1)
             # take the lowest byte and invert
-            chksum = chksum & ord('\xff')
-            chksum = (~chksum) & ord('\xff')
-            payload = self.input_stream[:plen+1]
-            self.input_stream = self.input_stream[plen+1:]
-            # pop chksum and compare
-            if chksum != payload.pop():
+            if (~sum(payload)) & 0xff != chksum:
                 # invalid payload, skip
+                stats.checksum_errors += 1
                 continue
-            else:
-                self.parse_payload(payload)
-                return
+            return self.parse_payload(payload)
+
+    def consume_stream(self):
+        "Decode one frame, reading more input if needed; False if none came"
+        retry = 0
+        frame = self.consume_frame()
+        while frame is None:
+            retry += 1
+            if retry > 3:
+                return False
+            self.read_more_stream()
+            frame = self.consume_frame()
+        return frame
+
+    def update(self, max_frames=1):
+        """Parse up to ``max_frames`` frames and return how many were parsed.
+
+        With the default of one frame more input is read whenever the buffer
+        does not hold a complete frame. With ``max_frames=None`` the input is
+        read once and every complete frame in the buffer is decoded, which
+        keeps a consumer that polls slower than the headset sends from
+        falling further and further behind.
+
+        Batch subscribers (see subscribe()) get the frames of this call once
+        it is done.
+        """
+        frames = []
+        if max_frames is None:
+            self.read_more_stream()
+            frame = self.consume_frame()
+            while frame is not None:
+                frames.append(frame)
+                frame = self.consume_frame()
+        else:
+            while len(frames) < max_frames:
+                frame = self.consume_stream()
+                if not frame:
+                    break
+                frames.append(frame)
+        arrival = None
+        if self.reader is not None:
+            arrival = self.reader.last_read_time
+            self.stamp_raw_samples(arrival)
+        self.dispatch(frames, arrival)
+        return len(frames)
+
+    def update_all(self):
+        "Drain mode: decode all buffered frames, see update()"
+        return self.update(max_frames=None)
+
+    def feed(self, data, arrival=None):
+        """Push-style entry point: buffer ``data`` and decode what it completes.
+
+        ``data`` may be cut anywhere, the bytes of a partial frame are kept
+        for the next call. Returns the list of decoded Frames. Nothing is
+        read from the input stream, so the parser can be driven from
+        sockets, replay files or an event loop (use VirtualParser(None)).
+        ``arrival`` is when ``data`` was received, on the stats.clock()
+        time base; it defaults to now.
+        """
+        if arrival is None:
+            arrival = clock()
+        self._buffer(data)
+        frames = []
+        frame = self.consume_frame()
+        while frame is not None:
+            frames.append(frame)
+            frame = self.consume_frame()
+        self.stamp_raw_samples(arrival)
+        self.dispatch(frames, arrival)
+        return frames
+
+    def subscribe(self, frame_types, callback):
+        """Get decoded frames in batches instead of one call per field.
+
+        ``frame_types`` is a name from FRAME_TYPES, a packet code, or a list
+        of them. ``callback(frames)`` is called once per update() or feed()
+        call with the list of Frames in that batch that carry any of those
+        codes.
+        """
+        if isinstance(frame_types, (str, int)):
+            frame_types = [frame_types]
+        codes = set()
+        for frame_type in frame_types:
+            codes.update(FRAME_TYPES.get(frame_type, (frame_type,)))
+        self.subscribers.append((frozenset(codes), callback))
+
+    def subscribe_raw(self, callback):
+        """Get raw samples as arrays, once per update() or feed() call.
+
+        ``callback(samples, times)`` receives the new samples and their
+        timestamps as views into raw_ring and raw_times (see SampleRing).
+        """
+        self.raw_subscribers.append(callback)
+        self.raw_dispatched = self.raw_ring.count
+
+    def subscribe_queued(self, frame_types, callback, maxsize=64,
+                         policy='drop_oldest'):
+        """Like subscribe(), but ``callback(frames)`` runs on a worker
+        thread behind a bounded queue, so it cannot hold up the reader.
+
+        ``policy`` says what happens when the queue is full, see
+        pymindwave.delivery. Returns the QueuedSubscriber, which has the
+        drop counters; pass it to unsubscribe() to stop it.
+        """
+        subscriber = QueuedSubscriber(callback, maxsize, policy)
+        self.subscribe(frame_types, subscriber.put)
+        self.queued_subscribers.append(subscriber)
+        return subscriber
+
+    def subscribe_raw_queued(self, callback, maxsize=64,
+                             policy='drop_oldest'):
+        "subscribe_raw() through a queue, see subscribe_queued()"
+        subscriber = QueuedSubscriber(callback, maxsize, policy, unpack=True)
+        self.subscribe_raw(subscriber.put_raw)
+        self.queued_subscribers.append(subscriber)
+        return subscriber
+
+    def subscribe_bytes(self, callback):
+        """Get every chunk of input bytes before it is parsed.
+
+        ``callback(data)`` runs on the reading thread, so it should only
+        hand the bytes on, e.g. to forward or record the stream.
+        """
+        self.byte_subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """Remove ``callback`` from the batch, raw and byte subscribers.
+
+        A QueuedSubscriber is closed after delivering what it has queued.
+        """
+        if isinstance(callback, QueuedSubscriber):
+            self.queued_subscribers.remove(callback)
+            self.unsubscribe(callback.put)
+            self.unsubscribe(callback.put_raw)
+            callback.close()
+            return
+        self.subscribers = [(codes, cb) for codes, cb in self.subscribers
+                            if cb != callback]
+        self.raw_subscribers = [cb for cb in self.raw_subscribers
+                                if cb != callback]
+        self.byte_subscribers = [cb for cb in self.byte_subscribers
+                                 if cb != callback]
+
+    def dispatch(self, frames, arrival=None):
+        """Hand a batch of frames to the subscribers.
+
+        ``arrival`` is when the bytes of the batch were read; it is used for
+        the read-to-dispatch latency in stats.
+        """
+        stats = self.stats
+        stats.count_frames(frames)
+        if frames:
+            self.publish()
+        now = clock()
+        # on the data path, so the rate does not depend on who polls it
+        stats.raw_rate.update(self.raw_ring.count, now)
+        if arrival is not None and frames:
+            stats.dispatch_latency.record(now - arrival)
+        for codes, callback in self.subscribers:
+            batch = [frame for frame in frames
+                     if not codes.isdisjoint(frame.codes)]
+            if batch:
+                started = clock()
+                callback(batch)
+                stats.callback_time.record(clock() - started)
+        if self.raw_subscribers and self.raw_times.count > self.raw_dispatched:
+            samples = self.raw_ring.since(self.raw_dispatched)
+            times = self.raw_times.since(self.raw_dispatched)
+            self.raw_dispatched = self.raw_times.count
+            for callback in self.raw_subscribers:
+                started = clock()
+                callback(samples, times)
+                stats.callback_time.record(clock() - started)
+
+    def publish(self):
+        """Replace ``values`` with the current state and raw counter.
+
+        dispatch() does this once per batch; call it after changing
+        dongle_state outside of a batch.
+        """
+        self.values = Values(
+            clock(), self.dongle_state, self.__poor_signal, self.__attention,
+            self.__meditation, self.__blink_strength,
+            (self.__delta, self.__theta, self.__low_alpha, self.__high_alpha,
+             self.__low_beta, self.__high_beta, self.__low_gamma,
+             self.__mid_gamma), self.raw_ring.count)
+
+    def snapshot(self, raw_len=None):
+        """Current values and raw window as one immutable Snapshot.
+
+        The values are those published after the last batch of frames
+        (see ``values``) and ``raw`` is a read-only copy of the
+        ``raw_len`` samples (raw_buffer_len by default) up to their
+        ``raw_count``, so both describe the same batch. Takes no locks and
+        is safe to call from any thread.
+        """
+        values = self.values
+        raw, _ = self.raw_ring.copy_latest(raw_len or self.raw_buffer_len,
+                                           values.raw_count)
+        return Snapshot(*(values + (raw,)))
 
-    def update(self):
-        self.consume_stream()
-        #input_stream = self.input_fstream.read(1000)
-        #for b in input_stream:
-            #self.parser.send(ord(b))	# Send each byte to the generator
+    def get_stats(self):
+        """Snapshot of the link health counters as a dict.
+
+        See ParserStats; the reader backend's latency histograms are
+        included under ``reader`` and the dropped sample count under
+        ``dropped_samples``.
+        """
+        snapshot = self.stats.snapshot(self.raw_ring.count)
+        snapshot['dropped_samples'] = self.dropped_samples
+        snapshot['subscribers'] = [subscriber.stats() for subscriber
+                                   in self.queued_subscribers]
+        if self.reader is not None:
+            snapshot['reader'] = self.reader.latency()
+        return snapshot
+
+    def stamp_raw_samples(self, arrival):
+        """Timestamp the raw samples decoded since the last call.
+
+        ``arrival`` is when the bytes holding them were read. The timestamps
+        come from the sample clock (see pymindwave.timing) and go into
+        raw_times. Samples lost on the radio link are reported to the
+        "dropped_samples" callback and written to the raw recording.
+        """
+        n = self.raw_ring.count - self.raw_times.count
+        if n <= 0 or arrival is None:
+            return
+        times, dropped = self.sample_clock.stamp(n, arrival)
+        self.raw_times.extend(times)
+        if dropped and "dropped_samples" in self.callBacksDictionary:
+            self.callBacksDictionary["dropped_samples"](dropped)
+        if self.raw_file:
+            values = self.raw_ring.latest(n)
+            savetxt(self.raw_file,
+                    column_stack((times[-len(values):] - self.raw_start_time,
+                                  values)),
+                    fmt=('%.4f', '%i'), delimiter=',')
+
+    @property
+    def dropped_samples(self):
+        "Number of raw samples lost on the radio link so far"
+        return self.sample_clock.dropped
 
     def write_serial(self, string):
         self.input_fstream.write(string)
 
     def start_raw_recording(self, file_name):
         self.raw_file = file(file_name, "wt")
-        self.raw_start_time = time()
+        # same time base as the raw sample timestamps
+        self.raw_start_time = clock()
 
     def start_esense_recording(self, file_name):
         self.esense_file = file(file_name, "wt")
@@ -229,93 +642,6 @@ class VirtualParser(object):
             self.esense_file.close()
             self.esense_file = None
 
-    def run(self):
-        """
-            This generator parses one byte at a time.
-        """
-        last = time()
-        i = 1
-        times = []
-        while 1:
-            byte = yield
-            if byte== 0xaa:
-                byte = yield # This byte should be "\aa" too
-                if byte== 0xaa:
-                    # packet synced by 0xaa 0xaa
-                    packet_length = yield
-                    packet_code = yield
-                    if packet_code == 0xd4:
-                        # standing by
-                        self.dongle_state= "standby"
-                    elif packet_code == 0xd0:
-                        self.dongle_state = "connected"
-                    elif packet_code == 0xd2:
-                        data_len = yield
-                        headset_id = yield
-                        headset_id += yield
-                        self.dongle_state = "disconnected"
-                    else:
-                        self.sending_data = True
-                        left = packet_length-2
-                        while left>0:
-                            if packet_code ==0x80: # raw value
-                                row_length = yield
-                                a = yield
-                                b = yield
-                                value = struct.unpack("<h",chr(a)+chr(b))[0]
-                                self.raw_values.append(value)
-                                if len(self.raw_values)>self.buffer_len:
-                                    self.raw_values = self.raw_values[-self.buffer_len:]
-                                left-=2
-
-                                if self.raw_file:
-                                    t = time()-self.raw_start_time
-                                    self.raw_file.write("%.4f,%i\n" %(t, value))
-                            elif packet_code == 0x02: # Poor signal
-                                a = yield
-                                self.poor_signal = a
-                                if a>0:
-                                    pass
-                                left-=1
-                            elif packet_code == 0x04: # Attention (eSense)
-                                a = yield
-                                if a>0:
-                                    v = struct.unpack("b",chr(a))[0]
-                                    if v>0:
-                                        self.current_attention = v
-                                        if self.esense_file:
-                                            self.esense_file.write("%.2f,,%i\n" % (time()-self.esense_start_time, v))
-                                left-=1
-                            elif packet_code == 0x05: # Meditation (eSense)
-                                a = yield
-                                if a>0:
-                                    v = struct.unpack("b",chr(a))[0]
-                                    if v>0:
-                                        self.current_meditation = v
-                                        if self.esense_file:
-                                            self.esense_file.write("%.2f,%i,\n" % (time()-self.esense_start_time, v))
-
-                                left-=1
-                            elif packet_code == 0x16: # Blink Strength
-                                self.current_blink_strength = yield
-                                left-=1
-                            elif packet_code == 0x83:
-                                vlength = yield
-                                self.current_vector = []
-                                for row in range(8):
-                                    a = yield
-                                    b = yield
-                                    c = yield
-                                    value = a*255*255+b*255+c
-                                    #value = c*255*255+b*255+a
-                                    self.current_vector.append(value)
-                                left -= vlength
-                            packet_code = yield
-                else:
-                    pass # sync failed
-            else:
-                pass # sync failed
-    
     def setCallBack(self,variable_name,callback_function):
         """Setting callback:a call back can be associated with all the above variables so that a function is called when the variable is updated. Syntax: setCallBack("variable",callback_function)
            for eg. to set a callback for attention data the syntax will be setCallBack("attention",callback_function)"""
@@ -331,7 +657,7 @@ class VirtualParser(object):
     @attention.setter
     def attention(self,value):
         self.__attention=value
-        if self.callBacksDictionary.has_key("attention"): #if callback has been set, execute the function
+        if "attention" in self.callBacksDictionary: #if callback has been set, execute the function
             self.callBacksDictionary["attention"](self.__attention)
             
     #meditation
@@ -342,7 +668,7 @@ class VirtualParser(object):
     @meditation.setter
     def meditation(self,value):
         self.__meditation=value
-        if self.callBacksDictionary.has_key("meditation"): #if callback has been set, execute the function
+        if "meditation" in self.callBacksDictionary: #if callback has been set, execute the function
             self.callBacksDictionary["meditation"](self.__meditation)
             
     #raw_value
@@ -353,21 +679,24 @@ class VirtualParser(object):
     @raw_value.setter
     def raw_value(self,value):
         self.__raw_value=value
-        self.__raw_values.append(value)
-        if self.callBacksDictionary.has_key("raw_value"): #if callback has been set, execute the function
+        ring = self.raw_ring
+        ring.append(value)
+        if "raw_value" in self.callBacksDictionary: #if callback has been set, execute the function
             self.callBacksDictionary["raw_value"](self.__raw_value)
-        if len(self.__raw_values) == self.raw_buffer_len: 
-            if self.callBacksDictionary.has_key("raw_values"): #if callback has been set, execute the function
-                self.callBacksDictionary["raw_values"](self.__raw_values)
-                del self.__raw_values[:]
-            else:
-                self.__raw_values.pop(0)
+        if ring.count - self.raw_block_start >= self.raw_buffer_len:
+            if "raw_values" in self.callBacksDictionary: #if callback has been set, execute the function, once per block of raw_buffer_len samples
+                self.callBacksDictionary["raw_values"](ring.since(self.raw_block_start).tolist())
+                self.raw_block_start = ring.count
 
     #raw_values
     @property
     def raw_values(self):
-        "Get value for raw_values"
-        return self.__raw_values
+        """Get value for raw_values: a list of the samples of the current block
+        if a raw_values callback is set, else of the last raw_buffer_len
+        samples. Use raw_ring to get arrays without the list conversion."""
+        if "raw_values" in self.callBacksDictionary:
+            return self.raw_ring.since(self.raw_block_start).tolist()
+        return self.raw_ring.latest(self.raw_buffer_len).tolist()
 
     #delta
     @property
@@ -377,7 +706,7 @@ class VirtualParser(object):
     @delta.setter
     def delta(self,value):
         self.__delta=value
-        if self.callBacksDictionary.has_key("delta"): #if callback has been set, execute the function
+        if "delta" in self.callBacksDictionary: #if callback has been set, execute the function
             self.callBacksDictionary["delta"](self.__delta)
 
     #theta
@@ -388,7 +717,7 @@ class VirtualParser(object):
     @theta.setter
     def theta(self,value):
         self.__theta=value
-        if self.callBacksDictionary.has_key("theta"): #if callback has been set, execute the function
+        if "theta" in self.callBacksDictionary: #if callback has been set, execute the function
             self.callBacksDictionary["theta"](self.__theta)
 
     #low_alpha
@@ -399,7 +728,7 @@ class VirtualParser(object):
     @low_alpha.setter
     def low_alpha(self,value):
         self.__low_alpha=value
-        if self.callBacksDictionary.has_key("low_alpha"): #if callback has been set, execute the function
+        if "low_alpha" in self.callBacksDictionary: #if callback has been set, execute the function
             self.callBacksDictionary["low_alpha"](self.__low_alpha)
 
     #high_alpha
@@ -410,7 +739,7 @@ class VirtualParser(object):
     @high_alpha.setter
     def high_alpha(self,value):
         self.__high_alpha=value
-        if self.callBacksDictionary.has_key("high_alpha"): #if callback has been set, execute the function
+        if "high_alpha" in self.callBacksDictionary: #if callback has been set, execute the function
             self.callBacksDictionary["high_alpha"](self.__high_alpha)
 
 
@@ -422,7 +751,7 @@ class VirtualParser(object):
     @low_beta.setter
     def low_beta(self,value):
         self.__low_beta=value
-        if self.callBacksDictionary.has_key("low_beta"): #if callback has been set, execute the function
+        if "low_beta" in self.callBacksDictionary: #if callback has been set, execute the function
             self.callBacksDictionary["low_beta"](self.__low_beta)
 
     #high_beta
@@ -433,7 +762,7 @@ class VirtualParser(object):
     @high_beta.setter
     def high_beta(self,value):
         self.__high_beta=value
-        if self.callBacksDictionary.has_key("high_beta"): #if callback has been set, execute the function
+        if "high_beta" in self.callBacksDictionary: #if callback has been set, execute the function
             self.callBacksDictionary["high_beta"](self.__high_beta)
 
     #low_gamma
@@ -444,7 +773,7 @@ class VirtualParser(object):
     @low_gamma.setter
     def low_gamma(self,value):
         self.__low_gamma=value
-        if self.callBacksDictionary.has_key("low_gamma"): #if callback has been set, execute the function
+        if "low_gamma" in self.callBacksDictionary: #if callback has been set, execute the function
             self.callBacksDictionary["low_gamma"](self.__low_gamma)
 
     #mid_gamma
@@ -455,7 +784,7 @@ class VirtualParser(object):
     @mid_gamma.setter
     def mid_gamma(self,value):
         self.__mid_gamma=value
-        if self.callBacksDictionary.has_key("mid_gamma"): #if callback has been set, execute the function
+        if "mid_gamma" in self.callBacksDictionary: #if callback has been set, execute the function
             self.callBacksDictionary["mid_gamma"](self.__mid_gamma)
     
     #poor_signal
@@ -466,7 +795,7 @@ class VirtualParser(object):
     @poor_signal.setter
     def poor_signal(self,value):
         self.__poor_signal=value
-        if self.callBacksDictionary.has_key("poor_signal"): #if callback has been set, execute the function
+        if "poor_signal" in self.callBacksDictionary: #if callback has been set, execute the function
             self.callBacksDictionary["poor_signal"](self.__poor_signal)
     
     #blink_strength
@@ -477,14 +806,16 @@ class VirtualParser(object):
     @blink_strength.setter
     def blink_strength(self,value):
         self.__blink_strength=value
-        if self.callBacksDictionary.has_key("blink_strength"): #if callback has been set, execute the function
+        if "blink_strength" in self.callBacksDictionary: #if callback has been set, execute the function
             self.callBacksDictionary["blink_strength"](self.__blink_strength)
 
 
 class Parser(VirtualParser):
-    def __init__(self, serial_dev='/dev/ttyUSB0'):
-        self.dongle = serial.Serial(serial_dev,  115200, timeout=0.001)
-        VirtualParser.__init__(self, self.dongle)
+    def __init__(self, serial_dev='/dev/ttyUSB0', latency_budget=None):
+        self.dongle = open_dongle(serial_dev)
+        VirtualParser.__init__(
+            self, self.dongle,
+            reader=make_reader(self.dongle, latency_budget))
 
 
 
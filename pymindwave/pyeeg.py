@@ -28,12 +28,24 @@ Functions listed alphabetically
 
 """
 
-from numpy.fft import fft
+from collections import OrderedDict
+from numpy.fft import fft, rfft
 from numpy import zeros, floor, log10, log, mean, array, sqrt, vstack, cumsum, \
 				  ones, log2, std
+from numpy import asarray, float64, arange, argsort, searchsorted, \
+				  flatnonzero, concatenate, finfo, int64, where, maximum, add
+from numpy.lib.stride_tricks import as_strided
 from numpy.linalg import svd, lstsq
 import time
 
+try:
+	from scipy.spatial import cKDTree
+except ImportError:
+	cKDTree = None
+
+# samp_entropy(Method = 'auto') counts with a k-d tree above this length
+KDTREE_MIN_LENGTH = 4096
+
 ######################## Functions contributed by Xin Liu #################
 
 def hurst(X):
@@ -91,13 +103,17 @@ def hurst(X):
 
 ######################## Begin function definitions #######################
 
-def embed_seq(X,Tau,D):
+def embed_seq(X,Tau,D,copy=False):
 	"""Build a set of embedding sequences from given time series X with lag Tau
 	and embedding dimension DE. Let X = [x(1), x(2), ... , x(N)], then for each
 	i such that 1 < i <  N - (D - 1) * Tau, we build an embedding sequence,
 	Y(i) = [x(i), x(i + Tau), ... , x(i + (D - 1) * Tau)]. All embedding 
 	sequence are placed in a matrix Y.
 
+	Y is a read-only view on the samples of X, built with stride tricks in 
+	constant time and without copying, unless copy is set. A float64 array X
+	is used as is, anything else is converted to one first.
+
 	Parameters
 	----------
 
@@ -116,11 +132,16 @@ def embed_seq(X,Tau,D):
 
 		the embedding dimension
 
+	copy
+		boolean
+
+		return a writeable copy instead of a view
+
 	Returns
 	-------
 
 	Y
-		2-D list
+		2-D array
 
 		embedding matrix built
 
@@ -165,10 +186,12 @@ def embed_seq(X,Tau,D):
 		print "Tau has to be at least 1"
 		exit()
 
-	Y=zeros((N - (D - 1) * Tau, D))
-	for i in xrange(0, N - (D - 1) * Tau):
-		for j in xrange(0, D):
-			Y[i][j] = X[i + j * Tau]
+	X = asarray(X, dtype = float64)
+	Stride = X.strides[0]
+	Y = as_strided(X, shape = (N - (D - 1) * Tau, D),
+				   strides = (Stride, Tau * Stride), writeable = False)
+	if copy:
+		return Y.copy()
 	return Y
 
 def in_range(Template, Scroll, Distance):
@@ -286,17 +309,128 @@ def bin_power(X,Band,Fs):
 		spectral power in each frequency bin normalized by total power in ALL 
 		frequency bins.
 
+	Notes
+	-----
+	The bin edges of a (len(X), Fs, Band) combination are computed once and
+	cached, see spectral_plan().
+
+	"""
+
+	X = asarray(X, dtype = float64)
+	return spectral_plan(len(X), Fs, Band).power(X)
+
+class SpectralPlan(object):
+	"""Precomputed FFT bin edges for bin_power() on series of length N 
+	sampled at Fs, with the boundary frequencies Band.
+
+	Band i sums the FFT magnitudes from floor(Band[i] / Fs * N) up to but 
+	not including floor(Band[i + 1] / Fs * N). When all edges are at or 
+	below the Nyquist frequency, as they should be, only the rfft of X is 
+	computed; otherwise the full fft, so the mirrored bins are summed as 
+	before. All bands are summed by a single np.add.reduceat.
 	"""
 
-	C = fft(X)
-	C = abs(C)
-	Power =zeros(len(Band)-1);
-	for Freq_Index in xrange(0,len(Band)-1):
-		Freq = float(Band[Freq_Index])										## Xin Liu
-		Next_Freq = float(Band[Freq_Index+1])
-		Power[Freq_Index] = sum(C[floor(Freq/Fs*len(X)):floor(Next_Freq/Fs*len(X))])
-	Power_Ratio = Power/sum(Power)
-	return Power, Power_Ratio	
+	def __init__(self, N, Fs, Band):
+		self.N = N
+		self.Fs = Fs
+		self.Band = tuple(Band)
+		Edges = [int(floor(float(Freq) / Fs * N)) for Freq in self.Band]
+		Lo, Hi = array(Edges[:-1]), array(Edges[1:])
+		self.Real = max(Edges) <= N // 2 + 1
+		Bins = N // 2 + 1 if self.Real else N
+		# slices past the end are cut, and empty bands sum to 0
+		Lo, Hi = Lo.clip(0, Bins), Hi.clip(0, Bins)
+		self.Empty = Lo >= Hi
+		# reduceat sums from one index to the next, the odd results are the
+		# gaps between bands; index Bins is a zero added to the spectrum
+		self.Indices = vstack((Lo, Hi)).T.ravel()
+
+	def spectrum(self, X):
+		"FFT magnitudes of X along its last axis, with a zero appended"
+		if self.Real:
+			C = abs(rfft(X))
+		else:
+			C = abs(fft(X))
+		Pad = zeros(C.shape[:-1] + (1,))
+		return concatenate((C, Pad), axis = -1)
+
+	def power(self, X):
+		"Power and Power_Ratio of X as returned by bin_power()"
+		Power = add.reduceat(self.spectrum(X), self.Indices, axis = -1)[..., ::2]
+		Power[..., self.Empty] = 0
+		Power_Ratio = Power / Power.sum(axis = -1)[..., None]
+		return Power, Power_Ratio
+
+Spectral_Plans = OrderedDict()
+Spectral_Plan_Cache_Size = 32
+
+def spectral_plan(N, Fs, Band):
+	"""The SpectralPlan for (N, Fs, Band), from a small LRU cache"""
+	Key = (N, Fs, tuple(Band))
+	Plan = Spectral_Plans.pop(Key, None)
+	if Plan is None:
+		Plan = SpectralPlan(N, Fs, Band)
+		if len(Spectral_Plans) >= Spectral_Plan_Cache_Size:
+			Spectral_Plans.popitem(last = False)
+	Spectral_Plans[Key] = Plan
+	return Plan
+
+def sliding_windows(X, Window, Hop):
+	"""Read-only view of the windows of length Window of the 1-D series X,
+	starting every Hop samples, as a (windows x Window) array. Like 
+	embed_seq(), nothing is copied."""
+	X = asarray(X, dtype = float64)
+	Count = (len(X) - Window) // Hop + 1
+	if Window > len(X) or Count < 1 or Hop < 1:
+		raise ValueError("need 0 < Hop and Window <= len(X)")
+	Stride = X.strides[0]
+	return as_strided(X, shape = (Count, Window),
+					  strides = (Hop * Stride, Stride), writeable = False)
+
+def spectral_features(X, Band, Fs, Window = None, Hop = None, Chunk = 256):
+	"""Compute bin_power() and spectral_entropy() of many windows at once.
+
+	Parameters
+	----------
+
+	X
+		2-D array
+
+		one window (epoch) per row. Or, with Window given, a 1-D series 
+		that is cut into windows of Window samples every Hop samples 
+		(default Window, i.e. no overlap), see sliding_windows().
+
+	Band, Fs
+		as for bin_power()
+
+	Chunk
+		integer
+
+		number of windows transformed at a time, which bounds the memory 
+		used for the spectra
+
+	Returns
+	-------
+
+	Power, Power_Ratio, Spectral_Entropy
+		arrays with one row, or for Spectral_Entropy one value, per window,
+		equal to what bin_power() and spectral_entropy() return for it
+
+	"""
+	if Window is not None:
+		X = sliding_windows(X, Window, Hop or Window)
+	X = asarray(X, dtype = float64)
+	Windows, N = X.shape
+	Plan = spectral_plan(N, Fs, Band)
+	Power = zeros((Windows, len(Band) - 1))
+	Power_Ratio = zeros((Windows, len(Band) - 1))
+	for A in xrange(0, Windows, Chunk):
+		Power[A:A + Chunk], Power_Ratio[A:A + Chunk] = \
+			Plan.power(X[A:A + Chunk])
+	# spectral_entropy() leaves out the last bin too
+	Terms = Power_Ratio[:, :-1] * log(Power_Ratio[:, :-1])
+	Spectral_Entropy = -1 * Terms.sum(axis = 1) / log(len(Band) - 1)
+	return Power, Power_Ratio, Spectral_Entropy
 
 def first_order_diff(X):
 	""" Compute the first order difference of a time series.
@@ -337,24 +471,47 @@ def pfd(X, D=None):
 
 
 def hfd(X, Kmax):
-	""" Compute Hjorth Fractal Dimension of a time series X, kmax
+	""" Compute Higuchi Fractal Dimension of a time series X, kmax
 	 is an HFD parameter
+
+	See hfd_batch() for how the curve lengths are computed.
+	"""
+	return hfd_batch(asarray(X, dtype = float64)[None, :], Kmax)[0]
+
+def hfd_batch(X, Kmax):
+	"""Compute the Higuchi Fractal Dimension of every row of the 2-D array X,
+	e.g. a set of equally long windows.
+
+	For each k < Kmax and offset m < k, the curve length L(m, k) sums the
+	first floor((N - m) / k) - 1 absolute differences of X[m::k], and is 
+	normalized by (N - 1) / (floor((N - m) / k) * k); note that this leaves
+	out the last increment of the usual definition. The HFD is the slope of 
+	log(mean over m of L(m, k)) against log(1 / k), fitted for all rows in 
+	one least squares solve.
+
+	The increments of all offsets of a k come from one strided difference,
+	X[:, k:] - X[:, :-k], summed by a cumulative sum down its columns, so
+	the cost is O(N) NumPy work per k instead of a loop over samples.
 	"""
-	L = [];
+	X = asarray(X, dtype = float64)
+	Windows, N = X.shape
+	L = zeros((Kmax - 1, Windows))
 	x = []
-	N = len(X)
-	for k in xrange(1,Kmax):
-		Lk = []
-		for m in xrange(0,k):
-			Lmk = 0
-			for i in xrange(1,int(floor((N-m)/k))):
-				Lmk += abs(X[m+i*k] - X[m+i*k-k])
-			Lmk = Lmk*(N - 1)/floor((N - m) / float(k)) / k
-			Lk.append(Lmk)
-		L.append(log(mean(Lk)))
+	for k in xrange(1, Kmax):
+		Offsets = arange(k)
+		N_m = (N - Offsets) // k
+		# column m holds the increments of X[m::k]
+		Rows = -(-(N - k) // k)
+		Diff = zeros((Windows, Rows * k))
+		Diff[:, :N - k] = abs(X[:, k:] - X[:, :-k])
+		Sums = cumsum(Diff.reshape(Windows, Rows, k), axis = 1)
+		Used = N_m - 1
+		Lmk = where(Used > 0, Sums[:, maximum(Used - 1, 0), Offsets], 0)
+		Lmk = Lmk * (N - 1) / N_m.astype(float64) / k
+		L[k - 1] = log(mean(Lmk, axis = 1))
 		x.append([log(float(1) / k), 1])
-	
-	(p, r1, r2, s)=lstsq(x, L)
+
+	(p, r1, r2, s)=lstsq(x, L, rcond = -1)
 	return p[0]
 
 def hjorth(X, D = None):
@@ -497,7 +654,7 @@ def svd_entropy(X, Tau, DE, W = None):
 	"""
 
 	if W is None:
-		Y = EmbedSeq(X, tau, dE)
+		Y = embed_seq(X, Tau, DE)
 		W = svd(Y, compute_uv = 0)
 		W /= sum(W) # normalize singular values
 
@@ -577,7 +734,7 @@ def fisher_info(X, Tau, DE, W = None):
 	
 	return FI
 
-def ap_entropy(X, M, R):
+def ap_entropy(X, M, R, Method = 'auto'):
 	"""Computer approximate entropy (ApEN) of series X, specified by M and R.
 
 	Suppose given time series is X = [x(1), x(2), ... , x(N)]. We first build
@@ -616,7 +773,6 @@ def ap_entropy(X, M, R):
 	-----
 	
 	#. Please be aware that self-match is also counted in ApEn. 
-	#. This function now runs very slow. We are still trying to speed it up.
 
 	References
 	----------
@@ -630,48 +786,31 @@ def ap_entropy(X, M, R):
 	
 	Notes
 	-----
-	Extremely slow implementation. Do NOT use if your dataset is not small.
+	Matches are counted by match_counts(), exactly, but a window still
+	costs O(N^2) comparisons; see there for Method.
 
 	"""
 	N = len(X)
 
-	Em = embed_seq(X, 1, M)	
-	Emp = embed_seq(X, 1, M + 1) #	try to only build Emp to save time
-
-	Cm, Cmp = zeros(N - M + 1), zeros(N - M)
-	# in case there is 0 after counting. Log(0) is undefined.
-
-	for i in xrange(0, N - M):
-#		print i
-		for j in xrange(i, N - M): # start from i, self-match counts in ApEn
-#			if max(abs(Em[i]-Em[j])) <= R:# compare N-M scalars in each subseq v 0.01b_r1
-			if in_range(Em[i], Em[j], R):
-				Cm[i] += 1																						### Xin Liu
-				Cm[j] += 1
-				if abs(Emp[i][-1] - Emp[j][-1]) <= R: # check last one
-					Cmp[i] += 1
-					Cmp[j] += 1
-		if in_range(Em[i], Em[N-M], R):
-			Cm[i] += 1
-			Cm[N-M] += 1
-		# try to count Cm[j] and Cmp[j] as well here
-	
-#		if max(abs(Em[N-M]-Em[N-M])) <= R: # index from 0, so N-M+1 is N-M  v 0.01b_r1
-#	if in_range(Em[i], Em[N - M], R):  # for Cm, there is one more iteration than Cmp
-#			Cm[N - M] += 1 # cross-matches on Cm[N - M]
-	
-	Cm[N - M] += 1 # Cm[N - M] self-matches
-#	import code;code.interact(local=locals())
+	# matches of every row of Em with the other rows, and of the first N - M
+	# rows of Emp with each other (x(N + 1) does not exist, so the last row 
+	# of Em has no Emp row)
+	Match, Match_Next = match_counts(X, M, R, N - M + 1, Method)
+
+	# the reference implementation counted every self-match twice, except 
+	# for the last row of Em
+	Cm = Match + 2.0
+	Cm[N - M] -= 1
+	Cmp = Match_Next[:N - M] + 2.0
 	Cm /= (N - M +1 )
 	Cmp /= ( N - M )
-#	import code;code.interact(local=locals())
 	Phi_m, Phi_mp = sum(log(Cm)),  sum(log(Cmp))
 
 	Ap_En = (Phi_m - Phi_mp) / (N - M)
 
 	return Ap_En
 
-def samp_entropy(X, M, R):
+def samp_entropy(X, M, R, Method = 'auto'):
 	"""Computer sample entropy (SampEn) of series X, specified by M and R.
 
 	SampEn is very close to ApEn. 
@@ -713,31 +852,136 @@ def samp_entropy(X, M, R):
 
 	Notes
 	-----
-	Extremely slow computation. Do NOT use if your dataset is not small and you
-	are not patient enough.
+	SampEn only needs the total number of matching pairs. With Method
+	'kdtree' they are counted by scipy's cKDTree in the maximum norm, about
+	O(N log N) plus the number of matches; 'auto' uses it for series longer
+	than KDTREE_MIN_LENGTH when scipy is installed. Otherwise matches are
+	counted by match_counts(), exactly, at O(N^2) comparisons; see there for
+	the other Methods. Both give the same counts.
 
 	"""
 
 	N = len(X)
 
-	Em = embed_seq(X, 1, M)	
-	Emp = embed_seq(X, 1, M + 1)
+	if Method == 'kdtree' or (Method == 'auto' and cKDTree is not None and
+			N > KDTREE_MIN_LENGTH):
+		Pairs, Pairs_Next = kdtree_match_pairs(X, M, R, N - M)
+	else:
+		Match, Match_Next = match_counts(X, M, R, N - M, Method)
+		# every pair is counted from both ends
+		Pairs, Pairs_Next = Match.sum() / 2, Match_Next.sum() / 2
 
-	Cm, Cmp = zeros(N - M - 1) + 1e-100, zeros(N - M - 1) + 1e-100
-	# in case there is 0 after counting. Log(0) is undefined.
+	# the reference implementation started all N - M - 1 counts at 1e-100 
+	# in case nothing matches
+	Tiny = (N - M - 1) * 1e-100
+	Samp_En = log((Pairs + Tiny) / (Pairs_Next + Tiny))
 
-	for i in xrange(0, N - M):
-		for j in xrange(i + 1, N - M): # no self-match
-#			if max(abs(Em[i]-Em[j])) <= R:  # v 0.01_b_r1 
-			if in_range(Em[i], Em[j], R):
-				Cm[i] += 1
-#			if max(abs(Emp[i] - Emp[j])) <= R: # v 0.01_b_r1
-				if abs(Emp[i][-1] - Emp[j][-1]) <= R: # check last one
-					Cmp[i] += 1
+	return Samp_En
 
-	Samp_En = log(sum(Cm)/sum(Cmp))
+def kdtree_match_pairs(X, M, R, Rows):
+	"""Count matching template pairs with a k-d tree, see samp_entropy().
 
-	return Samp_En
+	Returns the number of pairs i < j < Rows of embedding vectors of length
+	M, and of length M + 1, that are no more than R apart in the maximum 
+	norm. All vectors must lie within X. Needs scipy.
+	"""
+	if cKDTree is None:
+		raise ImportError("Method 'kdtree' needs scipy")
+	X = asarray(X, dtype = float64)
+	Pairs = []
+	for Length in (M, M + 1):
+		Tree = cKDTree(embed_seq(X, 1, Length)[:Rows])
+		# ordered pairs, each vector with itself included
+		Ordered = Tree.count_neighbors(Tree, R, p = float('inf'))
+		Pairs.append((Ordered - Rows) // 2)
+	return Pairs[0], Pairs[1]
+
+def match_counts(X, M, R, Rows, Method = 'auto', Chunk = 2 ** 20):
+	"""Count template matches for ap_entropy() and samp_entropy().
+
+	For each of the first Rows embedding vectors u(i) = [x(i), ... , 
+	x(i + M - 1)], count the other vectors u(j), j < Rows, with 
+	max(abs(u(i) - u(j))) <= R, and how many of those also have 
+	abs(x(i + M) - x(j + M)) <= R. Samples past the end of X match nothing.
+
+	Parameters
+	----------
+
+	Method
+		string
+
+		'block' compares blocks of rows with all later rows at once, at most
+		Chunk comparisons at a time. 'sorted' sorts the vectors by their first 
+		sample and only compares vectors less than R apart in it, which is 
+		faster when R is small compared to the spread of X, and uses O(N)
+		memory. 'auto' picks 'sorted' when there are more than 256 rows and 
+		on average less than a tenth of them are candidates.
+
+	Both compare every row with every other row that may match, so the cost
+	grows as Rows ** 2. samp_entropy() only needs the totals and gets them 
+	from a k-d tree for long series instead, see kdtree_match_pairs().
+
+	Returns
+	-------
+
+	Match, Match_Next
+		1-D integer arrays of length Rows
+
+	"""
+	X = asarray(X, dtype = float64)
+	# a last sample too far from all others to match any
+	Ext = concatenate((X, [2 * abs(X).max() + 2 * R + 1]))
+	if Method not in ('auto', 'block', 'sorted'):
+		raise ValueError("Method must be 'auto', 'block' or 'sorted'")
+	Match = zeros(Rows, dtype = int64)
+	Match_Next = zeros(Rows, dtype = int64)
+
+	if Method != 'block':
+		Order = argsort(Ext[:Rows], kind = 'mergesort')
+		First = Ext[:Rows][Order]
+		# candidates for i are the following vectors less than R (plus 
+		# rounding slack) above it in the first sample; the exact test below
+		# decides
+		Slack = 4 * finfo(float64).eps * (abs(First) + R)
+		End = searchsorted(First, First + R + Slack, 'right')
+		if Method == 'auto':
+			Candidates = (End - arange(Rows)).mean()
+			Method = 'sorted' if Rows > 256 and Candidates < 0.1 * Rows \
+				else 'block'
+
+	if Method == 'block':
+		Block = max(1, Chunk // Rows)
+		for A in xrange(0, Rows, Block):
+			B = min(A + Block, Rows)
+			# only pairs i < j, each is counted for both rows
+			Close = arange(A, Rows)[None, :] > arange(A, B)[:, None]
+			for K in xrange(0, M):
+				Close &= abs(Ext[A + K:B + K, None] - Ext[None, A + K:Rows + K]) <= R
+			Match[A:B] += Close.sum(1)
+			Match[A:] += Close.sum(0)
+			Close &= abs(Ext[A + M:B + M, None] - Ext[None, A + M:Rows + M]) <= R
+			Match_Next[A:B] += Close.sum(1)
+			Match_Next[A:] += Close.sum(0)
+	elif Method == 'sorted':
+		Sorted = [Ext[K:K + Rows][Order] for K in xrange(0, M + 1)]
+		Width = (End - arange(Rows)).max()
+		Sorted_Match = zeros(Rows, dtype = int64)
+		Sorted_Next = zeros(Rows, dtype = int64)
+		for D in xrange(1, Width):
+			I = flatnonzero(End[:Rows - D] > arange(D, Rows))
+			J = I + D
+			Close = abs(Sorted[0][I] - Sorted[0][J]) <= R
+			for K in xrange(1, M):
+				Close &= abs(Sorted[K][I] - Sorted[K][J]) <= R
+			Sorted_Match[I] += Close
+			Sorted_Match[J] += Close
+			Close &= abs(Sorted[M][I] - Sorted[M][J]) <= R
+			Sorted_Next[I] += Close
+			Sorted_Next[J] += Close
+		Match[Order] = Sorted_Match
+		Match_Next[Order] = Sorted_Next
+
+	return Match, Match_Next
 
 def dfa(X, Ave = None, L = None):
 	"""Compute Detrended Fluctuation Analysis from a time series X and length of
@@ -0,0 +1,289 @@
+"""
+TCP server streaming decoded headset data to remote clients.
+
+A Python substitute for the ThinkGear Connector, the TCP/IP server Neurosky
+ships with the Mindwave. StreamServer subscribes to a VirtualParser (usually
+the one of an AsyncHeadset on the same event loop) and sends every client
+the fields it subscribed to:
+
+``raw``
+    raw samples in blocks of ``raw_block`` samples, with the timestamp of
+    the first sample
+``attention``, ``meditation``, ``poor_signal``, ``blink_strength``
+    eSense and signal values
+``waves``
+    the eight band powers
+``state``
+    dongle state changes
+
+Clients configure their connection by sending JSON lines::
+
+    {"subscribe": ["raw", "attention"]}
+    {"unsubscribe": ["attention"]}
+    {"format": "binary"}
+
+New clients get every field except ``raw``, as newline-delimited JSON.
+The binary format sends ``<kind:u8><length:u16 LE><payload>`` messages;
+see encode_binary() and decode_binary().
+
+Each message is encoded once per format and the same bytes are written to
+every subscribed client, so a broadcast costs one write per client. Writes
+go to the asyncio transport until it pauses the protocol; after that they
+queue on the client. A client is disconnected instead of buffered forever
+when the bytes it has not taken (queued plus the transport's write buffer)
+exceed ``max_buffer``, or when it stays paused for ``stall_timeout``
+seconds. The send buffer of every accepted socket is capped at ``sndbuf``
+bytes so that a stalled client shows up after kilobytes, not after the
+megabytes of the kernel's default buffers.
+
+The protocol classes only use asyncio for the listening socket, so this
+module imports on Python 2, but serving needs Python 3.4+.
+"""
+import json
+import socket
+import struct
+from collections import deque
+
+import numpy as np
+
+from pymindwave.buffers import BlockBuilder
+from pymindwave.stats import clock
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+FIELDS = ('raw', 'attention', 'meditation', 'poor_signal', 'blink_strength',
+          'waves', 'state')
+DEFAULT_FIELDS = frozenset(FIELDS[1:])
+WAVE_NAMES = ('delta', 'theta', 'low_alpha', 'high_alpha', 'low_beta',
+              'high_beta', 'low_gamma', 'mid_gamma')
+# binary message kinds are the positions in FIELDS
+KINDS = dict((field, kind) for kind, field in enumerate(FIELDS))
+HEADER = struct.Struct('<BH')
+
+
+def encode_json(field, value):
+    "One JSON line for ``field``; raw values are ``(time, samples)`` pairs"
+    if field == 'raw':
+        time, samples = value
+        message = {'raw': samples.tolist(), 'time': time}
+    elif field == 'waves':
+        message = {'waves': dict(zip(WAVE_NAMES, value))}
+    else:
+        message = {field: value}
+    return (json.dumps(message, separators=(',', ':')) + '\n').encode('ascii')
+
+
+def encode_binary(field, value):
+    """One binary message for ``field``.
+
+    Payloads: raw is a float64 time followed by int16 samples, waves are
+    eight uint32, state is the UTF-8 name and the other fields are an
+    int32. All little endian.
+    """
+    if field == 'raw':
+        time, samples = value
+        payload = struct.pack('<d', time) + \
+            samples.astype('<i2').tobytes()
+    elif field == 'waves':
+        payload = struct.pack('<8I', *value)
+    elif field == 'state':
+        payload = value.encode('utf-8')
+    else:
+        payload = struct.pack('<i', value)
+    return HEADER.pack(KINDS[field], len(payload)) + payload
+
+
+def decode_binary(data):
+    """Split ``data`` into messages.
+
+    Returns a list of ``(field, value)`` pairs and the bytes of an
+    incomplete message at the end.
+    """
+    messages = []
+    i = 0
+    while i + HEADER.size <= len(data):
+        kind, length = HEADER.unpack_from(data, i)
+        start = i + HEADER.size
+        if start + length > len(data):
+            break
+        payload = data[start:start + length]
+        field = FIELDS[kind]
+        if field == 'raw':
+            value = (struct.unpack_from('<d', payload)[0],
+                     np.frombuffer(payload[8:], dtype='<i2'))
+        elif field == 'waves':
+            value = struct.unpack('<8I', payload)
+        elif field == 'state':
+            value = payload.decode('utf-8')
+        else:
+            value = struct.unpack('<i', payload)[0]
+        messages.append((field, value))
+        i = start + length
+    return messages, data[i:]
+
+
+ENCODERS = {'json': encode_json, 'binary': encode_binary}
+
+
+class ClientProtocol(asyncio.Protocol if asyncio else object):
+    "One connected client of a StreamServer"
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.fields = set(DEFAULT_FIELDS)
+        self.format = 'json'
+        self.paused = False
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.paused_since = None
+        self.pending = b''
+        self.messages_sent = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        sock = transport.get_extra_info('socket')
+        if sock is not None and self.server.sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                            self.server.sndbuf)
+        transport.set_write_buffer_limits(high=self.server.high_water)
+        self.server.clients.add(self)
+
+    def connection_lost(self, exc):
+        self.server.clients.discard(self)
+        self.queue.clear()
+        self.queued_bytes = 0
+
+    def data_received(self, data):
+        lines = (self.pending + data).split(b'\n')
+        self.pending = lines.pop()
+        if len(self.pending) > 4096:
+            self.transport.close()
+            return
+        for line in lines:
+            if line.strip():
+                self.command(line)
+
+    def command(self, line):
+        try:
+            request = json.loads(line.decode('utf-8'))
+            for field in request.get('subscribe', ()):
+                if field not in KINDS:
+                    raise ValueError('unknown field %r' % (field,))
+                self.fields.add(field)
+            for field in request.get('unsubscribe', ()):
+                self.fields.discard(field)
+            if 'format' in request:
+                if request['format'] not in ENCODERS:
+                    raise ValueError('unknown format %r' % (request['format'],))
+                self.format = request['format']
+        except (ValueError, AttributeError, TypeError) as e:
+            # errors are always JSON, the client may be confused about
+            # the format too
+            self.transport.write(encode_json('error', str(e)))
+
+    def send(self, data):
+        if not self.paused:
+            self.transport.write(data)
+            self.messages_sent += 1
+            return
+        server = self.server
+        backlog = self.queued_bytes + self.transport.get_write_buffer_size()
+        stalled_for = clock() - self.paused_since
+        if backlog + len(data) > server.max_buffer or \
+                (server.stall_timeout and stalled_for > server.stall_timeout):
+            # stalled: drop the client rather than buffer forever
+            server.stalled += 1
+            self.queue.clear()
+            self.queued_bytes = 0
+            self.transport.abort()
+            return
+        self.queue.append(data)
+        self.queued_bytes += len(data)
+
+    def pause_writing(self):
+        self.paused = True
+        self.paused_since = clock()
+
+    def resume_writing(self):
+        self.paused = False
+        while self.queue and not self.paused:
+            data = self.queue.popleft()
+            self.queued_bytes -= len(data)
+            self.transport.write(data)
+            self.messages_sent += 1
+
+
+class StreamServer(object):
+    """Streams what ``parser`` decodes to TCP clients, see the module
+    docstring.
+
+    ``high_water`` is the transport write buffer (bytes) above which a
+    client's messages queue up. A client is disconnected when more than
+    ``max_buffer`` bytes wait for it or when it has not taken data for
+    ``stall_timeout`` seconds (None to wait forever). ``sndbuf`` caps the
+    kernel send buffer of every client socket.
+    """
+
+    def __init__(self, parser=None, raw_block=64, max_buffer=256 * 1024,
+                 high_water=64 * 1024, sndbuf=64 * 1024, stall_timeout=10.0):
+        self.clients = set()
+        self.max_buffer = max_buffer
+        self.high_water = high_water
+        self.sndbuf = sndbuf
+        self.stall_timeout = stall_timeout
+        self.stalled = 0
+        self.messages = 0
+        self.raw_blocks = BlockBuilder(raw_block, self.on_raw_block)
+        self.server = None
+        if parser is not None:
+            self.attach(parser)
+
+    def attach(self, parser):
+        parser.subscribe(['attention', 'meditation', 'poor_signal',
+                          'blink_strength', 'waves', 'state'], self.on_frames)
+        parser.subscribe_raw(self.raw_blocks.push)
+
+    def on_frames(self, frames):
+        for frame in frames:
+            for field in FIELDS[1:]:
+                value = getattr(frame, field if field != 'state'
+                                else 'dongle_state')
+                if value is not None:
+                    self.broadcast(field, value)
+
+    def on_raw_block(self, samples, times):
+        self.broadcast('raw', (float(times[0]), samples))
+
+    def broadcast(self, field, value):
+        "Send ``field`` to every client subscribed to it"
+        encoded = {}
+        for client in list(self.clients):
+            if field not in client.fields:
+                continue
+            data = encoded.get(client.format)
+            if data is None:
+                data = encoded[client.format] = \
+                    ENCODERS[client.format](field, value)
+            client.send(data)
+        self.messages += 1
+
+    def start(self, host='127.0.0.1', port=13854, loop=None):
+        """Start listening; returns what loop.create_server returns, run it
+        with loop.run_until_complete()"""
+        if asyncio is None:
+            raise RuntimeError('StreamServer needs asyncio (Python 3.4+)')
+        loop = loop or asyncio.get_event_loop()
+        return loop.create_server(lambda: ClientProtocol(self), host, port)
+
+    def stats(self):
+        return {
+            'clients': len(self.clients),
+            'messages': self.messages,
+            'stalled_disconnects': self.stalled,
+            'queued': sum(len(c.queue) for c in self.clients),
+            'queued_bytes': sum(c.queued_bytes for c in self.clients),
+        }
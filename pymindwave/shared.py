@@ -0,0 +1,274 @@
+"""
+Acquisition in a child process, published through a shared memory ring.
+
+Callbacks run on the thread that reads the dongle. Heavy analysis there
+(bin_power, hfd, ...) holds the GIL, serial reads fall behind and the
+dongle's buffer overflows. SharedAcquisition instead runs the parser in a
+child process that does nothing but read and publish: raw samples with
+their timestamps, and eSense/band power records, go into rings in a
+memory-mapped file. Any number of analysis processes attach to that file
+by name and read the rings without copying and without ever blocking the
+writer.
+
+Every ring is a SampleRing whose counters live in the shared header. The
+writer first advances a ring's ``reserved`` counter, then writes, then
+advances ``count``, so a reader can tell whether a window it took has been
+overwritten meanwhile::
+
+    buf = SharedBuffer.attach(path)
+    start = buf.raw.count - 512
+    window = buf.raw.window(start, start + 512)
+    features = analyse(window)
+    if buf.raw.overwritten(start):
+        ...  # the writer lapped us while we were reading, drop the result
+
+The file lives in /dev/shm where it exists, so on Linux it never touches
+the disk. multiprocessing.shared_memory would do the same but needs
+Python 3.8.
+"""
+import multiprocessing
+import os
+import tempfile
+
+import numpy as np
+import serial
+
+from pymindwave import parser
+from pymindwave.buffers import SampleRing
+from pymindwave.headset import COMMAND_BYTES
+from pymindwave.stats import clock
+
+MAGIC = 0x6d696e6477617665  # 'mindwave'
+VERSION = 1
+
+ESENSE_DTYPE = np.dtype([
+    ('time', np.float64),
+    # -1 when the frame did not carry the value
+    ('poor_signal', np.int16),
+    ('attention', np.int16),
+    ('meditation', np.int16),
+    ('blink_strength', np.int16),
+    ('waves', np.int64, (8,)),
+])
+
+STATES = ('initializing', 'standby', 'connected', 'disconnected')
+
+# int64 slots of the header
+(_MAGIC, _VERSION, _RAW_CAPACITY, _ESENSE_CAPACITY, _STATE, _PID, _DROPPED,
+ _HEARTBEAT) = range(8)
+# every ring has a (count, reserved) pair starting at its slot
+_RAW, _TIMES, _ESENSE = 8, 10, 12
+HEADER_SLOTS = 16
+
+
+class SharedRing(SampleRing):
+    """SampleRing over shared memory, see the module docstring.
+
+    ``counters`` is a 2 element int64 array holding ``count`` and
+    ``reserved``.
+    """
+
+    def __init__(self, data, counters):
+        self.data = data
+        self.capacity = len(data)
+        self.counters = counters
+
+    @property
+    def count(self):
+        return int(self.counters[0])
+
+    @count.setter
+    def count(self, value):
+        self.counters[0] = value
+
+    @property
+    def reserved(self):
+        return int(self.counters[1])
+
+    def append(self, value):
+        self.counters[1] = self.count + 1
+        super(SharedRing, self).append(value)
+
+    def extend(self, values):
+        self.counters[1] = self.count + len(values)
+        super(SharedRing, self).extend(values)
+
+    def overwritten(self, counter):
+        "Whether the item with ``counter`` may have been overwritten by now"
+        return counter < self.reserved - self.capacity
+
+
+class SharedBuffer(object):
+    """The memory-mapped file holding the rings.
+
+    ``raw`` and ``raw_times`` share their counter values, ``esense`` holds
+    one ESENSE_DTYPE record per frame with eSense or band power values.
+    Use create() in the writer and attach() in readers; readers get
+    read-only arrays.
+    """
+
+    def __init__(self, path, mode):
+        self.path = path
+        header = np.memmap(path, dtype=np.int64, mode=mode,
+                           shape=(HEADER_SLOTS,))
+        if header[_MAGIC] != MAGIC or header[_VERSION] != VERSION:
+            raise ValueError('%s is not a pymindwave shared buffer' % path)
+        raw_capacity = int(header[_RAW_CAPACITY])
+        esense_capacity = int(header[_ESENSE_CAPACITY])
+        self.header = header
+        offset = header.nbytes
+        raw = np.memmap(path, dtype=np.int16, mode=mode, offset=offset,
+                        shape=(raw_capacity,))
+        offset += _aligned(raw.nbytes)
+        times = np.memmap(path, dtype=np.float64, mode=mode, offset=offset,
+                          shape=(raw_capacity,))
+        offset += times.nbytes
+        esense = np.memmap(path, dtype=ESENSE_DTYPE, mode=mode, offset=offset,
+                           shape=(esense_capacity,))
+        self.raw = SharedRing(raw, header[_RAW:_RAW + 2])
+        self.raw_times = SharedRing(times, header[_TIMES:_TIMES + 2])
+        self.esense = SharedRing(esense, header[_ESENSE:_ESENSE + 2])
+        # heartbeat is a float, stored in its int64 slot
+        self.heartbeat_slot = header[_HEARTBEAT:_HEARTBEAT + 1].view(
+            np.float64)
+
+    @classmethod
+    def create(cls, path=None, raw_capacity=512 * 60, esense_capacity=3600):
+        """Create the file at ``path`` (a new file in /dev/shm or the temp
+        directory by default) and open it for writing"""
+        if path is None:
+            directory = '/dev/shm' if os.path.isdir('/dev/shm') else None
+            fd, path = tempfile.mkstemp(prefix='pymindwave-', dir=directory)
+            os.close(fd)
+        size = HEADER_SLOTS * 8 + _aligned(raw_capacity * 2) + \
+            raw_capacity * 8 + esense_capacity * ESENSE_DTYPE.itemsize
+        header = np.memmap(path, dtype=np.int64, mode='w+',
+                           shape=(size // 8,))
+        header[_MAGIC] = MAGIC
+        header[_VERSION] = VERSION
+        header[_RAW_CAPACITY] = raw_capacity
+        header[_ESENSE_CAPACITY] = esense_capacity
+        header.flush()
+        del header
+        return cls(path, 'r+')
+
+    @classmethod
+    def attach(cls, path):
+        "Open an existing buffer for reading"
+        return cls(path, 'r')
+
+    @property
+    def state(self):
+        return STATES[self.header[_STATE]]
+
+    @state.setter
+    def state(self, value):
+        self.header[_STATE] = STATES.index(value)
+
+    @property
+    def writer_pid(self):
+        return int(self.header[_PID])
+
+    @property
+    def dropped_samples(self):
+        return int(self.header[_DROPPED])
+
+    @property
+    def heartbeat(self):
+        "stats.clock() time of the writer's last loop iteration"
+        return float(self.heartbeat_slot[0])
+
+    def unlink(self):
+        os.unlink(self.path)
+
+
+def _aligned(nbytes):
+    return (nbytes + 7) // 8 * 8
+
+
+class Publisher(object):
+    "Copies what a VirtualParser decodes into a SharedBuffer"
+
+    def __init__(self, p, buf):
+        self.parser = p
+        self.buffer = buf
+        buf.header[_PID] = os.getpid()
+        p.subscribe_raw(self.publish_raw)
+        p.subscribe(['poor_signal', 'waves', 'attention', 'meditation',
+                     'blink_strength'], self.publish_esense)
+        p.subscribe('state', self.publish_state)
+
+    def publish_raw(self, samples, times):
+        self.buffer.raw.extend(samples)
+        self.buffer.raw_times.extend(times)
+        self.buffer.header[_DROPPED] = self.parser.dropped_samples
+
+    def publish_esense(self, frames):
+        now = clock()
+        for frame in frames:
+            waves = frame.waves or (-1,) * 8
+            self.buffer.esense.append((
+                now, _or_missing(frame.poor_signal),
+                _or_missing(frame.attention), _or_missing(frame.meditation),
+                _or_missing(frame.blink_strength), waves))
+
+    def publish_state(self, frames):
+        for frame in frames:
+            if frame.dongle_state in STATES:
+                self.buffer.state = frame.dongle_state
+
+    def beat(self):
+        self.buffer.heartbeat_slot[0] = clock()
+
+
+def _or_missing(value):
+    return -1 if value is None else value
+
+
+def acquire(dongle_dev, path, stop, fstream=None, auto_connect=True):
+    """Child process body: read the dongle and publish until ``stop`` is set.
+
+    ``fstream`` replaces the serial port, e.g. a pipe inherited from the
+    parent.
+    """
+    if fstream is None:
+        fstream = serial.Serial(dongle_dev, 115200, timeout=0.001)
+        if auto_connect:
+            fstream.write(COMMAND_BYTES['auto_connect'])
+    buf = SharedBuffer(path, 'r+')
+    p = parser.VirtualParser(fstream)
+    publisher = Publisher(p, buf)
+    while not stop.is_set():
+        p.update_all()
+        publisher.beat()
+    fstream.close()
+
+
+class SharedAcquisition(object):
+    """Runs acquire() in a child process, see the module docstring.
+
+    ``path`` is the file readers pass to SharedBuffer.attach().
+    """
+
+    def __init__(self, dongle_dev, path=None, raw_capacity=512 * 60,
+                 esense_capacity=3600, fstream=None, auto_connect=True):
+        self.buffer = SharedBuffer.create(path, raw_capacity, esense_capacity)
+        self.path = self.buffer.path
+        self.stop_event = multiprocessing.Event()
+        self.process = multiprocessing.Process(
+            target=acquire, args=(dongle_dev, self.path, self.stop_event,
+                                  fstream, auto_connect))
+        self.process.daemon = True
+
+    def start(self):
+        self.process.start()
+
+    def stop(self, timeout=1.0):
+        self.stop_event.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+
+    def destroy(self):
+        self.stop()
+        self.buffer.unlink()
@@ -0,0 +1,173 @@
+"""
+Virtual dongles on pseudo-terminals, for testing without hardware.
+
+VirtualDongle opens a pty pair and plays the dongle on the master side; the
+slave side is a tty device like /dev/ttyUSB0, so Headset, Parser and
+DongleManager open it unchanged. Like the real dongle it sends 0xd4
+standby packets until it gets a connect command, answers 0xc2
+(auto-connect) and 0xc0 + global id with 0xd0 connected (or 0xd1 not
+found for a wrong id), answers 0xc1 with 0xd2 disconnected and streams
+synthetic EEG from synthetic.StreamGenerator while connected.
+
+``speed`` scales the sample rate, 1.0 is the headset's 512 Hz; with
+``speed=None`` data is sent as fast as the reader takes it. spawn()
+starts many dongles at once for load tests, see bin/virtual_load.py.
+"""
+import os
+import pty
+import select
+import threading
+import time
+import tty
+
+from pymindwave.stats import clock
+from pymindwave.synthetic import StreamGenerator
+
+
+class VirtualDongle(object):
+    """A simulated dongle on a pty, see the module docstring.
+
+    ``path`` is the tty device to open. Extra keyword arguments go to the
+    StreamGenerator.
+    """
+
+    # how often data is written while streaming, in seconds
+    TICK = 1 / 64.0
+
+    def __init__(self, global_id=0x0505, speed=1.0, standby_interval=1.0,
+                 seed=None, **generator_args):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        self.global_id = global_id
+        self.speed = speed
+        self.standby_interval = standby_interval
+        self.generator = StreamGenerator(global_id=global_id, seed=seed,
+                                         **generator_args)
+        self.state = 'standby'
+        self.samples_sent = 0
+        self.bytes_sent = 0
+        self.commands = []
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=self.path)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(1.0)
+            self.thread = None
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def run(self):
+        next_standby = clock()
+        stream_start = None
+        while self.running:
+            now = clock()
+            if self.state == 'connected':
+                if stream_start is None:
+                    stream_start = now
+                    streamed = 0
+                if self.speed:
+                    due = int((now - stream_start) * self.speed *
+                              self.generator.sample_rate) - streamed
+                else:
+                    due = int(self.TICK * self.generator.sample_rate)
+                if due > 0:
+                    self._send(self.generator.generate(
+                        due / float(self.generator.sample_rate)))
+                    self.samples_sent += due
+                    streamed += due
+                timeout = self.TICK if self.speed else 0
+            else:
+                stream_start = None
+                if now >= next_standby:
+                    self._send(self.generator.state(0xd4))
+                    next_standby = now + self.standby_interval
+                timeout = min(max(next_standby - now, 0), self.TICK)
+            self._read_commands(timeout)
+
+    def _send(self, data):
+        view = memoryview(data)
+        while len(view) and self.running:
+            # wait for room without missing commands
+            readable, writable, _ = select.select([self.master],
+                                                  [self.master], [], 0.1)
+            if readable:
+                self._read_commands(0)
+            if writable:
+                try:
+                    n = os.write(self.master, view)
+                except OSError:
+                    self.running = False
+                    return
+                view = view[n:]
+                self.bytes_sent += n
+
+    def _read_commands(self, timeout):
+        try:
+            readable, _, _ = select.select([self.master], [], [], timeout)
+            if not readable:
+                return
+            data = bytearray(os.read(self.master, 64))
+        except (OSError, select.error, ValueError):
+            self.running = False
+            return
+        i = 0
+        while i < len(data):
+            command = data[i]
+            if command == 0xc0 and i + 2 < len(data):
+                self.commands.append(bytes(data[i:i + 3]))
+                global_id = data[i + 1] << 8 | data[i + 2]
+                i += 3
+                if global_id == self.global_id:
+                    self._connect()
+                else:
+                    self._send(self.generator.state(0xd1))
+                continue
+            self.commands.append(bytes(data[i:i + 1]))
+            i += 1
+            if command == 0xc2:
+                self._connect()
+            elif command == 0xc1 and self.state == 'connected':
+                self.state = 'standby'
+                self._send(self.generator.state(0xd2))
+
+    def _connect(self):
+        if self.state != 'connected':
+            self.state = 'connected'
+            self._send(self.generator.state(0xd0))
+
+    def drop_link(self):
+        "Lose the headset: report disconnected and stop streaming"
+        self.state = 'standby'
+        self._send(self.generator.state(0xd2))
+
+
+def spawn(n, **kwargs):
+    """Start ``n`` virtual dongles with global ids 1 .. n"""
+    dongles = []
+    for i in range(n):
+        args = dict(kwargs, global_id=kwargs.get('global_id', 0) + i + 1)
+        dongles.append(VirtualDongle(**args).start())
+    return dongles
+
+
+def wait_for(condition, timeout=5.0, interval=0.01):
+    "Poll ``condition`` until it holds or ``timeout`` seconds pass"
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(interval)
+    return True
@@ -0,0 +1,187 @@
+"""
+Cheap measurement helpers for the acquisition path.
+"""
+import sys
+import time
+from bisect import bisect_left
+
+
+def _monotonic():
+    """A monotonic clock in seconds for this interpreter.
+
+    time.monotonic on Python 3. Python 2 has none, so there it is
+    clock_gettime(CLOCK_MONOTONIC) through ctypes on Linux and macOS, and
+    time.clock (QueryPerformanceCounter) on Windows. Anywhere else this
+    falls back to time.time, which jumps when the system clock is set.
+    """
+    try:
+        return time.monotonic
+    except AttributeError:
+        pass
+    if sys.platform == 'win32':
+        return time.clock
+    # CLOCK_MONOTONIC differs between the two
+    clock_id = {'darwin': 6}.get(sys.platform,
+                                 1 if sys.platform.startswith('linux') else None)
+    if clock_id is None:
+        return time.time
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        # glibc before 2.17 keeps clock_gettime in librt
+        libc = ctypes.CDLL(ctypes.util.find_library('rt') or
+                           ctypes.util.find_library('c'), use_errno=True)
+        clock_gettime = libc.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        if clock_gettime(clock_id, ctypes.byref(timespec())) != 0:
+            return time.time
+    except (ImportError, OSError, AttributeError):
+        return time.time
+
+    def monotonic():
+        # a timespec per call: clock() is used from several threads
+        t = timespec()
+        clock_gettime(clock_id, ctypes.byref(t))
+        return t.tv_sec + t.tv_nsec * 1e-9
+    return monotonic
+
+
+clock = _monotonic()
+
+
+class Histogram(object):
+    """Fixed-bucket histogram.
+
+    Recording a value is one bisect and a few additions, so it can stay
+    enabled on the reader thread. ``bounds`` are the inclusive upper edges
+    of the buckets; values above the last edge land in an overflow bucket.
+    The defaults suit latencies in seconds.
+    """
+
+    DEFAULT_BOUNDS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1,
+                      0.2, 0.5, 1.0)
+
+    def __init__(self, bounds=None):
+        self.bounds = tuple(bounds or self.DEFAULT_BOUNDS)
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0
+
+    def record(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+    def percentile(self, q):
+        """Upper edge of the bucket holding the ``q``-th percentile.
+
+        Returns ``max`` when that bucket is the overflow bucket.
+        """
+        if not self.count:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': list(zip(self.bounds + (None,), self.counts)),
+        }
+
+
+class RateMeter(object):
+    """Rate of a growing counter, recomputed at most once per ``window`` seconds.
+
+    ``rate`` is None until a full window has passed.
+    """
+
+    def __init__(self, window=1.0):
+        self.window = window
+        self.rate = None
+        self.last_time = None
+        self.last_count = 0
+
+    def update(self, count, now):
+        if self.last_time is None:
+            self.last_time, self.last_count = now, count
+        elif now - self.last_time >= self.window:
+            self.rate = (count - self.last_count) / (now - self.last_time)
+            self.last_time, self.last_count = now, count
+        return self.rate
+
+
+class ParserStats(object):
+    """Link health counters kept by VirtualParser.
+
+    Everything is a plain integer increment or a Histogram.record on the
+    reader thread, cheap enough to leave on. snapshot() returns a dict that
+    can be logged or checked, e.g. alert when ``raw_samples_per_second``
+    drops below 512. The parser updates that rate on every dispatch and
+    snapshot() only reads it; it is None for the first second.
+    """
+
+    def __init__(self):
+        self.started = clock()
+        self.bytes_read = 0
+        self.frames = 0
+        self.frames_per_code = {}
+        self.checksum_errors = 0
+        self.oversize_frames = 0
+        self.resync_bytes = 0
+        self.buffer_high_water = 0
+        self.raw_rate = RateMeter()
+        # from the read that delivered a batch to its dispatch
+        self.dispatch_latency = Histogram()
+        # field callbacks of one frame, or one batch subscriber call
+        self.callback_time = Histogram()
+
+    def count_frames(self, frames):
+        per_code = self.frames_per_code
+        for frame in frames:
+            for code in frame.codes:
+                per_code[code] = per_code.get(code, 0) + 1
+        self.frames += len(frames)
+
+    def snapshot(self, raw_samples=0):
+        return {
+            'uptime': clock() - self.started,
+            'bytes_read': self.bytes_read,
+            'frames': self.frames,
+            'frames_per_code': dict(('0x%02x' % code, n) for code, n
+                                    in self.frames_per_code.items()),
+            'checksum_errors': self.checksum_errors,
+            'oversize_frames': self.oversize_frames,
+            'resync_bytes': self.resync_bytes,
+            'buffer_high_water': self.buffer_high_water,
+            'raw_samples': raw_samples,
+            # read only: the dispatch path alone updates the meter
+            'raw_samples_per_second': self.raw_rate.rate,
+            'dispatch_latency': self.dispatch_latency.snapshot(),
+            'callback_time': self.callback_time.snapshot(),
+        }
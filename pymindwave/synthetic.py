@@ -0,0 +1,162 @@
+"""
+Synthetic ThinkGear byte streams for tests and benchmarks.
+
+StreamGenerator produces what a dongle sends while a headset is on: a 0x80
+raw packet per sample, an eSense packet (0x02 poor signal, 0x83 band powers,
+0x04 attention, 0x05 meditation) about once a second, occasional 0x16 blink
+packets and 0xd0 - 0xd4 state packets. Noise bytes between packets and
+corrupted checksums can be injected at configurable rates.
+
+The generator counts what a correct parser has to report for the bytes it
+produced, so a parser can be checked against ``counts`` without hardware.
+Noise bytes never contain 0xaa, which keeps the framing unambiguous: every
+noise byte is skipped by the sync search and shows up as a resync byte.
+"""
+import numpy as np
+
+
+STATE_PAYLOADS = {
+    0xd0: lambda gid: bytearray([0xd0, 0x02, gid >> 8, gid & 0xff]),
+    0xd1: lambda gid: bytearray([0xd1, 0x02, gid >> 8, gid & 0xff]),
+    0xd2: lambda gid: bytearray([0xd2, 0x02, gid >> 8, gid & 0xff]),
+    0xd3: lambda gid: bytearray([0xd3, 0x00]),
+    0xd4: lambda gid: bytearray([0xd4, 0x01, 0x00]),
+}
+
+
+def make_frame(payload):
+    "Wrap ``payload`` (bytes or bytearray) into a checksummed packet"
+    payload = bytearray(payload)
+    frame = bytearray([0xaa, 0xaa, len(payload)]) + payload
+    frame.append((~sum(payload)) & 0xff)
+    return bytes(frame)
+
+
+class StreamGenerator(object):
+    """Produces dongle byte streams, see the module docstring.
+
+    ``noise`` is the probability that a packet is followed by 1 - 16 noise
+    bytes and ``corrupt`` the probability that its checksum is broken.
+    ``blink_rate`` is the mean number of blinks per second. The raw signal
+    is a 10 Hz alpha wave on top of Gaussian noise and continues across
+    calls to generate(). Pass ``seed`` for reproducible streams.
+
+    ``counts`` accumulates, over everything generated so far, the number of
+    valid frames, frames per code, raw samples, checksum errors and noise
+    bytes a parser should see.
+    """
+
+    def __init__(self, sample_rate=512, esense_rate=1.0, blink_rate=0.2,
+                 noise=0.0, corrupt=0.0, global_id=0x0505, seed=None):
+        self.sample_rate = sample_rate
+        self.esense_rate = esense_rate
+        self.blink_rate = blink_rate
+        self.noise = noise
+        self.corrupt = corrupt
+        self.global_id = global_id
+        self.random = np.random.RandomState(seed)
+        self.sample_index = 0
+        self.counts = {
+            'frames': 0,
+            'frames_per_code': {},
+            'raw_samples': 0,
+            'checksum_errors': 0,
+            'noise_bytes': 0,
+        }
+
+    def raw_signal(self, n):
+        "The next ``n`` raw samples as int16"
+        t = (self.sample_index + np.arange(n)) / float(self.sample_rate)
+        signal = 200 * np.sin(2 * np.pi * 10 * t) + \
+            self.random.normal(0, 50, n)
+        self.sample_index += n
+        return np.clip(signal, -2048, 2047).astype(np.int16)
+
+    def esense_payload(self):
+        waves = self.random.randint(0, 1 << 24, 8)
+        payload = bytearray([0x02, self.random.randint(0, 30), 0x83, 24])
+        for value in waves:
+            payload.extend([value >> 16, (value >> 8) & 0xff, value & 0xff])
+        payload.extend([0x04, self.random.randint(1, 101),
+                        0x05, self.random.randint(1, 101)])
+        return payload
+
+    def state(self, code):
+        "A state packet for ``code`` (0xd0 - 0xd4), counted like any other"
+        return self._emit([STATE_PAYLOADS[code](self.global_id)])
+
+    def generate(self, seconds):
+        "``seconds`` of streaming data as bytes"
+        n = int(round(seconds * self.sample_rate))
+        raw = self.raw_signal(n).astype(np.uint16)
+        rows = np.empty((n, 8), dtype=np.uint8)
+        rows[:, :5] = (0xaa, 0xaa, 0x04, 0x80, 0x02)
+        rows[:, 5] = raw >> 8
+        rows[:, 6] = raw & 0xff
+        rows[:, 7] = ~(0x82 + rows[:, 5].astype(np.int64) + rows[:, 6]) & 0xff
+        data = rows.tobytes()
+        packets = [data[i:i + 8] for i in range(0, len(data), 8)]
+        payloads = [None] * n
+
+        # eSense and blink packets go after the raw packet of a sample
+        every = max(int(self.sample_rate / self.esense_rate), 1)
+        extra = {}
+        for i in range(every - 1 - (self.sample_index - n) % every, n, every):
+            extra.setdefault(i, []).append(self.esense_payload())
+        blinks = self.random.poisson(self.blink_rate * n / self.sample_rate)
+        for i in self.random.randint(0, max(n, 1), blinks):
+            extra.setdefault(i, []).append(
+                bytearray([0x16, self.random.randint(20, 256)]))
+        for i in sorted(extra, reverse=True):
+            packets[i + 1:i + 1] = [make_frame(p) for p in extra[i]]
+            payloads[i + 1:i + 1] = extra[i]
+        return self._finish(packets, payloads)
+
+    def _emit(self, payloads):
+        return self._finish([make_frame(p) for p in payloads], payloads)
+
+    def _finish(self, packets, payloads):
+        """Count the packets, then corrupt them and add noise.
+
+        ``payloads`` holds the payload of each packet, or None for raw
+        packets, which all have the same layout.
+        """
+        counts = self.counts
+        per_code = counts['frames_per_code']
+        n = len(packets)
+        corrupt = self.random.random_sample(n) < self.corrupt
+        noisy = self.random.random_sample(n) < self.noise
+        out = []
+        raw_frames = 0
+        for i in range(n):
+            packet = packets[i]
+            if corrupt[i]:
+                packet = packet[:-1] + \
+                    bytes(bytearray([(bytearray(packet)[-1] + 1) & 0xff]))
+                counts['checksum_errors'] += 1
+            elif payloads[i] is None:
+                raw_frames += 1
+            else:
+                for code in _codes(payloads[i]):
+                    per_code[code] = per_code.get(code, 0) + 1
+                counts['frames'] += 1
+            out.append(packet)
+            if noisy[i]:
+                junk = self.random.randint(0, 0xaa, self.random.randint(1, 17))
+                out.append(junk.astype(np.uint8).tobytes())
+                counts['noise_bytes'] += len(junk)
+        if raw_frames:
+            per_code[0x80] = per_code.get(0x80, 0) + raw_frames
+            counts['frames'] += raw_frames
+            counts['raw_samples'] += raw_frames
+        return b''.join(out)
+
+
+def _codes(payload):
+    codes = []
+    i = 0
+    while i < len(payload):
+        code = payload[i]
+        codes.append(code)
+        i += 2 + payload[i + 1] if code >= 0x80 else 2
+    return codes
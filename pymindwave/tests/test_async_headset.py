@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import socket
+from unittest import SkipTest
+from pymindwave import async_headset
+from pymindwave import simulator
+from pymindwave import transport
+
+
+def new_loop():
+    if async_headset.asyncio is None:
+        raise SkipTest('AsyncHeadset needs asyncio')
+    return async_headset.asyncio.new_event_loop()
+
+def test_async_headset_on_virtual_dongle():
+    loop = new_loop()
+    dongle = simulator.VirtualDongle(speed=4.0).start()
+    h = async_headset.AsyncHeadset(dongle.path, loop=loop)
+    try:
+        assert (loop.run_until_complete(h.connect()) == 'connected')
+        blocks = h.raw_blocks(64)
+        # what ``async for block in blocks`` awaits
+        block = loop.run_until_complete(blocks.__anext__())
+        assert (len(block) == 64)
+        frames = h.frames('waves')
+        frame = loop.run_until_complete(frames.__anext__())
+        assert (len(frame.waves) == 8)
+        # leaving the loop early must not leave the stream subscribed
+        loop.run_until_complete(blocks.aclose())
+        assert (blocks not in h.streams and not h.parser.raw_subscribers)
+        stream = loop.run_until_complete(frames.__aenter__())
+        loop.run_until_complete(stream.__aexit__(None, None, None))
+        assert (h.streams == [] and h.parser.subscribers[1:] == [])
+    finally:
+        h.close()
+        loop.close()
+        dongle.stop()
+
+class SocketHeadset(async_headset.AsyncHeadset):
+    "AsyncHeadset on one end of a socket pair"
+
+    def _open(self, dongle):
+        return transport.SocketStream(dongle)
+
+def test_async_headset_stream_ends_when_socket_closes():
+    loop = new_loop()
+    ours, theirs = socket.socketpair()
+    h = SocketHeadset(ours, loop=loop)
+    try:
+        frames = h.frames()
+        theirs.close()
+        # the stream stops instead of waiting forever
+        try:
+            loop.run_until_complete(frames.__anext__())
+        except StopAsyncIteration:
+            pass
+        else:
+            assert (False)
+        assert (h.fd is None)
+    finally:
+        h.close()
+        ours.close()
+        loop.close()
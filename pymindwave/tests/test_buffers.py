@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import numpy as np
+from pymindwave import buffers
+
+
+def test_sample_ring_views_and_wrap():
+    ring = buffers.SampleRing(8)
+    ring.extend(range(6))
+    window = ring.latest(4)
+    assert (window.tolist() == [2, 3, 4, 5])
+    assert (np.may_share_memory(window, ring.data))
+    assert (not window.flags.writeable)
+    counter = ring.count
+    for v in range(6, 11):
+        ring.append(v)
+    assert (ring.count == 11 and len(ring) == 8)
+    # wraps around the end of the array, so this one is a copy
+    wrapped = ring.since(counter)
+    assert (wrapped.tolist() == [6, 7, 8, 9, 10])
+    assert (not np.may_share_memory(wrapped, ring.data))
+    # older samples have been overwritten
+    assert (ring.since(0).tolist() == range(3, 11))
+    assert (ring.latest(100).tolist() == range(3, 11))
+    ring.extend(range(20))
+    assert (ring.count == 31 and ring.latest(3).tolist() == [17, 18, 19])
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import threading
+import time
+from pymindwave import delivery
+from pymindwave import parser
+from pymindwave.synthetic import make_frame
+
+
+def gated_subscriber(policy, maxsize=2):
+    "A subscriber whose callback waits for the gate to open"
+    gate = threading.Event()
+    received = []
+
+    def callback(item):
+        gate.wait()
+        received.append(item)
+    subscriber = delivery.QueuedSubscriber(callback, maxsize, policy)
+    subscriber.put(0)
+    # let the worker take item 0 and wait at the gate
+    while subscriber.items:
+        time.sleep(0.001)
+    return subscriber, gate, received
+
+def test_queue_policies():
+    expected = {
+        'drop_oldest': ([0, 4, 5], 3),
+        'drop_newest': ([0, 1, 2], 3),
+        'latest': ([0, 5], 4),
+    }
+    for policy, (items, dropped) in expected.items():
+        subscriber, gate, received = gated_subscriber(policy)
+        for i in range(1, 6):
+            subscriber.put(i)
+        gate.set()
+        subscriber.close()
+        assert (received == items)
+        assert (subscriber.dropped == dropped)
+
+def test_block_policy_waits_for_room():
+    subscriber, gate, received = gated_subscriber('block')
+    subscriber.put(1)
+    subscriber.put(2)
+    put = threading.Thread(target=subscriber.put, args=(3,))
+    put.start()
+    put.join(0.05)
+    assert (put.is_alive())
+    gate.set()
+    put.join(1.0)
+    subscriber.close()
+    assert (received == [0, 1, 2, 3] and subscriber.dropped == 0)
+    assert (subscriber.max_depth == 2)
+
+def test_parser_queued_subscriptions():
+    p = parser.VirtualParser()
+    frames = []
+    blocks = []
+    on_frames = p.subscribe_queued('attention', frames.extend)
+    on_raw = p.subscribe_raw_queued(
+        lambda samples, times: blocks.append(samples.tolist()))
+    p.feed(make_frame('\x04\x10') + make_frame('\x80\x02\x00\x07'))
+    p.feed(make_frame('\x80\x02\x00\x08'))
+    p.unsubscribe(on_frames)
+    p.unsubscribe(on_raw)
+    assert ([f.attention for f in frames] == [0x10])
+    assert (blocks == [[7], [8]])
+    assert (p.get_stats()['subscribers'] == [])
+    assert (p.subscribers == [] and p.raw_subscribers == [])
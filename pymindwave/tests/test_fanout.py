@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import errno
+import os
+import socket
+import tempfile
+import time
+from pymindwave import fanout
+from pymindwave import headset
+from pymindwave import transport
+from pymindwave.synthetic import StreamGenerator
+
+
+class SocketHeadset(headset.Headset):
+    "Headset on one end of a socket pair instead of a serial port"
+
+    def _open(self, dongle):
+        return transport.SocketStream(dongle)
+
+
+def poll_until(daemon, condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        daemon.poll(0.01)
+    return condition()
+
+def test_fanout_to_remote_headsets():
+    dongle, dongle_end = socket.socketpair()
+    path = os.path.join(tempfile.mkdtemp(), 'mindwave.sock')
+    daemon = fanout.FanoutDaemon(path, headset=SocketHeadset(dongle_end),
+                                 max_buffer=4096)
+    remotes = []
+    try:
+        fast = fanout.RemoteHeadset(path)
+        remotes.append(fast)
+        # a client that never reads
+        slow = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        slow.connect(path)
+        assert (poll_until(daemon, lambda: len(daemon.clients) == 2))
+
+        fast.connect()
+        commands = []
+        dongle.setblocking(False)
+
+        def received():
+            try:
+                commands.append(dongle.recv(16))
+            except socket.error:
+                pass
+            return commands
+        assert (poll_until(daemon, received) == ['\xc2'])
+        # connecting is the daemon's job: a second request adds nothing
+        fast.connect()
+        assert (not poll_until(daemon, lambda: len(received()) > 1, 0.2))
+        dongle.setblocking(True)
+        gen = StreamGenerator(seed=0)
+        # more than the kernel buffers for the slow client
+        data = gen.state(0xd0) + gen.generate(120.0)
+        for i in range(0, len(data), 4096):
+            dongle.sendall(data[i:i + 4096])
+            sent = min(i + 4096, len(data))
+            poll_until(daemon, lambda: fast.parser.stats.bytes_read == sent)
+        assert (poll_until(daemon, lambda: fast.parser.raw_ring.count == 61440))
+        assert (fast.get_state() == 'connected')
+        assert (fast.wait_connected(1.0))
+        assert (daemon.headset.connection.state == 'connected')
+        # one client cannot cut off the others
+        fast.disconnect()
+        dongle.setblocking(False)
+        assert (not poll_until(daemon, lambda: len(received()) > 1, 0.2))
+        assert (daemon.headset.parser.raw_ring.count == 61440)
+        stats = daemon.stats()['clients']
+        assert (sum(c['dropped_bytes'] for c in stats.values()) > 0)
+        slow.close()
+        assert (poll_until(daemon, lambda: len(daemon.clients) == 1))
+    finally:
+        for remote in remotes:
+            remote.destroy()
+        daemon.close()
+        daemon.headset.destroy()
+        dongle.close()
+    assert (not os.path.exists(path))
+
+def test_fanout_only_replaces_sockets():
+    dongle, dongle_end = socket.socketpair()
+    h = SocketHeadset(dongle_end)
+    path = os.path.join(tempfile.mkdtemp(), 'mindwave.sock')
+    try:
+        with open(path, 'w') as f:
+            f.write('keep me')
+        try:
+            fanout.FanoutDaemon(path, headset=h)
+        except IOError:
+            pass
+        else:
+            assert (False)
+        assert (open(path).read() == 'keep me')
+        os.unlink(path)
+        # a stale socket is replaced
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+        daemon = fanout.FanoutDaemon(path, headset=h)
+        # but not the socket of a daemon that is still running
+        try:
+            fanout.FanoutDaemon(path, headset=h)
+        except IOError as e:
+            assert (e.errno == errno.EADDRINUSE)
+        else:
+            assert (False)
+        assert (os.path.exists(path))
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(path)
+        # the refused daemon's probe comes and goes, the client stays
+        for i in range(10):
+            daemon.poll(0.01)
+        assert (len(daemon.clients) == 1)
+        client.close()
+        daemon.close()
+    finally:
+        h.destroy()
+        dongle.close()
+
+def test_fanout_connect_by_global_id():
+    dongle, dongle_end = socket.socketpair()
+    path = os.path.join(tempfile.mkdtemp(), 'mindwave.sock')
+    daemon = fanout.FanoutDaemon(path, headset=SocketHeadset(dongle_end))
+    clients = []
+    try:
+        for i in range(2):
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(path)
+            clients.append(client)
+        first, second = clients
+        assert (poll_until(daemon, lambda: len(daemon.clients) == 2))
+        # a command split across two reads
+        first.sendall('\xc0\x12')
+        daemon.poll(0.05)
+        first.sendall('\x34')
+        dongle.settimeout(2.0)
+        assert (poll_until(daemon, lambda: daemon.headset.connection.state ==
+                           'connecting'))
+        assert (dongle.recv(16) == '\xc0\x12\x34')
+        assert (daemon.headset.connection.global_id == 0x1234)
+
+        # another headset than the shared one is denied
+        second.sendall('\xc0\x56\x78')
+        second.settimeout(2.0)
+        poll_until(daemon, lambda: sum(
+            c.denied for c in daemon.clients.values()) == 1)
+        assert (second.recv(16) == fanout.DENIED_PACKET)
+        second.sendall('\xc0\x12\x34')
+        dongle.setblocking(False)
+        poll_until(daemon, lambda: False, 0.2)
+        try:
+            extra = dongle.recv(16)
+        except socket.error:
+            extra = ''
+        assert (extra == '')
+        stats = daemon.stats()['clients']
+        assert (sorted(c['denied'] for c in stats.values()) == [0, 1])
+    finally:
+        for client in clients:
+            client.close()
+        daemon.close()
+        daemon.headset.destroy()
+        dongle.close()
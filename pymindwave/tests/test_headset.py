@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import socket
+from pymindwave import headset
+from pymindwave import parser
+from pymindwave import simulator
+from pymindwave import transport
+from pymindwave.synthetic import StreamGenerator
+
+
+def test_reconnect_after_link_loss():
+    dongle = simulator.VirtualDongle(standby_interval=0.05).start()
+    h = headset.Headset(dongle.path)
+    events = []
+    h.subscribe_connection(events.append)
+    try:
+        assert (h.connect(timeout=2.0))
+        assert ([e.state for e in events] == ['connecting', 'connected'])
+        dongle.drop_link()
+        assert (simulator.wait_for(lambda: len(events) >= 4))
+        assert (h.wait_connected(2.0))
+        assert ([e.state for e in events] ==
+                ['connecting', 'connected', 'connecting', 'connected'])
+        assert (events[2].cause == 'disconnected')
+        assert (dongle.commands == [b'\xc2', b'\xc2'])
+        stats = h.get_stats()['connection']
+        assert (stats['losses'] == 1 and stats['connects'] == 2)
+        assert (stats['reconnect_time']['count'] == 1)
+        assert (stats['reconnect_time']['max'] < 0.5)
+
+        h.disconnect()
+        assert (h.connection.wait('idle', 2.0))
+        assert (simulator.wait_for(lambda: dongle.state == 'standby'))
+        # a deliberate disconnect is not undone
+        assert (not h.wait_connected(0.2))
+        assert (dongle.commands[-1] == b'\xc1')
+    finally:
+        h.destroy()
+        dongle.stop()
+
+
+def test_connect_by_global_id_with_backoff():
+    dongle = simulator.VirtualDongle(global_id=0x1235,
+                                     standby_interval=0.05).start()
+    h = headset.Headset(dongle.path, global_id=0x1234)
+    h.connection.max_backoff = 0.1
+    try:
+        assert (not h.connect(timeout=0.5))
+        stats = h.get_stats()['connection']
+        assert (stats['failures'] >= 2)
+        # backoff keeps the retries down to a few per second
+        assert (3 <= stats['attempts'] <= 10)
+        assert (set(dongle.commands) == set([b'\xc0\x12\x34']))
+        dongle.global_id = dongle.generator.global_id = 0x1234
+        assert (h.wait_connected(1.0))
+        assert (h.parser.global_id == 0x1234)
+        assert (h.connection.attempts == 0)
+    finally:
+        h.destroy()
+        dongle.stop()
+
+
+def test_connect_to_dongle_already_streaming():
+    # a dongle linked before it was opened streams without sending 0xd0
+    dongle = simulator.VirtualDongle()
+    dongle.state = 'connected'
+    dongle.start()
+    try:
+        h = headset.Headset(dongle.path)
+        try:
+            # before any data was read: one command at most, and the data
+            # that follows counts as connected
+            assert (h.connect(timeout=2.0))
+            assert (dongle.commands in ([], [b'\xc2']))
+            assert (h.get_stats()['connection']['connects'] == 1)
+        finally:
+            h.destroy()
+        del dongle.commands[:]
+
+        h = headset.Headset(dongle.path)
+        try:
+            assert (simulator.wait_for(
+                lambda: h.get_state() == 'connected', 2.0))
+            assert (h.connect(timeout=0))
+            assert (dongle.commands == [])
+        finally:
+            h.destroy()
+    finally:
+        dongle.stop()
+
+
+def test_reader_stops_when_stream_closes():
+    ours, theirs = socket.socketpair()
+    p = parser.VirtualParser(transport.SocketStream(ours))
+    reader = headset.DongleReader(p)
+    causes = []
+    reader.on_close.append(causes.append)
+    reader.daemon = True
+    reader.start()
+    try:
+        gen = StreamGenerator(seed=0)
+        theirs.sendall(gen.state(0xd0) + gen.generate(0.1))
+        assert (simulator.wait_for(lambda: p.dongle_state == 'connected'))
+        theirs.close()
+        reader.join(1.0)
+        # the thread ends instead of spinning on the closed socket
+        assert (not reader.is_alive())
+        assert (causes == ['closed'])
+        assert (p.dongle_state == 'disconnected')
+        assert (p.values.dongle_state == 'disconnected')
+    finally:
+        reader.stop()
+        ours.close()
+
+def test_getters_read_published_values():
+    dongle = simulator.VirtualDongle(speed=4.0)
+    dongle.state = 'connected'
+    dongle.start()
+    h = headset.Headset(dongle.path)
+    try:
+        assert (simulator.wait_for(lambda: h.get_attention() > 0, 2.0))
+        h.dongle_reader.stop()
+        h.dongle_reader.join(1.0)
+        values = h.parser.values
+        # a frame stored but not yet dispatched is not visible
+        frame = h.parser.parse_payload(bytearray(
+            b'\x04\x01\x05\x02\x16\x03\x83\x18' + b'\x00\x00\x09' * 8))
+        h.parser.apply_frame(frame)
+        assert (h.get_attention() == values.attention)
+        assert (h.get_meditation() == values.meditation)
+        assert (h.get_blink_strength() == values.blink_strength)
+        assert (h.get_delta_waves() == values.waves[0])
+        assert (h.get_theta_waves() == values.waves[1])
+        assert (h.get_waves_vector() == list(values.waves))
+        assert (h.get_state() == 'connected')
+        h.parser.dispatch([frame])
+        assert (h.get_attention() == 1 and h.get_meditation() == 2)
+        assert (h.get_blink_strength() == 3 and h.get_waves_vector() == [9] * 8)
+    finally:
+        h.destroy()
+        dongle.stop()
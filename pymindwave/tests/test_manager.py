@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import errno
+import os
+from pymindwave import manager
+from pymindwave.synthetic import make_frame
+
+
+def test_manager_tags_events_by_device():
+    m = manager.DongleManager(timeout=0.01)
+    pipes = {}
+    for name in ['left', 'right']:
+        r, w = os.pipe()
+        pipes[name] = w
+        m.add('/dev/' + name, device_id=name, fstream=os.fdopen(r, 'rb', 0))
+    frames = []
+    samples = []
+    m.subscribe('attention', lambda dev, batch: frames.append(
+        (dev, [f.attention for f in batch])))
+    m.subscribe_raw(lambda dev, raw, times: samples.append((dev, list(raw))))
+    attention = []
+    m.dongles['left'].parser.setCallBack('attention', attention.append)
+
+    os.write(pipes['left'], make_frame('\x04\x10') + make_frame('\x80\x02\x00\x05'))
+    os.write(pipes['right'], make_frame('\x04\x20'))
+    n = 0
+    while n < 3:
+        n += m.poll()
+    assert (sorted(frames) == [('left', [0x10]), ('right', [0x20])])
+    assert (samples == [('left', [5])])
+    assert (attention == [0x10])
+    assert (m.dongles['right'].parser.callBacksDictionary == {})
+    assert (m.get_stats()['right']['frames'] == 1)
+
+    os.close(pipes['right'])
+    m.poll()
+    assert (list(m.dongles) == ['left'])
+    os.close(pipes['left'])
+    m.destroy()
+    assert (m.dongles == {})
+
+class Unplugged(object):
+    "A serial port whose device is gone: readable, but every read fails"
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+    @property
+    def in_waiting(self):
+        raise IOError(errno.EIO, 'device disconnected')
+
+    def close(self):
+        os.close(self.fd)
+
+def test_failed_dongle_does_not_stop_the_others():
+    m = manager.DongleManager(timeout=0.01)
+    writers = {}
+    for name in ['good', 'unplugged', 'closed']:
+        r, w = os.pipe()
+        writers[name] = w
+        fstream = Unplugged(r) if name == 'unplugged' else \
+            os.fdopen(r, 'rb', 0)
+        m.add('/dev/' + name, device_id=name, fstream=fstream)
+    failures = []
+    m.subscribe_failure(lambda dev, cause: failures.append(dev))
+    attention = []
+    m.subscribe('attention', lambda dev, batch: attention.extend(
+        f.attention for f in batch))
+
+    for w in writers.values():
+        os.write(w, make_frame('\x04\x10'))
+    # the descriptor closed under the manager reports POLLNVAL
+    os.close(m.dongles['closed'].fd)
+    m.poll()
+    assert (sorted(failures) == ['closed', 'unplugged'])
+    assert (m.failed['unplugged'] == 'error: [Errno 5] device disconnected')
+    assert (list(m.dongles) == ['good'] and attention == [0x10])
+    for n in range(3):
+        os.write(writers['good'], make_frame('\x04' + chr(n)))
+        m.poll()
+    assert (attention == [0x10, 0, 1, 2])
+    for w in writers.values():
+        os.close(w)
+    m.destroy()
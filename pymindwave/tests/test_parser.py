@@ -2,7 +2,14 @@
 # -*- coding:utf-8 -*-
 
 import StringIO
+import sys
+import time
 from pymindwave import parser
+from pymindwave import buffers
+from pymindwave import bulk
+from pymindwave.stats import RateMeter, clock
+from pymindwave import synthetic
+from pymindwave.synthetic import make_frame
 
 standby_test_stream = StringIO.StringIO(
     '\xaa\xaa' + # [SYNC] sync packets
@@ -116,3 +123,275 @@ def test_rawdata_test():
     p.update()
     print p.raw_values
     assert (p.raw_values == [0x28])
+
+class ChunkedStream(object):
+    """File-like object that hands out its data a few bytes per read"""
+
+    def __init__(self, data, chunk_size):
+        self.data = data
+        self.chunk_size = chunk_size
+
+    def read(self, size):
+        chunk = self.data[:min(size, self.chunk_size)]
+        self.data = self.data[len(chunk):]
+        return chunk
+
+
+def test_frame_split_across_reads():
+    p = parser.VirtualParser(ChunkedStream(
+        '\x00\xaa\xaa\x04\x80\x02\x00\x28\x55', 3))
+    p.update()
+    assert (p.raw_value == 0x28)
+
+def test_byte_buffer_cursors():
+    buf = buffers.ByteBuffer(8)
+    buf.write('\x01\x02\xaa\xaa\x03')
+    assert (buf.find('\xaa\xaa') == 2)
+    buf.consume(2)
+    assert (len(buf) == 3 and buf[2] == 0x03)
+    # forces the unread bytes to move and then the array to grow
+    buf.write('\x04\x05\x06\x07')
+    buf.write('\x08' * 10)
+    assert (len(buf) == 17)
+    assert (buf.capacity >= 32)
+    assert (buf.slice(0, 4) == bytearray('\xaa\xaa\x03\x04'))
+    buf.consume(17)
+    assert (len(buf) == 0 and buf.find('\xaa') == -1)
+
+def test_update_all_drains_buffer():
+    raw_frame = '\xaa\xaa\x04\x80\x02\x00\x28\x55'
+    p = parser.VirtualParser(StringIO.StringIO(
+        raw_frame * 3 + '\xaa\xaa\x03\xd4\x01\x00\x2a' + '\xaa\xaa\x04'))
+    assert (p.update_all() == 4)
+    assert (p.dongle_state == 'standby')
+    assert (p.update_all() == 0)
+
+def test_bulk_decoder_matches_parse_payload():
+    fixtures = [standby_test_stream, sync_test_stream1, sync_test_stream2,
+                disconnected_test_stream, raw_data_test_stream,
+                official_test_stream]
+    data = ''.join(f.getvalue() for f in fixtures)
+    data += make_frame('\x80\x02\xaa\xaa') + make_frame('\x80\x02\x80\x00')
+    data += make_frame('\x16\x40\xd0\x02\x05\x05')
+    data += make_frame('\x04\x10')[:-1] + '\x00'  # bad checksum
+    data += '\xaa\xaa\xc8' + make_frame('\x05\x3d\x99\x01\x00\x02\x20')
+    data += make_frame('\x80\x02\x00\x01')[:5]    # incomplete
+    seen = []
+    names = ['raw_value', 'delta', 'theta', 'low_alpha', 'high_alpha',
+             'low_beta', 'high_beta', 'low_gamma', 'mid_gamma', 'attention',
+             'meditation', 'poor_signal', 'blink_strength']
+    p = parser.VirtualParser(StringIO.StringIO(data))
+    for name in names:
+        p.setCallBack(name, lambda v, name=name: seen.append((name, v)))
+    p.update_all()
+
+    decoded = bulk.decode_buffer(data)
+    assert ([v for n, v in seen if n == 'raw_value'] ==
+            decoded.raw['value'].tolist())
+    assert (decoded.raw['value'].tolist() == [0x28, -21846, -32768])
+    assert ([v for n, v in seen if n == 'delta'] ==
+            decoded.waves['values'][:, 0].tolist())
+    assert (decoded.waves['values'].tolist() ==
+            [[148, 66, 11, 100, 77, 61, 7, 5]])
+    for name in ['attention', 'meditation', 'poor_signal', 'blink_strength']:
+        assert ([v for n, v in seen if n == name] ==
+                getattr(decoded, name)['value'].tolist())
+    assert (decoded.events['code'].tolist() == [0xd4, 0xd4, 0xd4, 0xd2, 0xd0])
+    assert (decoded.events['value'][-1] == p.global_id == 0x0505)
+    assert (decoded.checksum_errors == 1 and decoded.oversize == 1)
+    assert (decoded.consumed == len(data) - 5)
+    assert (len(p.input_stream) == 5)
+
+def test_bulk_decoder_keeps_stream_order():
+    # the same code at different row positions, and repeated in a payload
+    layouts = (make_frame('\x02\x00\x04\x01') + make_frame('\x04\x02') +
+               make_frame('\x04\x03'))
+    data = (layouts + make_frame('\x80\x02\x00\x01\x80\x02\x00\x02') +
+            make_frame('\x04\x04\x80\x02\x00\x03') +
+            make_frame('\x80\x02\x00\x04\x04\x05\x04\x06'))
+    attention = []
+    p = parser.VirtualParser()
+    p.setCallBack('attention', attention.append)
+    p.feed(layouts)
+    decoded = bulk.decode_buffer(data)
+    assert (decoded.attention['value'][:3].tolist() == attention == [1, 2, 3])
+    assert (decoded.attention.tolist() ==
+            [(0, 1), (1, 2), (2, 3), (4, 4), (5, 5), (5, 6)])
+    assert (decoded.raw.tolist() == [(3, 1), (3, 2), (4, 3), (5, 4)])
+
+def test_repeated_raw_rows_are_all_kept():
+    data = (make_frame('\x80\x02\x00\x01\x80\x02\xff\xfe') +
+            make_frame('\x80\x02\x00\x03'))
+    p = parser.VirtualParser()
+    frames = p.feed(data)
+    assert (frames[0].raw_values == (1, -2) and frames[0].raw_value == -2)
+    assert (frames[1].raw_values == (3,))
+    assert (p.raw_ring.latest(3).tolist() == [1, -2, 3])
+    assert (bulk.decode_buffer(data).raw['value'].tolist() == [1, -2, 3])
+    # the per-sample callback sees every one
+    seen = []
+    p = parser.VirtualParser()
+    p.setCallBack('raw_value', seen.append)
+    p.feed(data)
+    assert (seen == [1, -2, 3] and p.raw_ring.count == 3)
+
+def test_feed_any_chunk_boundaries():
+    data = (official_test_stream.getvalue() + '\x00\x12' +
+            make_frame('\x80\x02\xff\xf6') + standby_test_stream.getvalue())
+    p = parser.VirtualParser()
+    frames = []
+    for i in range(len(data)):
+        frames += p.feed(data[i])
+    assert (len(frames) == 3)
+    assert (frames[0].attention == 13 and frames[0].meditation == 61)
+    assert (frames[0].waves == (148, 66, 11, 100, 77, 61, 7, 5))
+    assert (frames[0].raw_value is None)
+    assert (frames[1].raw_value == -10)
+    assert (frames[2].dongle_state == 'standby')
+    assert (p.feed('') == [])
+
+def test_raw_values_blocks():
+    blocks = []
+    p = parser.VirtualParser(raw_buffer_len=4)
+    p.setCallBack('raw_values', blocks.append)
+    p.feed(''.join(make_frame('\x80\x02\x00' + chr(i)) for i in range(10)))
+    assert (blocks == [[0, 1, 2, 3], [4, 5, 6, 7]])
+    assert (p.raw_values == [8, 9])
+    p.callBacksDictionary.clear()
+    assert (p.raw_values == [6, 7, 8, 9])
+    assert (p.raw_ring.latest(10).tolist() == range(10))
+
+def test_raw_sample_timestamps():
+    dropped = []
+    raw = lambda n: ''.join(make_frame('\x80\x02\x00\x01') for i in range(n))
+    p = parser.VirtualParser()
+    p.setCallBack('dropped_samples', dropped.append)
+    p.feed(raw(512), arrival=10.0)
+    # a quarter second later, 128 samples: right on time
+    p.feed(raw(128), arrival=10.25)
+    # 0.5 s late: 256 samples were lost on the way
+    p.feed(raw(128), arrival=11.0)
+    times = p.raw_times.latest(768)
+    assert (p.raw_times.count == p.raw_ring.count == 768)
+    assert (abs(times[511] - 10.0) < 1e-9)
+    assert (abs(times[639] - 10.25) < 1e-9)
+    assert (abs(times[640] - times[639] - 257 / 512.0) < 1e-9)
+    assert (abs(times[-1] - 11.0) < 1e-9)
+    assert (dropped == [256] and p.dropped_samples == 256)
+
+def test_batched_frame_dispatch():
+    batches, raw_batches = [], []
+    p = parser.VirtualParser()
+    p.subscribe(['waves', 'state'], batches.append)
+    p.subscribe_raw(lambda samples, times: raw_batches.append(samples.tolist()))
+    data = ''.join(make_frame('\x80\x02\x00' + chr(i)) for i in range(5))
+    p.feed(data + official_test_stream.getvalue() +
+           standby_test_stream.getvalue())
+    p.feed(make_frame('\x80\x02\x00\x09'))
+    assert (len(batches) == 1 and len(batches[0]) == 2)
+    assert (batches[0][0].codes == [0x02, 0x83, 0x04, 0x05])
+    assert (batches[0][1].dongle_state == 'standby')
+    assert (raw_batches == [[0, 1, 2, 3, 4], [9]])
+    assert (p.current_vector == [148, 66, 11, 100, 77, 61, 7, 5])
+
+def test_parser_stats():
+    p = parser.VirtualParser()
+    data = ('\x01\x02' + make_frame('\x80\x02\x00\x01') +
+            make_frame('\x04\x10')[:-1] + '\x00' + '\xaa\xaa\xc8' +
+            official_test_stream.getvalue())
+    p.feed(data)
+    stats = p.get_stats()
+    assert (stats['bytes_read'] == len(data))
+    assert (stats['frames'] == 2 and stats['raw_samples'] == 1)
+    assert (stats['frames_per_code'] ==
+            {'0x80': 1, '0x02': 1, '0x83': 1, '0x04': 1, '0x05': 1})
+    assert (stats['checksum_errors'] == 1 and stats['oversize_frames'] == 1)
+    assert (stats['resync_bytes'] == 5)
+    assert (stats['buffer_high_water'] == len(data))
+    assert (stats['dispatch_latency']['count'] == 1)
+    # no rate before a full window has passed
+    assert (stats['raw_samples_per_second'] is None)
+    # get_stats() only reads the meter, the dispatch path updates it
+    meter = p.stats.raw_rate
+    state = (meter.last_time, meter.last_count)
+    p.get_stats()
+    assert ((meter.last_time, meter.last_count) == state)
+    meter.last_time -= 1.0
+    p.feed(make_frame('\x80\x02\x00\x02'))
+    assert (meter.last_count == 2)
+    assert (p.get_stats()['raw_samples_per_second'] == meter.rate > 0)
+
+def test_rate_meter():
+    meter = RateMeter(window=1.0)
+    assert (meter.update(0, 10.0) is None)
+    assert (meter.update(300, 10.5) is None)
+    assert (meter.update(512, 11.0) == 512.0)
+    # later updates within the window keep the last rate
+    assert (meter.update(600, 11.2) == 512.0)
+
+def test_clock_is_monotonic():
+    if sys.platform.startswith('linux'):
+        # not the wall clock, also on Python 2
+        assert (clock is not time.time)
+        assert (abs(clock() - time.time()) > 1.0)
+    before = clock()
+    time.sleep(0.01)
+    assert (0.005 < clock() - before < 1.0)
+
+def test_synthetic_stream_counts():
+    gen = synthetic.StreamGenerator(noise=0.05, corrupt=0.05, seed=1)
+    data = gen.state(0xd4) + gen.state(0xd0) + gen.generate(3.0) + \
+        gen.state(0xd2)
+    counts = gen.counts
+    p = parser.VirtualParser()
+    for i in range(0, len(data), 777):
+        p.feed(data[i:i + 777])
+    stats = p.get_stats()
+    assert (counts['raw_samples'] > 1400 and counts['checksum_errors'] > 0)
+    assert (stats['frames'] == counts['frames'])
+    assert (stats['raw_samples'] == counts['raw_samples'])
+    assert (stats['checksum_errors'] == counts['checksum_errors'])
+    assert (stats['resync_bytes'] == counts['noise_bytes'])
+    assert (stats['frames_per_code'] == dict(
+        ('0x%02x' % code, n) for code, n in counts['frames_per_code'].items()))
+    assert (p.dongle_state == 'disconnected')
+    decoded = bulk.decode_buffer(data)
+    assert (len(decoded.frames) == counts['frames'])
+    assert (decoded.checksum_errors == counts['checksum_errors'])
+
+def test_unsubscribe():
+    p = parser.VirtualParser()
+    batches = []
+    on_raw = lambda samples, times: batches.append(samples)
+    p.subscribe('raw', batches.append)
+    p.subscribe_raw(on_raw)
+    p.feed(make_frame('\x80\x02\x00\x01'))
+    p.unsubscribe(batches.append)
+    p.unsubscribe(on_raw)
+    p.feed(make_frame('\x80\x02\x00\x02'))
+    assert (len(batches) == 2 and p.subscribers == [])
+    assert (p.raw_subscribers == [])
+
+def test_snapshot():
+    p = parser.VirtualParser(raw_buffer_len=4, raw_ring_len=8)
+    before = p.snapshot()
+    p.feed(''.join(make_frame('\x80\x02\x00' + chr(i)) for i in range(10)) +
+           official_test_stream.getvalue())
+    snap = p.snapshot()
+    assert (before.attention == 0 and before.raw_count == 0)
+    assert (snap.dongle_state == 'connected')
+    assert (snap.attention == 13 and snap.meditation == 61)
+    assert (snap.waves == (148, 66, 11, 100, 77, 61, 7, 5))
+    assert (snap.raw.tolist() == [6, 7, 8, 9] and snap.raw_count == 10)
+    assert (not snap.raw.flags.writeable)
+    # the window never includes the slot the writer may be filling
+    assert (len(p.snapshot(100).raw) == 7)
+    p.feed(make_frame('\x04\x20'))
+    assert (snap.attention == 13 and p.snapshot().attention == 0x20)
+    # raw only batches publish too, and the raw window always ends at the
+    # published counter even while the reader is halfway through a batch
+    p.feed(make_frame('\x80\x02\x00\x0a'))
+    assert (p.values.raw_count == 11 and p.snapshot().raw_count == 11)
+    p.raw_ring.extend([20, 21])
+    snap = p.snapshot()
+    assert (snap.raw_count == 11 and snap.raw.tolist() == [7, 8, 9, 10])
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import numpy as np
+from pymindwave import pyeeg
+
+
+def reference_embed_seq(X, Tau, D):
+    "The loop embed_seq used to be"
+    N = len(X)
+    Y = np.zeros((N - (D - 1) * Tau, D))
+    for i in xrange(0, N - (D - 1) * Tau):
+        for j in xrange(0, D):
+            Y[i][j] = X[i + j * Tau]
+    return Y
+
+def test_embed_seq_is_a_read_only_view():
+    x = np.random.RandomState(0).randn(512)
+    for tau, d in [(1, 4), (2, 3), (4, 1), (3, 10)]:
+        y = pyeeg.embed_seq(x, tau, d)
+        assert (np.array_equal(y, reference_embed_seq(x, tau, d)))
+        assert (np.may_share_memory(y, x))
+        assert (not y.flags.writeable)
+    y = pyeeg.embed_seq(x, 2, 3, copy=True)
+    assert (y.flags.writeable and not np.may_share_memory(y, x))
+    y[0, 0] = 1e9
+    assert (x[0] != 1e9)
+    # lists and integer samples embed as floats, like they used to
+    y = pyeeg.embed_seq(range(0, 9), 2, 3)
+    assert (y.dtype == np.float64)
+    assert (y.tolist() == reference_embed_seq(range(0, 9), 2, 3).tolist())
+
+def test_svd_entropy_from_series():
+    x = np.random.RandomState(1).randn(256)
+    w = np.linalg.svd(reference_embed_seq(x, 2, 5), compute_uv=0)
+    w /= sum(w)
+    assert (np.allclose(pyeeg.svd_entropy(x, 2, 5), pyeeg.svd_entropy(x, 2, 5, w)))
+
+# the loop implementations ap_entropy and samp_entropy replaced
+
+def reference_ap_entropy(X, M, R):
+    N = len(X)
+    Em = pyeeg.embed_seq(X, 1, M)
+    Emp = pyeeg.embed_seq(X, 1, M + 1)
+    Cm, Cmp = np.zeros(N - M + 1), np.zeros(N - M)
+    for i in xrange(0, N - M):
+        for j in xrange(i, N - M):
+            if pyeeg.in_range(Em[i], Em[j], R):
+                Cm[i] += 1
+                Cm[j] += 1
+                if abs(Emp[i][-1] - Emp[j][-1]) <= R:
+                    Cmp[i] += 1
+                    Cmp[j] += 1
+        if pyeeg.in_range(Em[i], Em[N-M], R):
+            Cm[i] += 1
+            Cm[N-M] += 1
+    Cm[N - M] += 1
+    Cm /= (N - M + 1)
+    Cmp /= (N - M)
+    Phi_m, Phi_mp = sum(np.log(Cm)), sum(np.log(Cmp))
+    return (Phi_m - Phi_mp) / (N - M)
+
+def reference_samp_entropy(X, M, R):
+    N = len(X)
+    Em = pyeeg.embed_seq(X, 1, M)
+    Emp = pyeeg.embed_seq(X, 1, M + 1)
+    Cm, Cmp = np.zeros(N - M - 1) + 1e-100, np.zeros(N - M - 1) + 1e-100
+    for i in xrange(0, N - M):
+        for j in xrange(i + 1, N - M):
+            if pyeeg.in_range(Em[i], Em[j], R):
+                Cm[i] += 1
+                if abs(Emp[i][-1] - Emp[j][-1]) <= R:
+                    Cmp[i] += 1
+    return np.log(sum(Cm) / sum(Cmp))
+
+def entropy_inputs():
+    rng = np.random.RandomState(2)
+    noise = rng.randn(300)
+    # quantized samples like the headset's, with many exact ties at R
+    steps = np.round(np.cumsum(rng.randn(300)) * 4) / 4
+    sine = np.sin(np.arange(300) * 0.2)
+    return [(noise, 2, 0.2), (noise, 3, 0.5), (steps, 2, 0.25),
+            (steps, 1, 0.5), (sine, 2, 0.1), (sine[:40], 4, 1e-3)]
+
+def test_ap_entropy_matches_reference():
+    for x, m, r in entropy_inputs():
+        expected = reference_ap_entropy(x, m, r)
+        for method in ('block', 'sorted'):
+            assert (np.allclose(pyeeg.ap_entropy(x, m, r, method), expected,
+                                rtol=1e-12, atol=0))
+
+def test_samp_entropy_matches_reference():
+    for x, m, r in entropy_inputs():
+        expected = reference_samp_entropy(x, m, r)
+        for method in ('block', 'sorted', 'kdtree'):
+            assert (np.allclose(pyeeg.samp_entropy(x, m, r, method), expected,
+                                rtol=1e-12, atol=0))
+
+def test_match_counts_methods_agree():
+    x = np.round(np.random.RandomState(3).randn(5000) * 50)
+    block = pyeeg.match_counts(x, 2, 10.0, len(x) - 2, 'block', 2 ** 16)
+    sort = pyeeg.match_counts(x, 2, 10.0, len(x) - 2, 'sorted')
+    assert (np.array_equal(block[0], sort[0]))
+    assert (np.array_equal(block[1], sort[1]))
+    # the k-d tree counts the same pairs, ties at exactly R included
+    pairs = pyeeg.kdtree_match_pairs(x, 2, 10.0, len(x) - 2)
+    assert (pairs == (block[0].sum() // 2, block[1].sum() // 2))
+    assert (pyeeg.samp_entropy(x, 2, 10.0) ==
+            pyeeg.samp_entropy(x, 2, 10.0, 'block'))
+
+def reference_hfd(X, Kmax):
+    "The loop hfd used to be"
+    L = []
+    x = []
+    N = len(X)
+    for k in xrange(1, Kmax):
+        Lk = []
+        for m in xrange(0, k):
+            Lmk = 0
+            for i in xrange(1, int(np.floor((N - m) / k))):
+                Lmk += abs(X[m + i * k] - X[m + i * k - k])
+            Lmk = Lmk * (N - 1) / np.floor((N - m) / float(k)) / k
+            Lk.append(Lmk)
+        L.append(np.log(np.mean(Lk)))
+        x.append([np.log(float(1) / k), 1])
+    (p, r1, r2, s) = np.linalg.lstsq(x, L, rcond=-1)
+    return p[0]
+
+def test_hfd_matches_reference():
+    rng = np.random.RandomState(4)
+    for n, kmax in [(512, 10), (100, 7), (37, 5), (512, 2)]:
+        x = rng.randn(n)
+        assert (np.allclose(pyeeg.hfd(x, kmax), reference_hfd(x, kmax),
+                            rtol=1e-12, atol=0))
+    # lists of raw samples, as mind_osc.py passes
+    raw = rng.randint(-2048, 2048, 512).tolist()
+    assert (np.allclose(pyeeg.hfd(raw, 10), reference_hfd(raw, 10),
+                        rtol=1e-12, atol=0))
+
+def test_hfd_batch():
+    windows = np.random.RandomState(5).randn(6, 256)
+    windows[1] = np.cumsum(windows[1])
+    batch = pyeeg.hfd_batch(windows, 10)
+    assert (batch.shape == (6,))
+    assert (np.allclose(batch, [reference_hfd(w, 10) for w in windows],
+                        rtol=1e-12, atol=0))
+
+def reference_bin_power(X, Band, Fs):
+    "The loop bin_power used to be, with integer slice indices"
+    C = abs(np.fft.fft(X))
+    Power = np.zeros(len(Band) - 1)
+    for Freq_Index in xrange(0, len(Band) - 1):
+        Freq = float(Band[Freq_Index])
+        Next_Freq = float(Band[Freq_Index + 1])
+        Power[Freq_Index] = sum(C[int(np.floor(Freq / Fs * len(X))):
+                                  int(np.floor(Next_Freq / Fs * len(X)))])
+    Power_Ratio = Power / sum(Power)
+    return Power, Power_Ratio
+
+def test_bin_power_matches_reference():
+    rng = np.random.RandomState(6)
+    cases = [(512, range(50), 512), (1536, range(50), 512),
+             (700, [0.5, 4, 7, 9.5, 12, 21, 30], 512),
+             (513, [0, 100, 256.5], 512),
+             # past Nyquist, and bands that are empty or reversed
+             (128, [10, 300, 400, 400, 200, 512], 512)]
+    for n, band, fs in cases:
+        x = rng.randn(n)
+        power, ratio = pyeeg.bin_power(x, band, fs)
+        expected, expected_ratio = reference_bin_power(x, band, fs)
+        assert (np.allclose(power, expected, rtol=1e-12, atol=1e-12))
+        assert (np.allclose(ratio, expected_ratio, rtol=1e-12, atol=1e-12))
+
+def test_spectral_plans_are_cached():
+    pyeeg.Spectral_Plans.clear()
+    plan = pyeeg.spectral_plan(512, 512, range(50))
+    assert (pyeeg.spectral_plan(512, 512, range(50)) is plan)
+    assert (plan.Real)
+    for n in xrange(pyeeg.Spectral_Plan_Cache_Size):
+        pyeeg.spectral_plan(n + 1, 512, [0, 1])
+        # recently used plans stay
+        pyeeg.spectral_plan(512, 512, range(50))
+    assert (pyeeg.spectral_plan(512, 512, range(50)) is plan)
+    assert (len(pyeeg.Spectral_Plans) == pyeeg.Spectral_Plan_Cache_Size)
+    assert ((1, 512, (0, 1)) not in pyeeg.Spectral_Plans)
+
+def test_spectral_features_of_epochs():
+    epochs = np.random.RandomState(7).randn(10, 512)
+    band = [0.5, 4, 7, 9.5, 12, 21, 30]
+    power, ratio, entropy = pyeeg.spectral_features(epochs, band, 512,
+                                                    Chunk=3)
+    for i, epoch in enumerate(epochs):
+        expected, expected_ratio = pyeeg.bin_power(epoch, band, 512)
+        assert (np.allclose(power[i], expected, rtol=1e-12, atol=0))
+        assert (np.allclose(ratio[i], expected_ratio, rtol=1e-12, atol=0))
+        assert (np.allclose(entropy[i],
+                            pyeeg.spectral_entropy(epoch, band, 512),
+                            rtol=1e-12, atol=0))
+
+def test_spectral_features_of_sliding_windows():
+    x = np.random.RandomState(8).randn(512 * 10 + 100)
+    windows = pyeeg.sliding_windows(x, 512, 128)
+    assert (windows.shape == (37, 512))
+    assert (np.may_share_memory(windows, x))
+    assert (np.array_equal(windows[3], x[384:896]))
+    power, ratio, entropy = pyeeg.spectral_features(x, range(50), 512,
+                                                    Window=512, Hop=128)
+    assert (power.shape == ratio.shape == (37, 49))
+    assert (entropy.shape == (37,))
+    whole = pyeeg.spectral_features(windows.copy(), range(50), 512)
+    assert (np.allclose(power, whole[0], rtol=1e-12, atol=0))
+    assert (np.allclose(pyeeg.bin_power(x[128 * 36:128 * 36 + 512],
+                                        range(50), 512)[0], power[36]))
+    # no overlap by default
+    assert (pyeeg.spectral_features(x, range(50), 512,
+                                    Window=512)[0].shape == (10, 49))
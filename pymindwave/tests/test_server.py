@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import json
+from pymindwave import parser
+from pymindwave import server
+from pymindwave.synthetic import StreamGenerator, make_frame
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.written = []
+        self.aborted = False
+
+    def set_write_buffer_limits(self, high=None):
+        pass
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def get_extra_info(self, name, default=None):
+        return default
+
+    def write(self, data):
+        self.written.append(data)
+
+    def abort(self):
+        self.aborted = True
+
+    def close(self):
+        self.aborted = True
+
+
+def connect(stream_server, *commands):
+    client = server.ClientProtocol(stream_server)
+    client.connection_made(FakeTransport())
+    for command in commands:
+        client.data_received(json.dumps(command) + '\n')
+    return client
+
+def test_stream_server_formats_and_subscriptions():
+    p = parser.VirtualParser()
+    s = server.StreamServer(p, raw_block=256)
+    plain = connect(s)
+    binary = connect(s, {'subscribe': ['raw'], 'unsubscribe': ['waves']},
+                     {'format': 'binary'})
+    bad = connect(s, {'subscribe': ['nope']})
+    assert (json.loads(bad.transport.written[0]) ==
+            {'error': "unknown field u'nope'"})
+
+    gen = StreamGenerator(seed=0)
+    p.feed(gen.state(0xd0) + gen.generate(1.0))
+    lines = [json.loads(line) for line in plain.transport.written]
+    assert (lines[0] == {'state': 'connected'})
+    fields = [field for line in lines for field in line]
+    assert (sorted(fields[1:]) ==
+            ['attention', 'meditation', 'poor_signal', 'waves'])
+    assert (sorted(lines[-1]['waves']) == sorted(server.WAVE_NAMES))
+
+    messages, rest = server.decode_binary(''.join(binary.transport.written))
+    assert (rest == '')
+    raw = [value for field, value in messages if field == 'raw']
+    assert (len(raw) == 2 and len(raw[0][1]) == 256)
+    assert (raw[1][1].tolist() == p.raw_ring.window(256, 512).tolist())
+    assert (abs(raw[1][0] - p.raw_times.window(256, 257)[0]) < 1e-6)
+    assert ('waves' not in [field for field, _ in messages])
+    assert (('state', u'connected') in messages)
+
+def test_stalled_client_is_disconnected():
+    p = parser.VirtualParser()
+    # every attention message is 16 bytes: three fit, the fourth does not
+    s = server.StreamServer(p, max_buffer=48)
+    stalled = connect(s)
+    stalled.pause_writing()
+    for i in range(3):
+        p.feed(make_frame('\x04' + chr(i + 1)))
+    assert (not stalled.transport.aborted and stalled.queued_bytes == 48)
+    p.feed(make_frame('\x04\x04'))
+    assert (stalled.transport.aborted and s.stalled == 1)
+    live = connect(s)
+    live.pause_writing()
+    p.feed(make_frame('\x04\x10'))
+    live.resume_writing()
+    assert (live.transport.written == ['{"attention":16}\n'])
+
+def test_client_stalled_too_long_is_disconnected():
+    p = parser.VirtualParser()
+    s = server.StreamServer(p, stall_timeout=0.5)
+    stalled = connect(s)
+    stalled.pause_writing()
+    p.feed(make_frame('\x04\x01'))
+    assert (not stalled.transport.aborted)
+    stalled.paused_since -= 1.0
+    p.feed(make_frame('\x04\x02'))
+    assert (stalled.transport.aborted and s.stalled == 1)
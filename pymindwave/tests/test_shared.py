@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import os
+import time
+from pymindwave import parser
+from pymindwave import shared
+from pymindwave.synthetic import StreamGenerator, make_frame
+
+
+def test_shared_ring_publish_and_attach():
+    buf = shared.SharedBuffer.create(raw_capacity=8, esense_capacity=4)
+    try:
+        p = parser.VirtualParser()
+        shared.Publisher(p, buf)
+        reader = shared.SharedBuffer.attach(buf.path)
+        p.feed(''.join(make_frame('\x80\x02\x00' + chr(i)) for i in range(6)) +
+               make_frame('\x04\x10\x05\x20') + make_frame('\xd4\x01\x00'))
+        assert (reader.raw.count == reader.raw_times.count == 6)
+        window = reader.raw.latest(4)
+        assert (window.tolist() == [2, 3, 4, 5])
+        assert (not window.flags.writeable)
+        assert (reader.esense.count == 1)
+        record = reader.esense.latest(1)[0]
+        assert (record['attention'] == 0x10 and record['meditation'] == 0x20)
+        assert (record['poor_signal'] == -1 and record['waves'][0] == -1)
+        assert (reader.state == 'standby')
+        assert (reader.writer_pid == os.getpid())
+        assert (not reader.raw.overwritten(0))
+        p.feed(''.join(make_frame('\x80\x02\x01' + chr(i)) for i in range(4)))
+        assert (reader.raw.overwritten(0) and not reader.raw.overwritten(2))
+    finally:
+        buf.unlink()
+
+def test_shared_acquisition_child_process():
+    r, w = os.pipe()
+    acquisition = shared.SharedAcquisition(None, raw_capacity=1024,
+                                           fstream=os.fdopen(r, 'rb', 0))
+    try:
+        acquisition.start()
+        reader = shared.SharedBuffer.attach(acquisition.path)
+        os.write(w, StreamGenerator(seed=0).generate(1.0))
+        deadline = time.time() + 5
+        # the heartbeat follows the samples of the same loop iteration
+        while (reader.raw.count < 512 or not reader.heartbeat) and \
+                time.time() < deadline:
+            time.sleep(0.01)
+        assert (reader.raw.count == 512)
+        assert (reader.writer_pid == acquisition.process.pid)
+        assert (reader.heartbeat > 0)
+    finally:
+        acquisition.destroy()
+        os.close(w)
+    assert (not acquisition.process.is_alive())
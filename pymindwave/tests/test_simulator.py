@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from pymindwave import headset
+from pymindwave import simulator
+
+
+def test_virtual_dongle_protocol():
+    dongles = simulator.spawn(2, speed=4.0, standby_interval=0.05, seed=0)
+    headsets = []
+    try:
+        headsets = [headset.Headset(d.path) for d in dongles]
+        first, second = headsets
+        assert (simulator.wait_for(lambda: first.get_state() == 'standby'))
+        first.connect()
+        assert (simulator.wait_for(lambda: first.get_state() == 'connected'))
+        assert (simulator.wait_for(
+            lambda: first.parser.raw_ring.count > 1024))
+        assert (dongles[0].commands == [b'\xc2'])
+        # the other dongle keeps idling
+        assert (second.get_state() == 'standby')
+        assert (dongles[1].samples_sent == 0)
+
+        first.disconnect()
+        assert (simulator.wait_for(
+            lambda: first.get_state() in ('disconnected', 'standby')))
+        sent = dongles[0].samples_sent
+        assert (simulator.wait_for(lambda: first.get_state() == 'standby'))
+        assert (dongles[0].samples_sent == sent)
+        assert (first.get_stats()['checksum_errors'] == 0)
+    finally:
+        for h in headsets:
+            h.destroy()
+        for d in dongles:
+            d.stop()
+
+
+def test_virtual_dongle_global_id():
+    dongle = simulator.VirtualDongle(global_id=0x1234,
+                                     standby_interval=0.05).start()
+    h = headset.Headset(dongle.path)
+    try:
+        h.dongle_fs.write(b'\xc0\x12\x35')
+        assert (simulator.wait_for(lambda: h.parser.error == 'not found'))
+        h.dongle_fs.write(b'\xc0\x12\x34')
+        assert (simulator.wait_for(lambda: h.get_state() == 'connected'))
+    finally:
+        h.destroy()
+        dongle.stop()
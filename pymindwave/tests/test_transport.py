@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import os
+import socket
+import StringIO
+import threading
+import time
+from pymindwave import transport
+
+
+def test_select_reader_wakes_on_data():
+    r, w = os.pipe()
+    fstream = os.fdopen(r, 'rb', 0)
+    reader = transport.make_reader(fstream)
+    assert (isinstance(reader, transport.SelectReader))
+    reader.chunk_size = 8
+    start = time.time()
+    assert (reader.read() == '')
+    assert (time.time() - start >= reader.timeout * 0.9)
+    os.write(w, '\xaa\xaa\x03\xd4\x01\x00\x2a')
+    start = time.time()
+    assert (reader.read() == '\xaa\xaa\x03\xd4\x01\x00\x2a')
+    assert (time.time() - start < reader.timeout)
+    assert (reader.bytes_read == 7)
+    os.close(w)
+    fstream.close()
+
+def test_select_reader_sees_closed_socket():
+    for latency_budget in (None, 0.01):
+        ours, theirs = socket.socketpair()
+        reader = transport.make_reader(transport.SocketStream(ours),
+                                       latency_budget)
+        theirs.sendall('\xaa\xaa')
+        assert (reader.read() == '\xaa\xaa' and not reader.eof)
+        theirs.close()
+        assert (reader.read() == '' and reader.eof)
+        ours.close()
+
+def test_stream_reader_does_not_sleep():
+    reader = transport.make_reader(StringIO.StringIO('\x00' * 10))
+    assert (type(reader) is transport.StreamReader)
+    assert (reader.read() == '\x00' * 10)
+    start = time.time()
+    assert (reader.read() == '')
+    assert (time.time() - start < 0.01)
+
+def trickle(reader, w, seconds):
+    """Write 8 bytes every 2 ms to ``w`` while reading with ``reader``.
+
+    Returns the bytes read and the number written."""
+    written = []
+
+    def write():
+        end = time.time() + seconds
+        while time.time() < end:
+            written.append(os.write(w, '\x00' * 8))
+            time.sleep(0.002)
+    writer = threading.Thread(target=write)
+    writer.start()
+    data = []
+    while writer.is_alive():
+        data.append(reader.read())
+    writer.join()
+    return ''.join(data), sum(written)
+
+def test_coalescing_reader_reads_less_often():
+    reads = {}
+    for budget in (None, 0.05):
+        r, w = os.pipe()
+        fstream = os.fdopen(r, 'rb', 0)
+        reader = transport.make_reader(fstream, budget)
+        assert (transport.bytes_waiting(fstream, r) == 0)
+        data, written = trickle(reader, w, 1.5)
+        assert (len(data) + transport.bytes_waiting(fstream, r) == written)
+        reads[budget] = reader.latency()
+        os.close(w)
+        fstream.close()
+    assert (isinstance(reader, transport.CoalescingReader))
+    assert (reads[0.05]['reads'] * 4 < reads[None]['reads'])
+    assert (reads[0.05]['chunk_bytes']['p50'] >
+            reads[None]['chunk_bytes']['p50'])
@@ -0,0 +1,68 @@
+"""
+Timestamps for raw samples reconstructed from the 512 Hz sample clock.
+
+The headset samples at a fixed rate but the bytes reach us in chunks whose
+arrival times jitter by tens of milliseconds. Stamping each sample with the
+time it was parsed therefore records read jitter, not acquisition time.
+SampleClock instead puts sample k at ``t0 + k / rate`` and only uses chunk
+arrival times to keep ``t0`` honest:
+
+* a sample cannot have been acquired after the chunk holding it arrived, so
+  an early arrival pulls ``t0`` back immediately;
+* late arrivals nudge ``t0`` forward a little, which follows a headset clock
+  that runs slightly slow;
+* when the newest sample of a chunk arrives much later than the clock
+  predicts, samples were lost on the radio link. The gap is skipped on the
+  sample clock and reported as dropped samples.
+
+Delays on our side (a GC pause, a slow consumer) do not look like drops: the
+OS keeps buffering, so the newest sample of the late chunk is still fresh.
+"""
+import numpy as np
+
+
+class SampleClock(object):
+    """Assigns timestamps to blocks of samples, see the module docstring.
+
+    ``drop_threshold`` is how late (in seconds) the newest sample of a chunk
+    may arrive before the delay is treated as lost samples; ``drift`` is the
+    fraction of a late arrival folded into the clock offset.
+
+    Arrival times must come from stats.clock, which is monotonic on Python
+    3 and on Python 2 under Linux, macOS and Windows (see stats._monotonic).
+    Where it falls back to wall time, setting the system clock forward
+    shows up as dropped samples and setting it back pulls ``t0`` back.
+    """
+
+    def __init__(self, rate=512.0, drop_threshold=0.1, drift=0.01):
+        self.rate = float(rate)
+        self.drop_threshold = drop_threshold
+        self.drift = drift
+        self.t0 = None
+        # position on the sample clock: samples received plus dropped
+        self.index = 0
+        self.dropped = 0
+
+    def stamp(self, n, arrival):
+        """Timestamps for ``n`` samples that arrived together at ``arrival``.
+
+        Returns the timestamps as a float64 array and the number of samples
+        detected as dropped before this block.
+        """
+        last = self.index + n - 1
+        if self.t0 is None:
+            self.t0 = arrival - last / self.rate
+        lag = arrival - (self.t0 + last / self.rate)
+        dropped = 0
+        if lag > self.drop_threshold:
+            dropped = int(round(lag * self.rate))
+            self.index += dropped
+            self.dropped += dropped
+            lag -= dropped / self.rate
+        if lag < 0:
+            self.t0 += lag
+        else:
+            self.t0 += self.drift * lag
+        times = self.t0 + (self.index + np.arange(n)) / self.rate
+        self.index += n
+        return times, dropped
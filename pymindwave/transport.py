@@ -0,0 +1,301 @@
+"""
+Readers that move bytes from the dongle (or any file-like object) into a
+parser.
+
+The parser used to call read(1000) on the serial port and then sleep for
+100 ms, so every chunk waited up to 100 ms before it was parsed. The readers
+here never sleep while data is flowing: SelectReader blocks in select() on
+the serial file descriptor and wakes as soon as bytes arrive, then reads
+everything the OS has buffered. CoalescingReader trades a bounded delay for
+fewer, larger reads. Every reader keeps latency and chunk size histograms so
+the backends can be compared on the same hardware.
+"""
+import os
+import select
+import socket
+import stat
+import struct
+import time
+
+import serial
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    # Windows
+    fcntl = None
+
+from pymindwave.stats import Histogram, clock
+
+# chunk size histogram buckets, in bytes
+CHUNK_BOUNDS = (1, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192,
+                16384)
+
+
+class StreamReader(object):
+    """Plain reader for file-like objects such as StringIO or replay files.
+
+    Returns whatever ``read(chunk_size)`` gives. If ``idle`` is set the
+    reader sleeps that long after a read that returned nothing, which is
+    only useful for streams that cannot be waited on.
+
+    Latency statistics:
+
+    ``interval``
+        time between two reads that returned data
+    ``chunk_age``
+        estimated age of the oldest byte in a chunk when it was read, i.e.
+        chunk size divided by the average byte rate of the stream
+    ``chunk_bytes``
+        size of the chunks read, in bytes
+
+    ``eof`` is set by readers that can tell a closed stream from a quiet
+    one, see SelectReader.
+    """
+
+    def __init__(self, fstream, chunk_size=1000, idle=0.0):
+        self.fstream = fstream
+        self.chunk_size = chunk_size
+        self.idle = idle
+        self.interval = Histogram()
+        self.chunk_age = Histogram()
+        self.chunk_bytes = Histogram(CHUNK_BOUNDS)
+        self.bytes_read = 0
+        self.reads = 0
+        self.first_read_time = None
+        self.last_read_time = None
+        self.eof = False
+
+    def read(self):
+        data = self._read()
+        now = clock()
+        self.reads += 1
+        if data:
+            self._record(len(data), now)
+        elif self.idle:
+            time.sleep(self.idle)
+        return data
+
+    def _read(self):
+        return self.fstream.read(self.chunk_size)
+
+    def _record(self, n, now):
+        if self.first_read_time is None:
+            self.first_read_time = now
+        else:
+            self.interval.record(now - self.last_read_time)
+            elapsed = now - self.first_read_time
+            # the byte rate is only meaningful once a few chunks are in
+            if elapsed > 1.0:
+                self.chunk_age.record(n * elapsed / self.bytes_read)
+        self.last_read_time = now
+        self.bytes_read += n
+        self.chunk_bytes.record(n)
+
+    def byte_rate(self):
+        "Average bytes per second since the first read, None until known"
+        if self.last_read_time is None:
+            return None
+        elapsed = self.last_read_time - self.first_read_time
+        if elapsed < 1.0:
+            return None
+        return self.bytes_read / elapsed
+
+    def latency(self):
+        "Snapshot of the latency histograms as a dict"
+        return {
+            'reads': self.reads,
+            'bytes_read': self.bytes_read,
+            'interval': self.interval.snapshot(),
+            'chunk_age': self.chunk_age.snapshot(),
+            'chunk_bytes': self.chunk_bytes.snapshot(),
+        }
+
+
+class PollingReader(StreamReader):
+    """The original read path: read a fixed chunk, then sleep.
+
+    Kept to compare latencies against SelectReader.
+    """
+
+    def __init__(self, fstream, chunk_size=1000, delay=0.1):
+        super(PollingReader, self).__init__(fstream, chunk_size)
+        self.delay = delay
+
+    def _read(self):
+        data = self.fstream.read(self.chunk_size)
+        time.sleep(self.delay)
+        return data
+
+
+class SelectReader(StreamReader):
+    """Event-driven reader for streams with a file descriptor.
+
+    Blocks in select() for at most ``timeout`` seconds and returns as soon
+    as the descriptor is readable, so a silent dongle costs one wakeup per
+    timeout and a streaming one is read the moment its bytes arrive. The
+    read is sized by pyserial's ``in_waiting`` when available so the whole
+    OS buffer is drained in one call, see read_available(). A descriptor
+    that is readable but gives no data has been closed at the other end
+    (a socket or pipe) and sets ``eof``.
+    """
+
+    def __init__(self, fstream, timeout=0.05, chunk_size=4096):
+        super(SelectReader, self).__init__(fstream, chunk_size)
+        self.fd = fstream.fileno()
+        self.timeout = timeout
+
+    def _read(self):
+        ready, _, _ = select.select([self.fd], [], [], self.timeout)
+        if not ready:
+            return b''
+        return self._check_eof(
+            read_available(self.fstream, self.fd, self.chunk_size))
+
+    def _check_eof(self, data):
+        if not data:
+            # readable but empty: the other end is gone
+            self.eof = True
+        return data
+
+
+class CoalescingReader(SelectReader):
+    """SelectReader that lets bytes pile up for up to ``latency_budget``
+    seconds before reading them.
+
+    A dongle sends about 4.5 kB/s in packets of a few bytes, and the
+    plain SelectReader wakes up for nearly every one of them. This reader
+    still wakes when data arrives, but then asks the OS how much is
+    waiting (``in_waiting``, FIONREAD elsewhere) and, if the oldest
+    waiting byte is younger than the budget at the stream's average byte
+    rate, sleeps for the rest of it and reads everything in one call of at
+    most ``max_chunk`` bytes. A backlog older than the budget is read at
+    once. Fewer wakeups and syscalls per second of EEG, at the cost of up
+    to ``latency_budget`` extra delay; the sizes read show in the
+    ``chunk_bytes`` histogram.
+    """
+
+    def __init__(self, fstream, latency_budget=0.02, timeout=0.05,
+                 max_chunk=16384):
+        super(CoalescingReader, self).__init__(fstream, timeout, max_chunk)
+        self.latency_budget = latency_budget
+
+    def _read(self):
+        ready, _, _ = select.select([self.fd], [], [], self.timeout)
+        if not ready:
+            return b''
+        waiting = bytes_waiting(self.fstream, self.fd)
+        if waiting is None:
+            return self._check_eof(
+                read_available(self.fstream, self.fd, self.chunk_size))
+        delay = self.latency_budget
+        rate = self.byte_rate()
+        if rate:
+            # waiting / rate is about how long the waiting bytes have been
+            # there
+            delay -= waiting / rate
+        if delay > 0.001 and waiting < self.chunk_size:
+            time.sleep(delay)
+            waiting = bytes_waiting(self.fstream, self.fd)
+        size = min(max(waiting, 1), self.chunk_size)
+        if hasattr(self.fstream, 'in_waiting'):
+            return self._check_eof(self.fstream.read(size))
+        return self._check_eof(os.read(self.fd, size))
+
+
+def bytes_waiting(fstream, fd):
+    """Number of bytes the OS has buffered for ``fstream``, None if unknown.
+
+    pyserial's ``in_waiting``, otherwise the FIONREAD ioctl, which works
+    for ttys, pipes and sockets.
+    """
+    try:
+        return fstream.in_waiting
+    except AttributeError:
+        pass
+    if fcntl is None:
+        return None
+    try:
+        result = fcntl.ioctl(fd, termios.FIONREAD, struct.pack('i', 0))
+    except (IOError, OSError):
+        return None
+    return struct.unpack('i', result)[0]
+
+
+def read_available(fstream, fd, chunk_size=4096):
+    """Read what a readable ``fstream`` has buffered without blocking.
+
+    Serial ports are read by pyserial's ``in_waiting``. For anything else a
+    plain read() could block until the whole chunk is there, so os.read()
+    on the descriptor returns what is available.
+    """
+    try:
+        waiting = fstream.in_waiting
+    except AttributeError:
+        return os.read(fd, chunk_size)
+    return fstream.read(waiting or chunk_size)
+
+
+def make_reader(fstream, latency_budget=None):
+    """Pick the best reader for ``fstream``.
+
+    Streams with a usable file descriptor get a SelectReader, or a
+    CoalescingReader when a ``latency_budget`` in seconds is given. Serial ports
+    without one (pyserial on Windows) are polled with a short idle sleep,
+    everything else is read directly.
+    """
+    try:
+        fstream.fileno()
+    except (AttributeError, IOError, OSError, ValueError):
+        pass
+    else:
+        if latency_budget:
+            return CoalescingReader(fstream, latency_budget)
+        return SelectReader(fstream)
+    if hasattr(fstream, 'in_waiting'):
+        return StreamReader(fstream, idle=0.005)
+    return StreamReader(fstream)
+
+
+def open_dongle(dongle_dev, timeout=0.001):
+    """Open a dongle's serial port.
+
+    If ``dongle_dev`` is a Unix socket, e.g. the one of a fan-out daemon
+    (see pymindwave.fanout), connect to it instead; the socket carries the
+    same bytes as the serial port in both directions.
+    """
+    try:
+        is_socket = stat.S_ISSOCK(os.stat(dongle_dev).st_mode)
+    except OSError:
+        is_socket = False
+    if not is_socket:
+        return serial.Serial(dongle_dev, 115200, timeout=timeout)
+    return open_unix_socket(dongle_dev)
+
+
+def open_unix_socket(path):
+    "Connect to a Unix socket and return it as a SocketStream"
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    return SocketStream(sock)
+
+
+class SocketStream(object):
+    """Connected socket with the part of the serial port interface the
+    parser and Headset use"""
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def read(self, size):
+        return self.sock.recv(size)
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+    def close(self):
+        self.sock.close()